@@ -1,47 +1,155 @@
 
 import argparse
 import code
+import contextlib
 import logging
-import telegram
+import sys
+import typing as t
 
-from locale import setlocale, LC_ALL
-from impfbot import model
-from impfbot.logger import TelegramBotLoggingHandler
-from impfbot.main.bot import Impfbot
-from impfbot.main.config import Config
-from impfbot.utils import locale
+from impfbot.utils.profile import StartupProfiler
 
-try:
-  import bpython
-except ImportError:
-  bpython = None
+# NOTE: The bot's modules are imported in main() so that their import time can be profiled
+#   with --profile-startup.
 
+if t.TYPE_CHECKING:
+  import telegram
+  from impfbot.main.config import Config
 
-def setup_telegram_logger(bot: telegram.Bot, chat_id: int, level: int, fmt: str) -> None:
+
+def setup_telegram_logger(bot: 'telegram.Bot', chat_id: int, level: int, fmt: str) -> None:
+  from impfbot.logger import TelegramBotLoggingHandler
+  from impfbot.main import metrics
   handler = TelegramBotLoggingHandler(bot, chat_id, level)
   handler.setFormatter(logging.Formatter(fmt))
   logging.root.addHandler(handler)
+  metrics.telegram_logger_events.labels('dropped').set_function(lambda: handler.dropped)
+  metrics.telegram_logger_events.labels('suppressed').set_function(lambda: handler.suppressed)
+  metrics.telegram_logger_events.labels('failed').set_function(lambda: handler.failed)
+
+
+def setup_tracing(config: 'Config') -> None:
+  from impfbot.utils import trace
+  if not config.trace_exporter:
+    return
+  exporter: trace.ISpanExporter
+  if config.trace_exporter.startswith(('http://', 'https://')):
+    exporter = trace.OtlpHttpExporter(config.trace_exporter)
+  else:
+    exporter = trace.JsonFileExporter(config.trace_exporter)
+  trace.configure(exporter, config.trace_sample_rate)
+
+
+def run_notifier(config: 'Config', shard: int) -> None:
+  import datetime
+  import telegram
+  from impfbot.model import ScopedSession
+  from impfbot.model.default import DefaultNotificationStore, DefaultUserStore
+  from impfbot.polling.notifier import NotificationWorker
+
+  if not 0 <= shard < config.notification_shards:
+    sys.exit(f'error: shard must be in the range [0, {config.notification_shards}) (Config.notification_shards)')
+
+  session = ScopedSession()
+  worker = NotificationWorker(
+    telegram.Bot(config.token),
+    session,
+    DefaultNotificationStore(session),
+    shard,
+    config.notification_shards,
+    batch_size=config.notification_batch_size,
+    lease=datetime.timedelta(seconds=config.notification_lease_in_s),
+    rate_limit=config.notification_rate_limit_per_s / config.notification_shards,
+    users=DefaultUserStore(session),
+  )
+  worker.mainloop()
+
+
+def run_snapshot(export_filename: t.Optional[str], import_filename: t.Optional[str], replace: bool) -> None:
+  from impfbot.model.snapshot import SnapshotError, export_snapshot, import_snapshot
+
+  if export_filename:
+    with open(export_filename, 'wb') as fp:
+      export_snapshot(fp)
+  if import_filename:
+    try:
+      with open(import_filename, 'rb') as fp:
+        import_snapshot(fp, replace=replace)
+    except SnapshotError as exc:
+      sys.exit(f'error: {exc}')
 
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('-i', '--interact', action='store_true', help='Enter an interactive interpreter session.')
+  parser.add_argument('--profile-startup', action='store_true',
+    help='Initialize the bot, print the time spent importing modules and in the startup phases, then exit.')
+  parser.add_argument('--notifier', type=int, metavar='SHARD',
+    help='Run a notification worker for the specified shard instead of the bot (see Config.notification_shards).')
+  parser.add_argument('--export-snapshot', metavar='FILE',
+    help='Write a snapshot of the users, subscriptions, vaccination centers and availability to FILE, then exit.')
+  parser.add_argument('--import-snapshot', metavar='FILE',
+    help='Load a snapshot written with --export-snapshot into the (empty) database, then exit.')
+  parser.add_argument('--replace', action='store_true',
+    help='Replace the existing data in the database with --import-snapshot.')
   args = parser.parse_args()
 
-  config = Config.load('config.yml')
-  setlocale(LC_ALL, config.locale)
+  profiler = StartupProfiler()
+  if args.profile_startup:
+    profiler.install()
+    phase: t.Callable[[str], t.ContextManager[None]] = profiler.phase
+  else:
+    phase = lambda name: contextlib.nullcontext()
+
+  with phase('import modules'):
+    from locale import setlocale, LC_ALL
+    from impfbot import model
+    from impfbot.main.bot import Impfbot
+    from impfbot.main.config import Config
+    from impfbot.utils import geo, locale
 
-  logging.basicConfig(level=logging.INFO, format=config.log_format)
-  model.db.init_database(config.database_spec)
-  locale.load('src/locale/de.yml')
-  bot = Impfbot(config)
+  with phase('load config'):
+    config = Config.load('config.yml')
+    setlocale(LC_ALL, config.locale)
+    logging.basicConfig(level=logging.INFO, format=config.log_format)
+    setup_tracing(config)
+
+  with phase('init database'):
+    model.db.init_database(config.database_spec, config.database_replica_spec)
+
+  if args.notifier is not None:
+    run_notifier(config, args.notifier)
+    return
+
+  if args.export_snapshot or args.import_snapshot:
+    run_snapshot(args.export_snapshot, args.import_snapshot, args.replace)
+    return
+
+  with phase('load locale'):
+    locale.load_all('src/locale', 'de')
+
+  if config.postcodes_file:
+    with phase('load postcodes'):
+      geo.use_postcodes_file(config.postcodes_file)
+
+  with phase('init bot'):
+    bot = Impfbot(config)
+
+  if args.profile_startup:
+    for plugin in bot.poller.plugins:
+      with phase(f'load plugin {plugin.get_id()}'):
+        getattr(plugin, 'load', lambda: None)()
+    profiler.uninstall()
+    print(profiler.report(), file=sys.stderr)
+    return
 
   if args.interact:
     locals_ = {'bot': bot, 'config': config}
-    if bpython:
-      bpython.embed(locals_)
+    try:
+      import bpython  # type: ignore
+    except ImportError:
+      code.interact(local=locals_)
     else:
-      code.interact(locals_)
+      bpython.embed(locals_)
     return
 
   if config.telegram_logger_chat_id is not None:
@@ -0,0 +1,278 @@
+
+"""
+A scraper for booking portals that use the WordPress "Salon Booking" plugin. Sites are described
+declaratively (e.g. in the `salon_sites` of the bot's `config.yml`), so that a new vaccination
+center can be added without code:
+
+```yaml
+salon_sites:
+- id: dachau-med
+  url: https://termin.dachau-med.de/
+  location: Landkreis Dachau
+  latitude: 48.26
+  longitude: 11.434
+  pages:
+  - url: https://termin.dachau-med.de/impfung/
+    vaccine_type: BIONTECH
+    vaccine_round: 0
+```
+
+Every booking page lists one or more shops ("salons"); shops with the same name on the pages of
+a site are combined into one vaccination center. All sites share one HTTP connection pool and
+one thread pool, and the number of concurrent requests to a site is limited by its
+*max_concurrency*. The pages are parsed in the engine's #ParsePool, which can run the parsing in
+separate processes.
+"""
+
+import bs4  # type: ignore
+import concurrent.futures
+import datetime
+import json
+import logging
+import re
+import threading
+import typing as t
+from dataclasses import dataclass, field
+import requests
+from requests.adapters import HTTPAdapter
+
+from impfbot.model.api import AvailabilityInfo, VaccinationCenter, VaccineRound, VaccineType
+from impfbot.polling.api import IPlugin, IVaccinationCenter
+from impfbot.utils.parsepool import ParsePool
+
+logger = logging.getLogger(__name__)
+
+#: Connect and read timeout for all requests to the sites.
+TIMEOUT = (5, 30)
+
+
+@dataclass
+class SalonPage:
+  #: URL of the booking page.
+  url: str
+
+  #: The vaccine that can be booked on the page.
+  vaccine_type: VaccineType
+
+  #: The round of vaccination that can be booked on the page, zero for any.
+  vaccine_round: int = 0
+
+  def get_vaccine_round(self) -> VaccineRound:
+    return VaccineRound(self.vaccine_type, self.vaccine_round)
+
+
+@dataclass
+class SalonSite:
+  #: A unique ID of the site. The IDs of its vaccination centers are derived from it, so it
+  #: must not change after users subscribed to them.
+  id: str
+
+  #: The URL that is shown to users.
+  url: str
+
+  #: The location that is shown to users and that they can search for.
+  location: str
+
+  #: The booking pages of the site.
+  pages: t.List[SalonPage] = field(default_factory=list)
+
+  #: Maximum number of concurrent requests to the site.
+  max_concurrency: int = 2
+
+  #: The coordinates of the site's vaccination centers, for the search by distance.
+  latitude: t.Optional[float] = None
+  longitude: t.Optional[float] = None
+
+
+@dataclass
+class _Salon:
+  site: SalonSite
+  id: str
+  name: str
+  ajax_url: str
+  ajax_nonce: str
+  vaccine_round: VaccineRound
+
+
+def _parse_html(html: str) -> bs4.BeautifulSoup:
+  return bs4.BeautifulSoup(html, features='html.parser')
+
+
+def parse_salons(site: SalonSite, page: SalonPage, html: str) -> t.List[_Salon]:
+  """
+  Parses the shops listed on a booking *page*.
+  """
+
+  soup = _parse_html(html)
+  form = soup.find('form', id='salon-step-attendant')
+  if not form:
+    raise ValueError(f'form#salon-step-attendant not found in {page.url!r}')
+  shop_list = soup.find('div', class_='sln-shop-list')
+  if not shop_list:
+    raise ValueError(f'div.sln-shop-list not found in {page.url!r}')
+  salon_extra = soup.find('script', id='salon-js-extra')
+  if not salon_extra or not salon_extra.string:
+    raise ValueError(f'script#salon-js-extra not found in {page.url!r}')
+  extra_data = json.loads(salon_extra.string.partition('=')[2].strip().rstrip(';'))
+  return [
+    _Salon(site, str(opt.attrs['value']), opt.text.strip(), extra_data['ajax_url'], extra_data['ajax_nonce'],
+      page.get_vaccine_round())
+    for opt in shop_list.find_all('option')
+  ]
+
+
+def parse_availability(text: str) -> AvailabilityInfo:
+  """
+  Parses the response to the request for the booking step of a shop.
+  """
+
+  if 'Keine freien Termine' in text:
+    return AvailabilityInfo(dates=[])
+
+  content = json.loads(text)['content']
+  soup = _parse_html(content)
+  data_node = soup.find(lambda t: 'data-intervals' in t.attrs)
+  if not data_node:
+    logger.error('Unable to find node with data-intervals attribute in page.\n\n%s\n', content)
+    return AvailabilityInfo()
+
+  intervals = json.loads(str(data_node.attrs['data-intervals']))
+  return AvailabilityInfo(dates=[datetime.date.fromisoformat(d) for d in intervals['dates']])
+
+
+class SalonEngine:
+  """
+  Performs the requests for all sites with a shared HTTP connection pool and a shared pool of
+  *pool_size* threads. The requests to every site are limited to the site's *max_concurrency*.
+  The responses are parsed in the *parse_pool*.
+  """
+
+  def __init__(self,
+    pool_size: int = 32,
+    session: t.Optional[requests.Session] = None,
+    parse_pool: t.Optional[ParsePool] = None,
+  ) -> None:
+    if session is None:
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+      session.mount('http://', adapter)
+      session.mount('https://', adapter)
+    self.session = session
+    self.parse_pool = parse_pool or ParsePool()
+    self._executor = concurrent.futures.ThreadPoolExecutor(pool_size, thread_name_prefix='salon')
+    self._lock = threading.Lock()
+    self._semaphores: t.Dict[str, threading.BoundedSemaphore] = {}
+
+  def _semaphore(self, site: SalonSite) -> threading.BoundedSemaphore:
+    with self._lock:
+      if site.id not in self._semaphores:
+        self._semaphores[site.id] = threading.BoundedSemaphore(site.max_concurrency)
+      return self._semaphores[site.id]
+
+  def request(self, site: SalonSite, method: str, url: str, **kwargs: t.Any) -> requests.Response:
+    with self._semaphore(site):
+      response = self.session.request(method, url, timeout=TIMEOUT, **kwargs)
+    response.raise_for_status()
+    return response
+
+  def map(self, func: t.Callable[[t.Any], t.Any], items: t.Iterable[t.Any]) -> t.List['concurrent.futures.Future[t.Any]']:
+    """
+    Calls *func* for every item in the thread pool. Must not be called from the thread pool.
+    """
+
+    return [self._executor.submit(func, item) for item in items]
+
+  def get_salons(self, site: SalonSite, page: SalonPage) -> t.List[_Salon]:
+    return self.parse_pool.run(parse_salons, site, page, self.request(site, 'GET', page.url).text)
+
+  def poll(self, salon: _Salon) -> AvailabilityInfo:
+    response = self.request(salon.site, 'POST', salon.ajax_url, data={
+      'sln[shop]': salon.id,
+      'sln_step_page': 'shop',
+      'submit_shop': 'next',
+      'action': 'salon',
+      'method': 'salonStep',
+      'security': salon.ajax_nonce,
+    })
+    return self.parse_pool.run(parse_availability, response.text)
+
+
+class SalonPlugin(IPlugin):
+  """
+  Provides the vaccination centers of the salon *sites*. If a site can not be discovered, the
+  vaccination centers that were last discovered for it are kept.
+  """
+
+  def __init__(self, sites: t.Sequence[SalonSite], engine: t.Optional[SalonEngine] = None) -> None:
+    self.sites = list(sites)
+    self.engine = engine or SalonEngine()
+    self._last_centers: t.Dict[str, t.List['SalonVaccinationCenter']] = {}
+
+  def get_vaccination_centers(self) -> t.Sequence['IVaccinationCenter']:
+    pages = [(site, page) for site in self.sites for page in site.pages]
+    futures = self.engine.map(lambda item: self.engine.get_salons(*item), pages)
+    salons_by_site: t.Dict[str, t.List[_Salon]] = {}
+    failed: t.Set[str] = set()
+    for (site, page), future in zip(pages, futures):
+      try:
+        salons_by_site.setdefault(site.id, []).extend(future.result())
+      except Exception:
+        logger.exception('Unable to discover the salons of %s at %s', site.id, page.url)
+        failed.add(site.id)
+    # Propagate the error if no site could be discovered, so the poller retries the discovery.
+    if failed and failed.issuperset(site.id for site in self.sites):
+      raise RuntimeError(f'Unable to discover the salons of all {len(self.sites)} site(s)')
+
+    centers: t.List[IVaccinationCenter] = []
+    for site in self.sites:
+      if site.id not in failed:
+        self._last_centers[site.id] = self._group_salons(site, salons_by_site.get(site.id, []))
+      centers += self._last_centers.get(site.id, [])
+    return centers
+
+  def _group_salons(self, site: SalonSite, salons: t.List[_Salon]) -> t.List['SalonVaccinationCenter']:
+    # Some salon names are slightly inconsistent between the pages, so they are grouped by a
+    # canonicalized name.
+    salons_by_name: t.Dict[str, t.List[_Salon]] = {}
+    for salon in salons:
+      name = re.sub(r'[\(\)\s\./]+', '', salon.name).lower()
+      salons_by_name.setdefault(name, []).append(salon)
+    return [
+      SalonVaccinationCenter(
+        id=f'{site.id}:{name}',
+        name=max((x.name for x in group), key=len),  # Pick the one with the longest name
+        site=site,
+        salons=group,
+        engine=self.engine,
+      )
+      for name, group in salons_by_name.items()
+    ]
+
+
+@dataclass
+class SalonVaccinationCenter(IVaccinationCenter):
+
+  id: str
+  name: str
+  site: SalonSite
+  salons: t.List[_Salon]
+  engine: SalonEngine
+
+  def get_metadata(self) -> VaccinationCenter:
+    # TODO(NiklasRosenstein): We need to provide different URLs for the different vaccine rounds.
+    return VaccinationCenter(self.id, self.name, self.site.url, self.site.location, self.site.latitude,
+      self.site.longitude)
+
+  def check_availability(self) -> t.Dict[VaccineRound, AvailabilityInfo]:
+    result = {}
+    error: t.Optional[Exception] = None
+    for salon, future in zip(self.salons, self.engine.map(self.engine.poll, self.salons)):
+      try:
+        result[salon.vaccine_round] = future.result()
+      except Exception as exc:
+        logger.warning('Unable to poll salon %s of %s: %s', salon.id, self.site.id, exc)
+        error = exc
+    # Propagate the error if no salon could be polled, so the caller sees the remote failing.
+    if error and not result:
+      raise error
+    return result
@@ -0,0 +1,127 @@
+
+import datetime
+import json
+import threading
+import time
+import typing as t
+import urllib.parse
+from unittest import TestCase
+import requests
+from requests.adapters import BaseAdapter
+
+from impfbot.model.api import AvailabilityInfo, VaccineRound, VaccineType
+from impfbot.utils.parsepool import ParsePool
+from .salon import SalonEngine, SalonPage, SalonPlugin, SalonSite
+
+PAGE = '''
+<form id="salon-step-attendant"></form>
+<div class="sln-shop-list"><select>
+  <option value="1">Impfzentrum (Nord)</option>
+  <option value="2">Praxis Süd</option>
+</select></div>
+<script id="salon-js-extra">var salon = {"ajax_url": "https://%s/wp-admin/admin-ajax.php", "ajax_nonce": "nonce"};</script>
+'''
+
+
+class _FakeSalonAdapter(BaseAdapter):
+  """
+  Serves the booking pages of all hosts and records the highest number of concurrent requests
+  per host.
+  """
+
+  def __init__(self, latency: float = 0.0) -> None:
+    super().__init__()
+    self.latency = latency
+    self.dates: t.Dict[str, t.List[str]] = {'1': ['2021-11-22'], '2': []}
+    self.failing_hosts: t.Set[str] = set()
+    self.max_concurrency: t.Dict[str, int] = {}
+    self._concurrency: t.Dict[str, int] = {}
+    self._lock = threading.Lock()
+
+  def send(self, request: requests.PreparedRequest, *args: t.Any, **kwargs: t.Any) -> requests.Response:  # type: ignore[override]
+    host = urllib.parse.urlparse(request.url or '').netloc
+    with self._lock:
+      self._concurrency[host] = self._concurrency.get(host, 0) + 1
+      self.max_concurrency[host] = max(self.max_concurrency.get(host, 0), self._concurrency[host])
+    try:
+      time.sleep(self.latency)
+      response = requests.Response()
+      response.request = request
+      response.url = request.url or ''
+      response.encoding = 'utf8'
+      response.status_code = 500 if host in self.failing_hosts else 200
+      if request.method == 'GET':
+        body = PAGE % host
+      else:
+        shop = urllib.parse.parse_qs(t.cast(str, request.body))['sln[shop]'][0]
+        if self.dates[shop]:
+          body = json.dumps({'content': f"<div data-intervals='{json.dumps({'dates': self.dates[shop]})}'></div>"})
+        else:
+          body = 'Keine freien Termine'
+      response._content = body.encode('utf8')
+      return response
+    finally:
+      with self._lock:
+        self._concurrency[host] -= 1
+
+  def close(self) -> None:
+    pass
+
+
+def _site(host: str, max_concurrency: int = 2) -> SalonSite:
+  return SalonSite(host, f'https://{host}/', 'Vaccheim', [
+    SalonPage(f'https://{host}/impfung01/', VaccineType.BIONTECH, 1),
+    SalonPage(f'https://{host}/impfung02/', VaccineType.BIONTECH, 2),
+  ], max_concurrency)
+
+
+class SalonPluginTest(TestCase):
+
+  def setUp(self) -> None:
+    self.adapter = _FakeSalonAdapter()
+    self.session = requests.Session()
+    self.session.mount('https://', self.adapter)
+    self.engine = SalonEngine(pool_size=16, session=self.session)
+
+  def test_discover_and_poll(self) -> None:
+    plugin = SalonPlugin([_site('a.vacc')], self.engine)
+    centers = {c.get_metadata().id: c for c in plugin.get_vaccination_centers()}
+    assert centers.keys() == {'a.vacc:impfzentrumnord', 'a.vacc:praxissüd'}
+    assert centers['a.vacc:impfzentrumnord'].get_metadata().name == 'Impfzentrum (Nord)'
+    assert centers['a.vacc:impfzentrumnord'].check_availability() == {
+      VaccineRound(VaccineType.BIONTECH, 1): AvailabilityInfo([datetime.date(2021, 11, 22)]),
+      VaccineRound(VaccineType.BIONTECH, 2): AvailabilityInfo([datetime.date(2021, 11, 22)]),
+    }
+    assert centers['a.vacc:praxissüd'].check_availability() == {
+      VaccineRound(VaccineType.BIONTECH, 1): AvailabilityInfo([]),
+      VaccineRound(VaccineType.BIONTECH, 2): AvailabilityInfo([]),
+    }
+
+  def test_parse_in_processes(self) -> None:
+    parsed: t.List[str] = []
+    pool = ParsePool(2, lambda name, wait, duration: parsed.append(name))
+    self.addCleanup(pool.shutdown)
+    plugin = SalonPlugin([_site('a.vacc')], SalonEngine(pool_size=4, session=self.session, parse_pool=pool))
+    centers = {c.get_metadata().id: c for c in plugin.get_vaccination_centers()}
+    assert centers['a.vacc:impfzentrumnord'].check_availability()[VaccineRound(VaccineType.BIONTECH, 1)] == \
+      AvailabilityInfo([datetime.date(2021, 11, 22)])
+    assert sorted(parsed) == ['parse_availability'] * 2 + ['parse_salons'] * 2
+
+  def test_keeps_centers_of_failing_site(self) -> None:
+    plugin = SalonPlugin([_site('a.vacc'), _site('b.vacc')], self.engine)
+    assert len(plugin.get_vaccination_centers()) == 4
+    self.adapter.failing_hosts.add('b.vacc')
+    assert len(plugin.get_vaccination_centers()) == 4
+
+  def test_per_site_concurrency(self) -> None:
+    self.adapter.latency = 0.02
+    sites = [_site(f'{i}.vacc', max_concurrency=1 + i % 2) for i in range(10)]
+    for site in sites:
+      site.pages *= 3
+    plugin = SalonPlugin(sites, self.engine)
+    started = time.perf_counter()
+    assert len(plugin.get_vaccination_centers()) == 20
+    # 60 requests, at most 16 at a time.
+    assert time.perf_counter() - started < 60 * 0.02 / 2
+    assert all(self.adapter.max_concurrency[site.id] <= site.max_concurrency for site in sites)
+    assert max(self.adapter.max_concurrency.values()) == 2
@@ -1,36 +1,184 @@
 
-import atexit
+import collections
+import datetime
 import html
 import logging
-import queue
+import sys
 import threading
+import time
+import traceback
 import typing as t
-from telegram import Bot, ParseMode
+from telegram import Bot, ParseMode, TelegramError
+from telegram.error import RetryAfter
+
+_Key = t.Tuple[str, int, str, int, str, t.Optional[int]]
 
 
 class TelegramBotLoggingHandler(logging.Handler):
   """
-  A handler class which dispatches log events to a Telegram chat. Dispatches messages in a
-  separate thread to avoid blocking the caller thread.
+  A handler class which dispatches log events to a Telegram chat. Records are buffered and sent
+  in batches from a separate thread every *flush_interval*, so emitting a record never blocks the
+  caller thread.
+
+  * Records that repeat within *dedupe_window* (same logger, level, call site, message and
+    traceback) are sent only once and reported with a repeat count instead.
+  * If the buffer holds *capacity* records, further records are dropped. The number of dropped
+    records is reported with the next batch.
+  * At most *max_messages_per_flush* messages of up to #MAX_MESSAGE_LENGTH characters are sent
+    per batch, at most one every *min_send_interval*. The remaining records are summarized.
+  * Errors when sending a message are counted and written to stderr. The dispatcher thread keeps
+    running.
   """
 
-  def __init__(self, bot: Bot, chat_id: int, level: int = logging.NOTSET) -> None:
+  MAX_MESSAGE_LENGTH = 4096
+
+  def __init__(self,
+    bot: Bot,
+    chat_id: int,
+    level: int = logging.NOTSET,
+    capacity: int = 1024,
+    flush_interval: datetime.timedelta = datetime.timedelta(seconds=10),
+    min_send_interval: datetime.timedelta = datetime.timedelta(seconds=1),
+    max_messages_per_flush: int = 5,
+    dedupe_window: datetime.timedelta = datetime.timedelta(minutes=10),
+  ) -> None:
+
     super().__init__(level)
     self.bot = bot
     self.chat_id = chat_id
-    self.queue: 'queue.Queue[t.Optional[logging.LogRecord]]' = queue.Queue(1024)
-    threading.Thread(target=self._dispatcher).start()
-    atexit.register(lambda: self.queue.put(None))
+    self.capacity = capacity
+    self.flush_interval = flush_interval.total_seconds()
+    self.min_send_interval = min_send_interval.total_seconds()
+    self.max_messages_per_flush = max_messages_per_flush
+    self.dedupe_window = dedupe_window.total_seconds()
+
+    #: Number of records that were dropped because the buffer was full.
+    self.dropped = 0
+    #: Number of records that were not sent because they repeated an earlier record.
+    self.suppressed = 0
+    #: Number of messages that could not be sent.
+    self.failed = 0
+
+    self._cond = threading.Condition()
+    self._buffer: t.List[t.Tuple[_Key, str]] = []
+    self._last_sent: t.Dict[_Key, float] = {}
+    self._repeats: t.Dict[_Key, int] = collections.Counter()
+    self._dropped_unreported = 0
+    self._closed = False
+    self._thread = threading.Thread(target=self._dispatcher, daemon=True)
+    self._thread.start()
+
+  @staticmethod
+  def _key(record: logging.LogRecord) -> _Key:
+    tb_hash = None
+    if record.exc_info and record.exc_info[0]:
+      frames = traceback.extract_tb(record.exc_info[2])
+      tb_hash = hash((record.exc_info[0].__name__,) + tuple((f.filename, f.lineno) for f in frames))
+    return (record.name, record.levelno, record.pathname, record.lineno, record.getMessage(), tb_hash)
+
+  def emit(self, record: logging.LogRecord) -> None:
+    key = self._key(record)
+    with self._cond:
+      if self._closed:
+        return
+      if len(self._buffer) >= self.capacity:
+        self.dropped += 1
+        self._dropped_unreported += 1
+        return
+      last_sent = self._last_sent.get(key)
+      if last_sent is not None and time.monotonic() - last_sent < self.dedupe_window:
+        self.suppressed += 1
+        self._repeats[key] += 1
+        return
+      # Mark the key as sent right away so that repetitions within the same batch are counted.
+      self._last_sent[key] = time.monotonic()
+    try:
+      text = self.format(record)
+    except Exception:
+      self.handleError(record)
+      return
+    with self._cond:
+      self._buffer.append((key, text))
+
+  def flush(self) -> None:
+    with self._cond:
+      self._cond.notify()
+
+  def close(self) -> None:
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._thread.join(self.flush_interval)
+    super().close()
 
   def _dispatcher(self) -> None:
     while True:
-      record = self.queue.get()
-      if not record:
+      with self._cond:
+        if not self._closed:
+          self._cond.wait(self.flush_interval)
+        closed = self._closed
+        batch, self._buffer = self._buffer, []
+        repeats, self._repeats = self._repeats, collections.Counter()
+        dropped, self._dropped_unreported = self._dropped_unreported, 0
+        now = time.monotonic()
+        for key in [k for k, v in self._last_sent.items() if now - v >= self.dedupe_window]:
+          del self._last_sent[key]
+      try:
+        self._send_batch(batch, repeats, dropped)
+      except Exception as exc:
+        print(f'{type(self).__name__}: unable to send batch: {exc}', file=sys.stderr)
+      if closed:
         break
-      self.bot.send_message(
-        chat_id=self.chat_id,
-        text=f'<code>{html.escape(self.format(record))}</code>',
-        parse_mode=ParseMode.HTML)
 
-  def emit(self, record: logging.LogRecord) -> None:
-    self.queue.put_nowait(record)
+  def _send_batch(self, batch: t.List[t.Tuple[_Key, str]], repeats: t.Dict[_Key, int], dropped: int) -> None:
+    entries = []
+    for key, text in batch:
+      if repeats.get(key):
+        text += f'\n(repeated {repeats.pop(key)} more time(s))'
+      entries.append(f'<code>{self._truncate(html.escape(text))}</code>')
+    if repeats:
+      entries.append(f'<i>{sum(repeats.values())} more repetition(s) of earlier log records.</i>')
+    if dropped:
+      entries.append(f'<i>{dropped} log record(s) were dropped.</i>')
+
+    messages = self._join_messages(entries)
+    if len(messages) > self.max_messages_per_flush:
+      omitted = len(messages) - self.max_messages_per_flush + 1
+      messages = messages[:self.max_messages_per_flush - 1]
+      messages.append(f'<i>{omitted} more message(s) with log records were omitted.</i>')
+
+    for index, message in enumerate(messages):
+      if index > 0:
+        time.sleep(self.min_send_interval)
+      self._send(message)
+
+  def _truncate(self, text: str) -> str:
+    limit = self.MAX_MESSAGE_LENGTH - 32
+    if len(text) <= limit:
+      return text
+    text = text[:limit]
+    # Don't cut an HTML entity in half.
+    if text.rfind('&') > text.rfind(';'):
+      text = text[:text.rfind('&')]
+    return text + '\n...'
+
+  def _join_messages(self, entries: t.List[str]) -> t.List[str]:
+    messages: t.List[str] = []
+    for entry in entries:
+      if messages and len(messages[-1]) + 1 + len(entry) <= self.MAX_MESSAGE_LENGTH:
+        messages[-1] += '\n' + entry
+      else:
+        messages.append(entry)
+    return messages
+
+  def _send(self, text: str) -> None:
+    for _attempt in range(2):
+      try:
+        self.bot.send_message(chat_id=self.chat_id, text=text, parse_mode=ParseMode.HTML)
+        return
+      except RetryAfter as exc:
+        time.sleep(exc.retry_after)
+      except TelegramError as exc:
+        print(f'{type(self).__name__}: unable to send message: {exc}', file=sys.stderr)
+        break
+    self.failed += 1
@@ -0,0 +1,72 @@
+
+import datetime
+import logging
+import threading
+import typing as t
+from unittest import TestCase
+from telegram import Bot
+
+from .logger import TelegramBotLoggingHandler
+from .utils.fakebot import FakeCall, FakeTelegramRequest
+
+
+class TelegramBotLoggingHandlerTest(TestCase):
+
+  def setUp(self) -> None:
+    self.request = FakeTelegramRequest()
+    self.handler = TelegramBotLoggingHandler(Bot('123456:fake', request=self.request), 42, capacity=3,
+      flush_interval=datetime.timedelta(hours=1), min_send_interval=datetime.timedelta(0))
+    self.logger = logging.Logger('test')
+    self.logger.addHandler(self.handler)
+
+  def _flush(self) -> None:
+    self.handler.close()
+
+  @property
+  def messages(self) -> t.List[str]:
+    return [m['text'] for m in self.request.messages.get(42, [])]
+
+  def test_batches_and_dedupes_records(self) -> None:
+    for _ in range(5):
+      self.logger.error('Failed attempt at %s', 'abc')
+    self.logger.warning('Something else')
+    self._flush()
+    assert len(self.messages) == 1
+    assert 'Failed attempt at abc\n(repeated 4 more time(s))' in self.messages[0]
+    assert 'Something else' in self.messages[0]
+    assert self.handler.suppressed == 4
+
+  def test_does_not_dedupe_different_messages(self) -> None:
+    for center_id in ['abc', 'xyz']:
+      self.logger.error('Failed attempt at %s', center_id)
+    self._flush()
+    assert 'Failed attempt at abc' in self.messages[0] and 'Failed attempt at xyz' in self.messages[0]
+    assert self.handler.suppressed == 0
+
+  def test_drops_records_on_overflow(self) -> None:
+    self.logger.error('Record 1')
+    self.logger.error('Record 2')
+    self.logger.error('Record 3')
+    self.logger.error('Record 4')
+    self.logger.error('Record 5')
+    self._flush()
+    assert self.handler.dropped == 2
+    assert '2 log record(s) were dropped' in self.messages[0]
+
+  def test_survives_send_errors(self) -> None:
+    failed = threading.Event()
+
+    def _on_call(call: FakeCall) -> None:
+      if call.error:
+        failed.set()
+
+    self.request.listeners.append(_on_call)
+    self.request.blocked_chat_ids.add(42)
+    self.logger.error('Lost')
+    self.handler.flush()
+    assert failed.wait(5)
+    self.request.blocked_chat_ids.clear()
+    self.logger.warning('Delivered')
+    self._flush()
+    assert self.handler.failed == 1
+    assert len(self.messages) == 1 and 'Delivered' in self.messages[0]
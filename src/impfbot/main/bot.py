@@ -1,25 +1,36 @@
 
 import cachetools
+import contextlib
 import datetime
+import functools
 import logging
+import math
 import threading
 import typing as t
 import uuid
 from prometheus_client import start_http_server  # type: ignore
-from telegram import Update, ParseMode, TelegramError
-from telegram.ext import CallbackContext, CommandHandler, Updater, CallbackQueryHandler
+from telegram import Bot, Update, ParseMode, TelegramError
+from telegram.ext import CallbackContext, CommandHandler, Filters, MessageHandler, Updater, CallbackQueryHandler
 from telegram.message import Message
-from nr.stream import Stream
 
 from impfbot import __version__
+from impfbot.contrib.salon import SalonEngine, SalonPlugin
 from impfbot.model import ScopedSession, User
 from impfbot.model.api import AvailabilityInfo
-from impfbot.model.default import DefaultAvailabilityStore, DefaultUserStore
+from impfbot.model.default import DefaultAvailabilityStore, DefaultNotificationStore, DefaultUserStore
 from impfbot.polling.api import IPlugin
+from impfbot.polling.breaker import CircuitBreakerRegistry
 from impfbot.polling.default import DefaultPoller
-from impfbot.polling.telegram import TelegramAvailabilityDispatcher, TelegramAvailabilityRecorder
+from impfbot.polling.diff import AvailabilityDiffer
+from impfbot.polling.render import AvailabilityItem, AvailabilityRenderCache
+from impfbot.polling.scheduler import AdaptiveScheduler
+from impfbot.polling.telegram import TelegramAvailabilityDispatcher, TelegramAvailabilityRecorder, is_chat_unreachable
 from impfbot.utils.locale import get as _
-from impfbot.utils import tgui
+from impfbot.utils import locale, tgui
+from impfbot.utils.cache import LocalCache, create_cache
+from impfbot.utils.parsepool import ParsePool
+from impfbot.utils.ratelimit import RateLimiter, RequestGuard, SharedRateLimiter
+from impfbot.utils.workqueue import WorkQueue, WorkQueueFull
 from .config import Config
 from .sub import SubscriptionManager
 from . import metrics
@@ -29,15 +40,58 @@ logger = logging.getLogger(__name__)
 
 class Impfbot:
 
-  def __init__(self, config: Config) -> None:
+  def __init__(self, config: Config, bot: t.Optional[Bot] = None) -> None:
     self.session = ScopedSession()
     self.config = config
-    self.telegram_updater = Updater(config.token)
+    self.telegram_updater = Updater(bot=bot) if bot else Updater(config.token)
     self.bot = self.telegram_updater.bot
-    self.poller = DefaultPoller(datetime.timedelta(seconds=config.check_period_in_s))
-    self.poller.plugins += IPlugin.load_plugins()
     self.availability_store = DefaultAvailabilityStore(self.session, datetime.timedelta(hours=config.retention_period_in_h))
-    self.user_store = DefaultUserStore(self.session)
+    self.user_store = DefaultUserStore(self.session, self.availability_store)
+    self.notification_store = DefaultNotificationStore(self.session)
+    self.cache = create_cache(config.cache_url)
+
+    # Separate worker pools so that broadcasts and notification fan-outs don't delay the responses
+    # to interactive commands. The Telegram dispatcher thread only hands updates off to them.
+    self.interactive_queue = WorkQueue('interactive', config.interactive_workers, config.work_queue_maxsize,
+      metrics.observe_work_queue_wait)
+    self.notification_queue = WorkQueue('notifications', config.notification_workers, 0,
+      metrics.observe_work_queue_wait)
+    self.background_queue = WorkQueue('background', config.background_workers, config.work_queue_maxsize,
+      metrics.observe_work_queue_wait)
+    for wq in (self.interactive_queue, self.notification_queue, self.background_queue):
+      metrics.publish_work_queue(wq)
+
+    self.poller = DefaultPoller(
+      datetime.timedelta(seconds=config.check_period_in_s),
+      AdaptiveScheduler(
+        datetime.timedelta(seconds=config.check_period_in_s),
+        datetime.timedelta(seconds=config.check_period_min_in_s),
+        datetime.timedelta(seconds=config.check_period_max_in_s),
+        jitter=config.check_period_jitter,
+        night_hours=(config.check_period_night_start_h, config.check_period_night_end_h),
+        night_factor=config.check_period_night_factor,
+        priority=self._get_subscriber_count,
+        on_interval_changed=metrics.set_poll_interval,
+      ),
+      datetime.timedelta(seconds=config.discovery_period_in_s),
+      CircuitBreakerRegistry(
+        failure_threshold=config.breaker_failure_threshold,
+        backoff=datetime.timedelta(seconds=config.breaker_backoff_in_s),
+        max_backoff=datetime.timedelta(seconds=config.breaker_max_backoff_in_s),
+        on_state_changed=metrics.set_circuit_breaker_state,
+        timeout=datetime.timedelta(seconds=config.breaker_call_timeout_in_s),
+      ),
+      datetime.timedelta(seconds=config.discovery_retry_interval_in_s),
+      self.cache,
+      config.poll_concurrency,
+    )
+    self.parse_pool = ParsePool(config.parse_processes, metrics.observe_parse)
+    metrics.parse_pool_pending.set_function(lambda: self.parse_pool.pending)
+    self.salon_engine = SalonEngine(config.salon_pool_size, parse_pool=self.parse_pool)
+    self.poller.plugins += IPlugin.load_plugins(on_loaded=self._configure_plugin)
+    if config.salon_sites:
+      self.poller.plugins.append(SalonPlugin(config.salon_sites, self.salon_engine))
+    self.render_cache = AvailabilityRenderCache(cache=self.cache)
     self.poller.receivers.append(
       TelegramAvailabilityRecorder(
         self.session,
@@ -46,51 +100,138 @@ class Impfbot:
           self.telegram_updater.bot,
           self.session,
           self.availability_store,
-          self.user_store
-        )
+          self.user_store,
+          datetime.timedelta(seconds=config.notification_coalesce_window_in_s),
+          self.render_cache,
+          self.notification_queue,
+          self.notification_store if config.notification_shards else None,
+        ),
+        AvailabilityDiffer(datetime.timedelta(seconds=config.notification_hysteresis_in_s)),
       )
     )
-    self.subs = SubscriptionManager(self.availability_store, self.user_store)
-    self.tgui_action_store = tgui.DefaultActionStore(cachetools.TTLCache(2**16, ttl=3600 * 24))
+    self.subs = SubscriptionManager(self.availability_store, self.user_store, self.cache, config.center_picker_page_size)
+    # Actions hold callbacks and can not be shared with other instances. This is fine as long as
+    # only one instance receives the updates from Telegram (which long polling enforces).
+    self.tgui_action_cache = LocalCache(2**16)
+    self.tgui_action_store = tgui.DefaultActionStore(self.tgui_action_cache, ttl=3600 * 24)
+    rate = config.command_rate_limit_per_minute / 60
+    if config.cache_url:
+      limiter: RateLimiter = SharedRateLimiter(rate, config.command_rate_limit_burst, self.cache)
+    else:
+      limiter = RateLimiter(rate, config.command_rate_limit_burst)
+    self.request_guard = RequestGuard(limiter)
     self.init_commands()
 
+    # The metrics and the poll priorities tolerate stale data and are read from the replica.
     @metrics.users_num_registered.set_function
     def _user_count() -> int:
-      with self.session:
+      with self.session.read_only():
         return self.user_store.get_user_count(False)
 
+    @metrics.users_num_blocked.set_function
+    def _user_blocked_count() -> int:
+      with self.session.read_only():
+        return self.user_store.get_blocked_user_count()
+
     @metrics.users_num_subscribed.set_function
     def _user_subscribed_count() -> int:
-      with self.session:
+      with self.session.read_only():
         return self.user_store.get_user_count(True)
 
-    metrics.tgui_action_cache_size.set_function(lambda: len(self.tgui_action_store._cache))
+    if config.notification_shards:
+      for state in ('pending', 'claimed', 'sent', 'failed'):
+        metrics.notifications_queued.labels(state).set_function(
+          functools.partial(self._get_notification_count, state))
+
+    metrics.tgui_action_cache_size.set_function(lambda: len(self.tgui_action_cache))
+
+    self.poller.receivers.append(metrics.AvailabilityMetrics(
+      datetime.timedelta(hours=config.retention_period_in_h), config.availability_metrics_aggregate_only))
+    self.poller.receivers.append(self.render_cache)
+    metrics.render_cache_requests.labels('hit').set_function(lambda: self.render_cache.hits)
+    metrics.render_cache_requests.labels('miss').set_function(lambda: self.render_cache.misses)
 
-    availability_metrics = metrics.AvailabilityMetrics(self.session, self.availability_store)
-    availability_metrics.publish_all()
-    self.poller.receivers.append(availability_metrics)
+  def _configure_plugin(self, plugin: IPlugin) -> None:
+    # Salon plugins share the bot's HTTP connection pool and parse pool.
+    if isinstance(plugin, SalonPlugin):
+      plugin.engine = self.salon_engine
 
-  def add_command(self, name: str, handler_func: t.Callable) -> None:
-    def wrapper(*args, **kwargs):
-      with self.session:
-        return handler_func(*args, **kwargs)
+  def _get_subscriber_count(self, vaccination_center_id: str) -> int:
+    with self.session.read_only():
+      return self.user_store.get_subscriber_count(vaccination_center_id)
+
+  @cachetools.cached(cachetools.TTLCache(1, ttl=5), lock=threading.Lock())
+  def _get_notification_counts(self) -> t.Dict[str, int]:
+    with self.session.read_only():
+      return self.notification_store.get_notification_counts()
+
+  def _get_notification_count(self, state: str) -> int:
+    return self._get_notification_counts()[state]
+
+  def _reject_request(self, update: Update, command: str, reason: str) -> None:
+    metrics.commands_throttled.labels(command, reason).inc()
+    if update.callback_query:
+      if reason == RequestGuard.RATE_LIMITED:
+        update.callback_query.answer(_('conversation.throttled'))
+      else:
+        update.callback_query.answer()
+    elif update.message and update.effective_user and reason == RequestGuard.RATE_LIMITED \
+        and self.request_guard.should_notify(update.effective_user.id):
+      update.message.reply_text(_('conversation.throttled'))
+
+  def _enqueue(self, wq: WorkQueue, update: Update, command: str, request: t.Hashable, func: t.Callable[[], None]) -> None:
+    """
+    Checks the request against the #request_guard and submits *func* to the work queue. The
+    request counts as in flight until *func* returns.
+    """
+
+    user_id = update.effective_user.id if update.effective_user else None
+    language_code = update.effective_user.language_code if update.effective_user else None
+    stack = contextlib.ExitStack()
+    rejected = stack.enter_context(self.request_guard.enter(user_id, request))
+    if rejected:
+      stack.close()
+      self._reject_request(update, command, rejected)
+      return
+
+    def job() -> None:
+      with stack, self.session, locale.use(locale.get_locale(language_code)):
+        func()
+
+    try:
+      wq.submit(job)
+    except WorkQueueFull:
+      stack.close()
+      metrics.work_queue_rejected.labels(wq.name).inc()
+      logger.warning('Dropping %s of user %s because work queue %r is full.', command, user_id, wq.name)
+
+  def add_command(self, name: str, handler_func: t.Callable, wq: t.Optional[WorkQueue] = None) -> None:
+    def wrapper(update: Update, context: CallbackContext) -> None:
+      # Only identical commands are coalesced, e.g. not two /broadcast with different messages.
+      request = update.message.text if update.message and update.message.text else name
+      self._enqueue(wq or self.interactive_queue, update, '/' + name, request, lambda: handler_func(update, context))
     self.telegram_updater.dispatcher.add_handler(CommandHandler(name, wrapper))
 
   def init_commands(self) -> None:
     self.add_command('start', self._command_start)
     self.add_command('einstellungen', self._command_config)
     self.add_command('termine', self._command_availability)
+    self.add_command('umkreis', self._command_area)
     self.add_command('info', self._command_info)
-    self.add_command('adm', self._command_admin)
-    self.add_command('broadcast', self._command_broadcast)
-    self.add_command('broadcast4real', self._command_broadcast)
+    self.add_command('adm', self._command_admin, self.background_queue)
+    self.add_command('broadcast', self._command_broadcast, self.background_queue)
+    self.add_command('broadcast4real', self._command_broadcast, self.background_queue)
     self.telegram_updater.dispatcher.add_handler(CallbackQueryHandler(self._callback_query_handler))
+    self.telegram_updater.dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, self._message_handler))
 
   def mainloop(self) -> None:
     start_http_server(self.config.metrics_port, self.config.metrics_host)
     threading.Thread(target=self.poller.mainloop, daemon=True).start()
     self.telegram_updater.start_polling()
     self.telegram_updater.idle()
+    for wq in (self.interactive_queue, self.notification_queue, self.background_queue):
+      wq.shutdown(cancel_futures=wq is not self.notification_queue)
+    self.parse_pool.shutdown()
 
   def _register_user_from_message(self, message: Message) -> User:
     assert message.from_user
@@ -113,6 +254,23 @@ class Impfbot:
     ctx = tgui.DefaultContext(self.tgui_action_store, update)
     self.subs.get_root_view(ctx.user_id()).respond(ctx)
 
+  def _command_area(self, update: Update, context: CallbackContext) -> None:
+    metrics.commands_executed.labels('/umkreis').inc()
+    if not update.message: return
+    args = context.args or []
+    try:
+      postcode = args[0]
+      radius_km = float(args[1].replace(',', '.')) if len(args) > 1 else self.config.default_area_radius_km
+    except (IndexError, ValueError):
+      update.message.reply_text(_('subscriptions.dialog.area.usage'))
+      return
+    if not math.isfinite(radius_km) or radius_km <= 0:
+      update.message.reply_text(_('subscriptions.dialog.area.usage'))
+      return
+    self._register_user_from_message(update.message)
+    ctx = tgui.DefaultContext(self.tgui_action_store, update)
+    self.subs.set_area(ctx.user_id(), postcode, radius_km).respond(ctx)
+
   def _command_info(self, update: Update, context: CallbackContext) -> None:
     metrics.commands_executed.labels('/info').inc()
     if not update.message: return
@@ -123,36 +281,47 @@ class Impfbot:
     metrics.commands_executed.labels('/termine').inc()
     if not update.message or not update.message.from_user: return
     user_id = update.message.from_user.id
-    subscription = self.user_store.get_subscription(user_id)
+    # Stale data is fine for the reply, so it is read from the replica.
+    availability: t.List[AvailabilityItem] = []
+    with self.session.read_only():
+      subscription = self.user_store.get_subscription(user_id)
+      if subscription and not subscription.is_partial():
+        availability = self.render_cache.get_relevant_availability_for_user(user_id, subscription,
+          lambda: self.user_store.get_relevant_availability_for_user(user_id))
     if not subscription:
       update.message.reply_text(_('subscriptions.dialog.main.not_subscribed'))
       return
     if subscription.is_partial():
       update.message.reply_text(_('subscriptions.dialog.main.partial_subscription_warning'))
       return
-    availability = self.user_store.get_relevant_availability_for_user(user_id)
-    lines = []
-    for vaccine_round, values in Stream(availability).groupby(lambda t: t[1]):
-      lines.append(f'<b>{vaccine_round.to_text()}</b>')
-      for vcenter, vaccine_round, data in values:
-        dates = ', '.join(d.strftime('%Y-%m-%d') for d in data.dates)
-        lines.append(f'• <a href="{vcenter.url}">{vcenter.name}</a>: {dates}')
-      lines.append('')
-    if lines:
-      lines.insert(0, '')
-      lines.insert(0, _('conversation.summary_header'))
+    if availability:
+      message = _('conversation.summary_header') + '\n\n' + \
+        self.render_cache.format_availability_summary_html(availability)
     else:
-      lines.append(_('conversation.no_availability'))
-      if self.poller.last_poll:
-        date = self.poller.last_poll.strftime(_('format.date'))
-        time = self.poller.last_poll.strftime(_('format.time'))
-        lines[-1] += ' ' + _('conversation.last_checked_on', date=date, time=time)
-    update.message.reply_html('\n'.join(lines))
+      message = _('conversation.no_availability')
+      last_poll = self.poller.get_last_poll()
+      if last_poll:
+        date = last_poll.strftime(_('format.date'))
+        time = last_poll.strftime(_('format.time'))
+        message += ' ' + _('conversation.last_checked_on', date=date, time=time)
+    update.message.reply_html(message)
 
   def _callback_query_handler(self, update: Update, context: CallbackContext) -> None:
-    with self.session:
-      ctx = tgui.DefaultContext(self.tgui_action_store, update)
-      tgui.dispatch(ctx)
+    assert update.callback_query
+    self._enqueue(self.interactive_queue, update, 'callback_query', update.callback_query.data,
+      lambda: tgui.dispatch(tgui.DefaultContext(self.tgui_action_store, update)))
+
+  def _message_handler(self, update: Update, context: CallbackContext) -> None:
+    if not update.message or not update.message.text: return
+    self._enqueue(self.interactive_queue, update, 'message', update.message.text,
+      lambda: self._handle_message(update))
+
+  def _handle_message(self, update: Update) -> None:
+    assert update.message and update.message.text
+    ctx = tgui.DefaultContext(self.tgui_action_store, update)
+    view = self.subs.handle_message(ctx.user_id(), update.message.text)
+    if view:
+      view.respond(ctx)
 
   def _command_admin(self, update: Update, context: CallbackContext) -> None:
     if not update.message or not update.message.from_user: return
@@ -192,15 +361,22 @@ class Impfbot:
       return
 
     if for_real:
-      chat_ids = [x.chat_id for x in self.user_store.get_users()]
+      recipients = [(x.id, x.chat_id) for x in self.user_store.get_users()]
     else:
-      chat_ids = [update.message.chat_id]
+      recipients = [(update.message.from_user.id, update.message.chat_id)]
 
-    for chat_id in chat_ids:
+    unreachable = []
+    for user_id, chat_id in recipients:
       try:
         self.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN)
         if not for_real:
           self.bot.send_message(chat_id=chat_id, text=f'Use {prefix_4_real} to actually send '
             f'the message to {self.user_store.get_user_count(False)} users.')
-      except TelegramError:
-        logger.exception('Could not send message to chat_id %s', chat_id)
+      except TelegramError as exc:
+        if is_chat_unreachable(exc):
+          unreachable.append(user_id)
+        else:
+          logger.exception('Could not send message to chat_id %s', chat_id)
+    if unreachable:
+      logger.info('Marking %d user(s) as blocked after broadcast.', len(unreachable))
+      self.user_store.mark_users_blocked(unreachable)
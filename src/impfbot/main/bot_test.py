@@ -0,0 +1,34 @@
+
+import os
+import tempfile
+from unittest import TestCase
+from telegram import Bot
+
+from impfbot.contrib.salon import SalonPlugin
+from impfbot.model import db
+from impfbot.polling.api import IPlugin, _LazyPlugin, importlib_metadata
+from impfbot.utils.fakebot import FakeTelegramRequest
+from .bot import Impfbot
+from .config import Config
+
+
+class ImpfbotTest(TestCase):
+
+  def setUp(self) -> None:
+    tempdir = tempfile.TemporaryDirectory()
+    self.addCleanup(tempdir.cleanup)
+    db.init_database('sqlite:///' + os.path.join(tempdir.name, 'bot.db'))
+    assert db.engine
+    self.addCleanup(db.engine.dispose)
+    config = Config(token='123456:fake')
+    self.bot = Impfbot(config, Bot(config.token, request=FakeTelegramRequest()))
+    for wq in (self.bot.interactive_queue, self.bot.notification_queue, self.bot.background_queue):
+      self.addCleanup(wq.shutdown)
+
+  def test_entry_point_plugins_share_the_salon_engine(self) -> None:
+    entry_point = importlib_metadata.EntryPoint(
+      'dachau', 'impfbot.contrib.de.bavaria.dachau:DachauMedPlugin', IPlugin.ENTRYPOINT_GROUP)
+    plugin = _LazyPlugin(entry_point, self.bot._configure_plugin).load()
+    assert isinstance(plugin, SalonPlugin)
+    assert plugin.engine is self.bot.salon_engine
+    assert plugin.engine.parse_pool is self.bot.parse_pool
@@ -3,6 +3,8 @@ from dataclasses import dataclass, field
 import databind.yaml as yaml
 import typing as t
 
+from impfbot.contrib.salon import SalonSite
+
 
 @dataclass
 class Config:
@@ -19,13 +21,143 @@ class Config:
   #: SqlAlchemy connect URL.
   database_spec: str = 'sqlite+pysqlite:///data/impfbot.db'
 
-  #: Number of seconds between polling for updates from plugins.
+  #: SqlAlchemy connect URL of a read replica of the database. Reads that tolerate stale data
+  #: (`/termine`, the subscribers of a vaccination center and the metrics) use it if set.
+  database_replica_spec: t.Optional[str] = None
+
+  #: Number of seconds between polling for the availability of a vaccination center. This is the
+  #: initial poll interval of every vaccination center, which is then adapted to how often its
+  #: availability changes within the bounds below.
   check_period_in_s: int = 20 * 60  # 20 minutes
 
+  #: Lower bound for the poll interval of a vaccination center.
+  check_period_min_in_s: int = 5 * 60  # 5 minutes
+
+  #: Upper bound for the poll interval of a vaccination center. Must stay below the
+  #: #retention_period_in_h (including jitter), otherwise centers expire between polls.
+  check_period_max_in_s: int = 45 * 60  # 45 minutes
+
+  #: Number of seconds between retrieving the list of vaccination centers from the plugins.
+  discovery_period_in_s: int = 6 * 60 * 60  # 6 hours
+
+  #: Number of seconds after which an incomplete discovery (a plugin failed) is retried.
+  discovery_retry_interval_in_s: int = 60
+
+  #: Number of vaccination centers that are polled at the same time.
+  poll_concurrency: int = 8
+
+  #: Booking portals that use the WordPress "Salon Booking" plugin. They are polled by the
+  #: #impfbot.contrib.salon engine in addition to the installed plugins.
+  salon_sites: t.List[SalonSite] = field(default_factory=list)
+
+  #: Number of HTTP connections and threads shared by all #salon_sites and salon plugins.
+  salon_pool_size: int = 32
+
+  #: Number of processes to parse the pages of the polled sites in. With zero, pages are parsed in
+  #: the polling threads, which compete with the Telegram commands for the GIL.
+  parse_processes: int = 0
+
+  #: Random variation of the poll interval as a fraction of the interval.
+  check_period_jitter: float = 0.1
+
+  #: Hour of the day at which the poll interval starts to be multiplied by
+  #: #check_period_night_factor.
+  check_period_night_start_h: int = 0
+
+  #: Hour of the day at which the poll interval stops being multiplied by
+  #: #check_period_night_factor.
+  check_period_night_end_h: int = 6
+
+  #: Factor to apply to the poll interval during the night hours.
+  check_period_night_factor: float = 3.0
+
+  #: Number of consecutive failures after which a plugin or remote host is no longer polled.
+  breaker_failure_threshold: int = 3
+
+  #: Number of seconds to wait before polling a failing plugin or remote host again. Doubles
+  #: with every failed attempt up to #breaker_max_backoff_in_s.
+  breaker_backoff_in_s: int = 60
+
+  #: Upper bound for the #breaker_backoff_in_s.
+  breaker_max_backoff_in_s: int = 60 * 60  # 1 hour
+
+  #: Number of seconds after which a call to a plugin or remote host counts as failed. Plugins
+  #: should still set timeouts on their requests, as a call that hangs can not be interrupted.
+  breaker_call_timeout_in_s: int = 2 * 60  # 2 minutes
+
   #: Number of hours to keep vaccination centers and their availability stored in the database.
   #: If there was no update within this period, the data is ignored/removd.
   retention_period_in_h: int = 1  # 1 hour
 
+  #: Number of seconds for which a date that disappeared from the availability of a vaccination
+  #: center is not reported again when it reappears. Suppresses notifications for flapping dates.
+  notification_hysteresis_in_s: int = 60 * 60  # 1 hour
+
+  #: Number of seconds to collect availability changes for a user before they are sent as a
+  #: single message. Pending changes are sent at the end of the first poll cycle after this
+  #: period, so a value of zero sends one message per user and poll cycle.
+  notification_coalesce_window_in_s: int = 0
+
+  #: Radius in kilometers of the area around a postcode that the `/umkreis` command subscribes
+  #: to if the user does not specify one.
+  default_area_radius_km: float = 10.0
+
+  #: A table of postcodes and their coordinates for the `/umkreis` command, as a CSV file or a
+  #: GeoNames postcode export (see #geo.load_postcodes()). The table that ships with the package
+  #: only covers the region around Munich.
+  postcodes_file: t.Optional[str] = None
+
+  #: Number of vaccination centers per page of the center picker in the `/einstellungen`.
+  center_picker_page_size: int = 10
+
+  #: Number of notification worker processes (`python -m impfbot --notifier SHARD`, with SHARD
+  #: from zero to this value minus one). If set, the bot only queues notifications in the
+  #: database and the workers send them. Every worker sends the notifications of the users whose
+  #: ID modulo this value is the worker's shard.
+  notification_shards: int = 0
+
+  #: Number of messages per second that all notification workers together may send.
+  notification_rate_limit_per_s: float = 25.0
+
+  #: Number of notifications that a notification worker claims at once.
+  notification_batch_size: int = 100
+
+  #: Number of seconds after which notifications claimed by a worker that did not send them can
+  #: be claimed by another worker.
+  notification_lease_in_s: int = 5 * 60  # 5 minutes
+
+  #: URL of a Redis compatible server (`redis://[:password@]host[:port][/db]`) that holds the
+  #: state shared between multiple instances of the bot (rate limits, rendered messages and the
+  #: time of the last poll). Without a URL, that state is kept in the process.
+  cache_url: t.Optional[str] = None
+
+  #: Number of commands and button clicks per minute that a user can send on average.
+  command_rate_limit_per_minute: int = 20
+
+  #: Number of commands and button clicks that a user can send in short succession.
+  command_rate_limit_burst: int = 5
+
+  #: Number of threads that process commands and button clicks of users.
+  interactive_workers: int = 4
+
+  #: Number of threads that send availability notifications.
+  notification_workers: int = 2
+
+  #: Number of threads that process admin commands and broadcasts.
+  background_workers: int = 1
+
+  #: Maximum number of jobs that can wait in each of the work queues above. Commands that
+  #: exceed the limit are dropped.
+  work_queue_maxsize: int = 1000
+
+  #: Where to export traces to: an `http(s)://` URL of an OTLP/HTTP collector endpoint (e.g.
+  #: `http://localhost:4318/v1/traces`) or the name of a file to append JSON lines to. Tracing is
+  #: disabled if not set.
+  trace_exporter: t.Optional[str] = None
+
+  #: Fraction of the polls of a vaccination center that are traced.
+  trace_sample_rate: float = 0.01
+
   #: Logging format.
   log_format: str = '[%(asctime)s - %(levelname)s - %(name)s]: %(message)s'
 
@@ -44,6 +176,10 @@ class Config:
   #: Host for the Prometheus metrics.
   metrics_host: str = 'localhost'
 
+  #: Export only the sums of the available dates over all vaccination centers instead of one
+  #: series per center, to keep the Prometheus metrics small with many centers.
+  availability_metrics_aggregate_only: bool = False
+
   @classmethod
   def load(cls, filename: str) -> 'Config':
     with open(filename) as fp:
@@ -0,0 +1,216 @@
+
+"""
+Runs the bot against the #FakeTelegramRequest and reports latencies and throughput.
+
+    $ python -m impfbot.main.loadtest --users 1000 --events 20 --latency 0.05
+
+First every user sends `/termine` (the command latency is the time until the bot replied),
+then *events* times a new date becomes available at one of the vaccination centers (the
+notification latency is the time from polling the center until the message was sent to a
+subscribed user).
+"""
+
+import argparse
+import dataclasses
+import datetime
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import typing as t
+from telegram import Bot
+
+from impfbot.model import db, AvailabilityInfo, Subscription, User, VaccinationCenter, VaccineRound, VaccineType
+from impfbot.polling.api import IPlugin, IVaccinationCenter
+from impfbot.utils import locale
+from impfbot.utils.fakebot import FakeCall, FakeTelegramRequest
+from .bot import Impfbot
+from .config import Config
+
+LOCALE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'locale')
+VACCINE_ROUND = VaccineRound(VaccineType.BIONTECH, 1)
+
+
+class _Center(IVaccinationCenter):
+
+  def __init__(self, vcenter: VaccinationCenter) -> None:
+    self.vcenter = vcenter
+    self.dates: t.List[datetime.date] = []
+
+  def get_metadata(self) -> VaccinationCenter:
+    return self.vcenter
+
+  def check_availability(self) -> t.Dict[VaccineRound, AvailabilityInfo]:
+    return {VACCINE_ROUND: AvailabilityInfo(dates=list(self.dates))}
+
+
+class _Plugin(IPlugin):
+
+  def __init__(self, centers: t.List[_Center]) -> None:
+    self.centers = centers
+
+  def get_vaccination_centers(self) -> t.Sequence[IVaccinationCenter]:
+    return self.centers
+
+
+def percentile(values: t.Sequence[float], p: float) -> float:
+  if not values:
+    return float('nan')
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+@dataclasses.dataclass
+class LoadTestResult:
+  command_latencies: t.List[float] = dataclasses.field(default_factory=list)
+  notification_latencies: t.List[float] = dataclasses.field(default_factory=list)
+  errors: t.Dict[str, int] = dataclasses.field(default_factory=dict)
+  messages_sent: int = 0
+  duration: float = 0.0
+
+  def report(self) -> str:
+    lines = []
+    for name, values in [('commands', self.command_latencies), ('notifications', self.notification_latencies)]:
+      lines.append(f'{name:14} n={len(values):<7} p50={percentile(values, 50) * 1000:9.1f}ms  '
+        f'p99={percentile(values, 99) * 1000:9.1f}ms')
+    lines.append(f'messages sent: {self.messages_sent} in {self.duration:.2f}s '
+      f'({self.messages_sent / self.duration if self.duration else 0:.1f} msgs/s)')
+    if self.errors:
+      lines.append('errors: ' + ', '.join(f'{k}={v}' for k, v in sorted(self.errors.items())))
+    return '\n'.join(lines)
+
+
+def run(
+  num_users: int,
+  num_events: int,
+  num_centers: int = 10,
+  subscriptions_per_user: int = 3,
+  request: t.Optional[FakeTelegramRequest] = None,
+  config: t.Optional[Config] = None,
+  database_spec: t.Optional[str] = None,
+  timeout: float = 600.0,
+  seed: int = 0,
+) -> LoadTestResult:
+  """
+  Runs the load test. By default, the database is a temporary SQLite file (an in-memory database
+  can not be shared between the bot's threads).
+  """
+
+  rnd = random.Random(seed)
+  request = request or FakeTelegramRequest(seed=seed)
+  config = config or Config(
+    token='123456:fake',
+    command_rate_limit_per_minute=10**6,
+    command_rate_limit_burst=10**6,
+    work_queue_maxsize=0,
+  )
+  result = LoadTestResult()
+
+  with tempfile.TemporaryDirectory() as tempdir:
+    db.init_database(database_spec or 'sqlite:///' + os.path.join(tempdir, 'loadtest.db'))
+    locale.load_all(LOCALE_DIR, 'de')
+    bot = Impfbot(config, Bot(config.token, request=request))
+    centers = [_Center(VaccinationCenter(f'center-{i}', f'Center {i}', f'https://example.org/{i}', 'Testheim'))
+      for i in range(num_centers)]
+    bot.poller.plugins[:] = [_Plugin(centers)]
+    bot.poller.discover()
+
+    with bot.session:
+      for user_id in range(1, num_users + 1):
+        bot.user_store.register_user(User(user_id, user_id, f'User {user_id}'))
+        bot.user_store.subscribe_user(user_id, Subscription(
+          vaccine_rounds=[VACCINE_ROUND],
+          vaccination_center_ids=[c.vcenter.id for c in rnd.sample(centers, min(subscriptions_per_user, num_centers))]))
+
+    lock = threading.Lock()
+    done = threading.Condition(lock)
+    command_sent: t.Dict[int, float] = {}
+    event_started: t.Dict[str, float] = {}
+
+    def _on_call(call: FakeCall) -> None:
+      finished = call.started + call.duration
+      with done:
+        if call.error:
+          result.errors[call.error] = result.errors.get(call.error, 0) + 1
+          chat_id = call.data.get('chat_id')
+          if chat_id is not None:
+            command_sent.pop(int(chat_id), None)
+        elif call.method == 'sendMessage':
+          result.messages_sent += 1
+          chat_id = int(call.data['chat_id'])
+          if chat_id in command_sent:
+            result.command_latencies.append(finished - command_sent.pop(chat_id))
+          else:
+            dates = re.findall(r'\d{4}-\d{2}-\d{2}', str(call.data.get('text', '')))
+            starts = [event_started[d] for d in dates if d in event_started]
+            if starts:
+              result.notification_latencies.append(finished - min(starts))
+        done.notify_all()
+
+    request.listeners.append(_on_call)
+    bot.telegram_updater.start_polling(poll_interval=0, timeout=1)
+    started = time.perf_counter()
+    try:
+      with done:
+        for user_id in range(1, num_users + 1):
+          command_sent[user_id] = time.perf_counter()
+          request.push_command(user_id, '/termine')
+        done.wait_for(lambda: not command_sent, timeout)
+
+      first_date = datetime.date.today() + datetime.timedelta(days=1)
+      for i in range(num_events):
+        center = rnd.choice(centers)
+        date = first_date + datetime.timedelta(days=i)
+        center.dates.append(date)
+        with done:
+          event_started[date.strftime('%Y-%m-%d')] = time.perf_counter()
+        bot.poller.poll_centers([center.vcenter.id])
+
+      # The recipients are only known to the dispatcher (users that turn out to be blocked are
+      # pruned during the run), so wait for it to send everything it queued.
+      bot.notification_queue.join(timeout)
+    finally:
+      result.duration = time.perf_counter() - started
+      bot.telegram_updater.stop()
+      request.stop()
+      for wq in (bot.interactive_queue, bot.notification_queue, bot.background_queue):
+        wq.shutdown(cancel_futures=True)
+      assert db.engine
+      db.engine.dispose()
+
+  return result
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--users', type=int, default=1000, help='Number of users.')
+  parser.add_argument('--events', type=int, default=20, help='Number of availability events.')
+  parser.add_argument('--centers', type=int, default=10, help='Number of vaccination centers.')
+  parser.add_argument('--subscriptions', type=int, default=3, help='Number of centers every user subscribes to.')
+  parser.add_argument('--latency', type=float, default=0.05, help='Latency of the fake Bot API in seconds.')
+  parser.add_argument('--latency-jitter', type=float, default=0.02, help='Random additional latency in seconds.')
+  parser.add_argument('--retry-after-rate', type=float, default=0.0, help='Fraction of calls that fail with RetryAfter.')
+  parser.add_argument('--blocked', type=float, default=0.0, help='Fraction of users that blocked the bot.')
+  parser.add_argument('--database', help='SqlAlchemy connect URL (default: a temporary SQLite file).')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.WARNING)
+  rnd = random.Random(args.seed)
+  request = FakeTelegramRequest(
+    latency=args.latency,
+    latency_jitter=args.latency_jitter,
+    retry_after_rate=args.retry_after_rate,
+    blocked_chat_ids=[u for u in range(1, args.users + 1) if rnd.random() < args.blocked],
+    seed=args.seed,
+  )
+  result = run(args.users, args.events, args.centers, args.subscriptions, request,
+    database_spec=args.database, seed=args.seed)
+  print(result.report())
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,21 @@
+
+from unittest import TestCase
+
+from impfbot.utils.fakebot import FakeTelegramRequest
+from . import loadtest
+
+
+class LoadTestTest(TestCase):
+
+  def test_run(self) -> None:
+    request = FakeTelegramRequest(blocked_chat_ids={3})
+    result = loadtest.run(5, 3, num_centers=1, subscriptions_per_user=1, request=request)
+    assert len(result.command_latencies) == 4
+    assert len(result.notification_latencies) == 3 * 4
+    # The reply to /termine and the first notification fail; once the first notification failed,
+    # user 3 is marked as blocked and not notified anymore (an event that was dispatched before
+    # that happened may still address the user).
+    sent_to_blocked = [c for c in request.calls if c.method == 'sendMessage' and c.data['chat_id'] == 3]
+    assert 2 <= len(sent_to_blocked) <= 4
+    assert result.errors == {'Unauthorized': len(sent_to_blocked)}
+    assert 3 not in request.messages
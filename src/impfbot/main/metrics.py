@@ -1,33 +1,129 @@
 
-from prometheus_client import Counter, Gauge  # type: ignore
+import datetime
+import threading
+import time
+import typing as t
+from prometheus_client import Counter, Gauge, Histogram  # type: ignore
 from impfbot import polling
 from impfbot import model
-from impfbot.model.db import ISessionProvider
+from impfbot.utils.workqueue import WorkQueue
 
 users_num_registered = Gauge('users_num_registered', 'Number of users registered.')
 users_num_subscribed = Gauge('users_num_subscribed', 'Number of users with active subscriptions.')
+users_num_blocked = Gauge('users_num_blocked',
+  'Number of users that blocked the bot or deleted the chat and are excluded from notifications.')
 commands_executed = Counter('commands_executed', 'Number of commands executed', ['command'])
+commands_throttled = Counter('commands_throttled', 'Number of commands and callback queries that were rejected',
+  ['command', 'reason'])
+poll_interval_seconds = Gauge('poll_interval_seconds', 'Effective poll interval per vaccination center.',
+  ['vaccination_center_id'])
+circuit_breaker_state = Gauge('circuit_breaker_state',
+  'State of the circuit breaker for a plugin or remote host (0 = closed, 1 = half-open, 2 = open).', ['name'])
+render_cache_requests = Gauge('render_cache_requests', 'Number of requests to the availability render cache.',
+  ['result'])
+work_queue_depth = Gauge('work_queue_depth', 'Number of jobs waiting in a work queue.', ['queue'])
+work_queue_active = Gauge('work_queue_active', 'Number of jobs being processed by the workers of a work queue.',
+  ['queue'])
+work_queue_wait_seconds = Histogram('work_queue_wait_seconds', 'Time jobs spent waiting in a work queue.', ['queue'],
+  buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+work_queue_rejected = Counter('work_queue_rejected', 'Number of jobs rejected because a work queue was full.',
+  ['queue'])
+parse_wait_seconds = Histogram('parse_wait_seconds', 'Time parse jobs waited for a process of the parse pool.',
+  ['function'], buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+parse_seconds = Histogram('parse_seconds', 'Time spent running parse jobs.', ['function'],
+  buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+parse_pool_pending = Gauge('parse_pool_pending', 'Number of parse jobs waiting for or running in the parse pool.')
+notifications_queued = Gauge('notifications_queued',
+  'Number of notifications in the notification queue by state (pending, claimed, sent, failed).', ['state'])
 tgui_action_cache_size = Gauge('tgui_action_cache_size', 'Size of the tgui action cache.')
+telegram_logger_events = Gauge('telegram_logger_events',
+  'Log records dropped or suppressed and messages that failed to send by the Telegram logger.', ['kind'])
 number_of_dates_with_available_vaccination_appointments = Gauge(
-  'number_of_dates_with_available_vaccination_appointments', '',
-  ['vaccine_type', 'vaccine_round', 'vaccination_center_id', 'vaccination_center_name',
-   'vaccination_center_location'])
+  'number_of_dates_with_available_vaccination_appointments', 'Number of dates with available appointments per '
+  'vaccination center. The name and location of the center are in vaccination_center_info.',
+  ['vaccine_type', 'vaccine_round', 'vaccination_center_id'])
+vaccination_center_info = Gauge('vaccination_center_info', 'The name and location of a vaccination center.',
+  ['vaccination_center_id', 'vaccination_center_name', 'vaccination_center_location'])
+available_vaccination_appointment_dates = Gauge('available_vaccination_appointment_dates',
+  'Sum of the number of dates with available appointments over all vaccination centers.',
+  ['vaccine_type', 'vaccine_round'])
+availability_metrics_series = Gauge('availability_metrics_series',
+  'Number of series exported for the availability of vaccination centers.')
+
+
+def set_poll_interval(center_id: str, seconds: t.Optional[float]) -> None:
+  if seconds is None:
+    try:
+      poll_interval_seconds.remove(center_id)
+    except KeyError:
+      pass
+  else:
+    poll_interval_seconds.labels(center_id).set(seconds)
+
+
+def set_circuit_breaker_state(name: str, state: polling.BreakerState) -> None:
+  circuit_breaker_state.labels(name).set(state.value)
+
+
+def observe_work_queue_wait(queue: str, seconds: float) -> None:
+  work_queue_wait_seconds.labels(queue).observe(seconds)
+
+
+def observe_parse(function: str, wait: float, duration: float) -> None:
+  parse_wait_seconds.labels(function).observe(wait)
+  parse_seconds.labels(function).observe(duration)
+
+
+def publish_work_queue(wq: WorkQueue) -> None:
+  work_queue_depth.labels(wq.name).set_function(lambda: wq.depth)
+  work_queue_active.labels(wq.name).set_function(lambda: wq.active)
+
+
+class _CenterSeries:
+
+  def __init__(self) -> None:
+    self.info: t.Optional[t.Tuple[str, str, str]] = None
+    self.dates: t.Dict[t.Tuple[str, str], int] = {}
+    self.last_seen = 0.0
+
+
+def _remove(gauge: Gauge, *labels: str) -> None:
+  try:
+    gauge.remove(*labels)
+  except KeyError:
+    pass
 
 
 class AvailabilityMetrics(polling.IDataReceiver):
   """
-  Populates the :data:`number_of_dates_with_available_vaccination_appointments` metric.
+  Populates the availability metrics from the polled data. The series of a vaccination center are
+  removed when it was not polled for *ttl*.
+
+  In *aggregate_only* mode, only the sums over all centers are exported (one series per vaccine
+  round), otherwise also one series per vaccine round and center and one `_info` series per
+  center.
   """
 
-  def __init__(self, session: ISessionProvider, avail: model.IAvailabilityStore) -> None:
-    self.session = session
-    self.avail = avail
+  def __init__(self,
+    ttl: datetime.timedelta,
+    aggregate_only: bool = False,
+    clock: t.Callable[[], float] = time.monotonic,
+  ) -> None:
+    self.ttl = ttl
+    self.aggregate_only = aggregate_only
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._centers: t.Dict[str, _CenterSeries] = {}
+    # The sum and the number of centers for every vaccine round.
+    self._totals: t.Dict[t.Tuple[str, str], t.List[int]] = {}
+    availability_metrics_series.set_function(lambda: self.series_count)
 
-  def publish_all(self) -> None:
-    with self.session:
-      for center in self.avail.search_vaccination_centers(None):
-        for vaccine_round, data in self.avail.get_per_vaccine_round_availability(center.id):
-          self._publish_metrics(center, vaccine_round, data)
+  @property
+  def series_count(self) -> int:
+    count = len(self._totals)
+    if not self.aggregate_only:
+      count += sum(len(series.dates) + (series.info is not None) for series in self._centers.values())
+    return count
 
   def on_availability_info_ready(self,
     center: polling.IVaccinationCenter,
@@ -36,13 +132,41 @@ class AvailabilityMetrics(polling.IDataReceiver):
   ) -> None:
 
     vcenter = center.get_metadata()
-    self._publish_metrics(vcenter, vaccine_round, data)
+    key = (vaccine_round.type.name, str(vaccine_round.round))
+    with self._lock:
+      series = self._centers.setdefault(vcenter.id, _CenterSeries())
+      series.last_seen = self._clock()
+      info = (vcenter.id, vcenter.name, vcenter.location)
+      if not self.aggregate_only and series.info != info:
+        if series.info:
+          _remove(vaccination_center_info, *series.info)
+        vaccination_center_info.labels(*info).set(1)
+      series.info = info
+      if not self.aggregate_only:
+        number_of_dates_with_available_vaccination_appointments.labels(*key, vcenter.id).set(len(data.dates))
+      self._add_total(key, len(data.dates) - series.dates.get(key, 0), key not in series.dates)
+      series.dates[key] = len(data.dates)
 
-  def _publish_metrics(self,
-    center: model.VaccinationCenter,
-    vaccine_round: model.VaccineRound,
-    data: model.AvailabilityInfo
-  ) -> None:
+  def end_polling(self) -> None:
+    expired_before = self._clock() - self.ttl.total_seconds()
+    with self._lock:
+      for center_id, series in list(self._centers.items()):
+        if series.last_seen >= expired_before:
+          continue
+        del self._centers[center_id]
+        if series.info and not self.aggregate_only:
+          _remove(vaccination_center_info, *series.info)
+        for key, count in series.dates.items():
+          if not self.aggregate_only:
+            _remove(number_of_dates_with_available_vaccination_appointments, *key, center_id)
+          self._add_total(key, -count, -1)
 
-    number_of_dates_with_available_vaccination_appointments.labels(
-      vaccine_round.type.name, vaccine_round.round, center.id, center.name, center.location).set(len(data.dates))
+  def _add_total(self, key: t.Tuple[str, str], dates: int, centers: int) -> None:
+    total = self._totals.setdefault(key, [0, 0])
+    total[0] += dates
+    total[1] += centers
+    if total[1] > 0:
+      available_vaccination_appointment_dates.labels(*key).set(total[0])
+    else:
+      del self._totals[key]
+      _remove(available_vaccination_appointment_dates, *key)
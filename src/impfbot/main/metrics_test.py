@@ -0,0 +1,87 @@
+
+import datetime
+import typing as t
+from unittest import TestCase
+from prometheus_client import Gauge  # type: ignore
+
+from impfbot.model.api import AvailabilityInfo, VaccinationCenter, VaccineRound, VaccineType
+from impfbot.polling.api import IVaccinationCenter
+from . import metrics
+
+# A round that no other test reports, as the metrics are global.
+ROUND = VaccineRound(VaccineType.BIONTECH, 9)
+DATES = [datetime.date(2021, 6, 21), datetime.date(2021, 6, 22)]
+
+
+class _Center(IVaccinationCenter):
+
+  def __init__(self, id: str, name: str) -> None:
+    self.metadata = VaccinationCenter(id, name, 'https://vacc', 'Vaccheim')
+
+  def get_metadata(self) -> VaccinationCenter:
+    return self.metadata
+
+  def check_availability(self) -> t.Dict[VaccineRound, AvailabilityInfo]:
+    raise NotImplementedError
+
+
+def _value(gauge: Gauge, **labels: str) -> t.Optional[float]:
+  # Not with the REGISTRY, which would also collect the metrics of the other tests.
+  for metric in gauge.collect():
+    for sample in metric.samples:
+      if sample.labels == labels:
+        return sample.value
+  return None
+
+
+class AvailabilityMetricsTest(TestCase):
+
+  def setUp(self) -> None:
+    self.now = 0.0
+    self.metrics = metrics.AvailabilityMetrics(datetime.timedelta(seconds=60), clock=lambda: self.now)
+
+  def _dates(self, center_id: str) -> t.Optional[float]:
+    return _value(metrics.number_of_dates_with_available_vaccination_appointments, vaccine_type='BIONTECH',
+      vaccine_round='9', vaccination_center_id=center_id)
+
+  def _total(self) -> t.Optional[float]:
+    return _value(metrics.available_vaccination_appointment_dates, vaccine_type='BIONTECH', vaccine_round='9')
+
+  def test_expire_series(self) -> None:
+    a, b = _Center('metrics-a', 'A'), _Center('metrics-b', 'B')
+    self.metrics.on_availability_info_ready(a, ROUND, AvailabilityInfo(DATES))
+    self.metrics.on_availability_info_ready(b, ROUND, AvailabilityInfo(DATES[:1]))
+    assert self._dates('metrics-a') == 2 and self._dates('metrics-b') == 1
+    assert self._total() == 3
+    assert _value(metrics.vaccination_center_info, vaccination_center_id='metrics-a', vaccination_center_name='A',
+      vaccination_center_location='Vaccheim') == 1
+    assert self.metrics.series_count == 5
+    assert _value(metrics.availability_metrics_series) == 5
+
+    # Renaming a center replaces its info series.
+    a.metadata = VaccinationCenter('metrics-a', 'A2', 'https://vacc', 'Vaccheim')
+    self.now = 50
+    self.metrics.on_availability_info_ready(a, ROUND, AvailabilityInfo([]))
+    assert _value(metrics.vaccination_center_info, vaccination_center_id='metrics-a', vaccination_center_name='A',
+      vaccination_center_location='Vaccheim') is None
+    assert self._total() == 1
+
+    self.now = 100
+    self.metrics.end_polling()
+    assert self._dates('metrics-a') == 0 and self._dates('metrics-b') is None
+    assert self.metrics.series_count == 3
+
+    self.now = 200
+    self.metrics.end_polling()
+    assert self._dates('metrics-a') is None and self._total() is None
+    assert self.metrics.series_count == 0
+
+  def test_aggregate_only(self) -> None:
+    self.metrics.aggregate_only = True
+    self.metrics.on_availability_info_ready(_Center('metrics-c', 'C'), ROUND, AvailabilityInfo(DATES))
+    assert self._dates('metrics-c') is None
+    assert self._total() == 2
+    assert self.metrics.series_count == 1
+    self.now = 100
+    self.metrics.end_polling()
+    assert self._total() is None
@@ -3,10 +3,12 @@ import enum
 import typing as t
 from dataclasses import dataclass
 from databind.json import from_str, to_str
+from telegram.utils.helpers import escape_markdown
 
 from impfbot.model import IAvailabilityStore, IUSerStore
-from impfbot.model.api import Subscription, VaccineRound, VaccineType
-from impfbot.utils import tgui
+from impfbot.model.api import Area, Subscription, VaccineRound, VaccineType
+from impfbot.utils import geo, tgui
+from impfbot.utils.cache import ICache, LocalCache
 from impfbot.utils.locale import get as _
 
 
@@ -56,9 +58,24 @@ class SubscriptionManager:
   This class implements the state machine for the subscription configuration in Telegram.
   """
 
-  def __init__(self, avail: IAvailabilityStore, users: IUSerStore) -> None:
+  #: Key of the cache entry that marks that the next message of a user is a search query.
+  SEARCH_KEY = 'subscriptions:search:{}'
+
+  #: Search queries are truncated to this length.
+  MAX_QUERY_LENGTH = 64
+
+  def __init__(self,
+    avail: IAvailabilityStore,
+    users: IUSerStore,
+    cache: t.Optional[ICache] = None,
+    page_size: int = 10,
+    search_ttl: float = 10 * 60,
+  ) -> None:
     self.avail = avail
     self.users = users
+    self.cache = cache if cache is not None else LocalCache()
+    self.page_size = page_size
+    self.search_ttl = search_ttl
 
   def _toggle_vaccine_type_filter(self, user_id: int, vaccine_round: VaccineRound) -> tgui.View:
     subscription = self.users.get_subscription(user_id)
@@ -101,34 +118,132 @@ class SubscriptionManager:
     self.users.subscribe_user(user_id, subscription)
     return self._get_vaccination_center_picker_view(user_id, subscription)
 
-  def _toggle_vaccination_center_id(self, user_id: int, center_id: str) -> tgui.View:
+  def _toggle_vaccination_center_id(self, user_id: int, center_id: str, page: int, query: t.Optional[str]) -> tgui.View:
     subscription = self.users.get_subscription(user_id)
     if center_id in subscription.vaccination_center_ids:
       subscription.vaccination_center_ids.remove(center_id)
     else:
       subscription.vaccination_center_ids.append(center_id)
     self.users.subscribe_user(user_id, subscription)
+    return self._get_vaccination_center_picker_view(user_id, subscription, page, query)
+
+  def _remove_area(self, user_id: int, postcode: str) -> tgui.View:
+    subscription = self.users.get_subscription(user_id)
+    subscription.vaccination_center_areas[:] = [a for a in subscription.vaccination_center_areas if a.postcode != postcode]
+    self.users.subscribe_user(user_id, subscription)
     return self._get_vaccination_center_picker_view(user_id, subscription)
 
-  def _get_vaccination_center_picker_view(self, user_id, subscription: t.Optional[Subscription] = None) -> tgui.View:
+  def set_area(self, user_id: int, postcode: str, radius_km: float) -> tgui.View:
+    """
+    Subscribes the user to the vaccination centers within *radius_km* (at most
+    #geo.MAX_RADIUS_KM) around the center of the *postcode*, replacing a previous subscription to
+    an area around the same postcode. The postcode must be known to #geo.lookup_postcode().
+    """
+
+    coordinates = geo.lookup_postcode(postcode)
+    if coordinates is None:
+      return tgui.View(_('subscriptions.dialog.area.unknown_postcode', postcode=postcode))
+    area = Area(postcode.strip(), coordinates.latitude, coordinates.longitude, min(radius_km, geo.MAX_RADIUS_KM))
+    subscription = self.users.get_subscription(user_id)
+    subscription.vaccination_center_areas[:] = [a for a in subscription.vaccination_center_areas
+      if a.postcode != area.postcode] + [area]
+    self.users.subscribe_user(user_id, subscription)
+    return self._get_vaccination_center_picker_view(user_id, subscription)
+
+  def _start_search(self, user_id: int) -> tgui.View:
+    self.cache.set(self.SEARCH_KEY.format(user_id), True, self.search_ttl)
+    view = tgui.View(_('subscriptions.dialog.search.message'))
+    view.add_button(_('subscriptions.dialog.general.back')).connect(
+      lambda ctx, btn: self._cancel_search(ctx.user_id()))
+    return view
+
+  def _cancel_search(self, user_id: int) -> tgui.View:
+    self.cache.delete(self.SEARCH_KEY.format(user_id))
+    return self._get_vaccination_center_picker_view(user_id)
+
+  def handle_message(self, user_id: int, text: str) -> t.Optional[tgui.View]:
+    """
+    Handles a text message of the user that is not a command. If the user started a search for
+    vaccination centers, returns the view with the first page of the results. Otherwise, returns
+    #None.
+    """
+
+    key = self.SEARCH_KEY.format(user_id)
+    if self.cache.get(key) is None:
+      return None
+    self.cache.delete(key)
+    return self._get_vaccination_center_picker_view(user_id, query=text.strip()[:self.MAX_QUERY_LENGTH])
+
+  def _get_vaccination_center_picker_view(self,
+    user_id: int,
+    subscription: t.Optional[Subscription] = None,
+    page: int = 0,
+    query: t.Optional[str] = None,
+  ) -> tgui.View:
+    """
+    Shows the *page* of the vaccination centers, or of the centers whose name starts with the
+    search *query*. Only the centers of the page are loaded and rendered as buttons.
+    """
+
     subscription = subscription or self.users.get_subscription(user_id)
-    view = tgui.View(_('subscriptions.dialog.choose_vaccination_centers.message'))
+    if query:
+      message = _('subscriptions.dialog.search.results', query=escape_markdown(query))
+    else:
+      message = _('subscriptions.dialog.choose_vaccination_centers.message')
+    view = tgui.View(message)
 
     all_enabled = '%' in subscription.vaccination_center_queries
-    name = _('subscriptions.dialog.general.all')
-    if all_enabled:
-      name += ' ' + _('emoji.enabled')
-    view.add_button(name).connect(lambda ctx, btn: self._toggle_match_all(ctx.user_id()))
+    if page == 0 and not query:
+      name = _('subscriptions.dialog.general.all')
+      if all_enabled:
+        name += ' ' + _('emoji.enabled')
+      view.add_button(name).connect(lambda ctx, btn: self._toggle_match_all(ctx.user_id()))
 
-    for center in self.avail.search_vaccination_centers(None):
+    # The areas the user subscribed to, and the distance to the nearest one for every center in them.
+    distances: t.Dict[str, float] = {}
+    for area in subscription.vaccination_center_areas:
+      if page == 0 and not query:
+        name = _('subscriptions.dialog.area.button', postcode=area.postcode, radius=f'{area.radius_km:g}')
+        view.add_button(name + ' ' + _('emoji.enabled'), {'postcode': area.postcode}).connect(
+          lambda ctx, btn: self._remove_area(ctx.user_id(), btn.args['postcode']))
+      for distance, center in self.avail.search_vaccination_centers_near(area.latitude, area.longitude, area.radius_km):
+        distances[center.id] = min(distance, distances.get(center.id, distance))
+
+    # Load one more center than fits on the page to know whether there is a next page.
+    offset = page * self.page_size
+    if query:
+      centers = self.avail.search_vaccination_centers_by_prefix(query, offset, self.page_size + 1)
+    else:
+      centers = self.avail.search_vaccination_centers(None, offset, self.page_size + 1)
+    for center in centers[:self.page_size]:
       name = center.name
-      if all_enabled:
+      if center.id in distances:
+        name += f' ({distances[center.id]:.0f} km)'
+      if all_enabled or center.id in distances:
         name += ' ' + _('emoji.enabled_implicit')
       if center.id in subscription.vaccination_center_ids:
         name += ' ' + _('emoji.enabled')
-      view.add_button(name, {'id': center.id}).connect(
-        lambda ctx, btn: self._toggle_vaccination_center_id(ctx.user_id(), btn.args['id']))
-    view.add_button(_('subscriptions.dialog.general.back')).connect(lambda ctx, btn: self.get_root_view(ctx.user_id()))
+      view.add_button(name, {'id': center.id, 'page': page, 'query': query}).connect(
+        lambda ctx, btn: self._toggle_vaccination_center_id(ctx.user_id(), btn.args['id'], btn.args['page'],
+          btn.args['query']))
+    if query and not centers:
+      view.message += '\n\n' + _('subscriptions.dialog.search.no_results')
+
+    navigation = []
+    if page > 0:
+      navigation.append(tgui.Button(_('subscriptions.dialog.general.previous_page'), {'page': page - 1}).connect(
+        lambda ctx, btn: self._get_vaccination_center_picker_view(ctx.user_id(), None, btn.args['page'], query)))
+    if len(centers) > self.page_size:
+      navigation.append(tgui.Button(_('subscriptions.dialog.general.next_page'), {'page': page + 1}).connect(
+        lambda ctx, btn: self._get_vaccination_center_picker_view(ctx.user_id(), None, btn.args['page'], query)))
+    if navigation:
+      view.add_buttons(*navigation)
+    view.add_button(_('subscriptions.dialog.search.button')).connect(lambda ctx, btn: self._start_search(ctx.user_id()))
+    if query:
+      view.add_button(_('subscriptions.dialog.general.back')).connect(
+        lambda ctx, btn: self._get_vaccination_center_picker_view(ctx.user_id()))
+    else:
+      view.add_button(_('subscriptions.dialog.general.back')).connect(lambda ctx, btn: self.get_root_view(ctx.user_id()))
     return view
 
   def _unsubscribe(self, user_id) -> tgui.View:
@@ -0,0 +1,77 @@
+
+import datetime
+import os
+import typing as t
+from unittest import TestCase
+
+from impfbot.model import db
+from impfbot.model.api import User, VaccinationCenter
+from impfbot.model.default import DefaultAvailabilityStore, DefaultUserStore
+from impfbot.utils import locale, tgui
+from .sub import SubscriptionManager
+
+
+def _texts(view: tgui.View) -> t.List[str]:
+  return [btn.text for line in view.buttons for btn in line]
+
+
+def _click(view: tgui.View, text: str) -> tgui.View:
+  button = next(btn for line in view.buttons for btn in line if btn.text.startswith(text))
+  assert button.on_click
+  result = button.on_click(t.cast(tgui.IContext, _Context()), button)
+  assert isinstance(result, tgui.View)
+  return result
+
+
+class _Context:
+
+  def user_id(self) -> int:
+    return 1
+
+
+class SubscriptionManagerTest(TestCase):
+
+  def setUp(self) -> None:
+    locale.load(os.path.join(os.path.dirname(__file__), '..', '..', 'locale', 'de.yml'))
+    db.init_database('sqlite:///:memory:')
+    self.session = db.ScopedSession()
+    self.avail = DefaultAvailabilityStore(self.session, datetime.timedelta(1))
+    self.users = DefaultUserStore(self.session, self.avail)
+    self.subs = SubscriptionManager(self.avail, self.users, page_size=10)
+    with self.session:
+      for i in range(25):
+        self.avail.upsert_vaccination_center(VaccinationCenter(f'c{i:02}', f'Center {i:02}', 'https://vacc', 'Vaccheim'))
+      self.users.register_user(User(1, 1, 'u1'))
+
+  def test_pages(self) -> None:
+    with self.session:
+      view = self.subs._get_vaccination_center_picker_view(1)
+      assert _texts(view)[1:11] == [f'Center {i:02}' for i in range(10)]
+      assert '◀' not in _texts(view)
+
+      view = _click(view, '▶')
+      assert _texts(view)[:10] == [f'Center {i:02}' for i in range(10, 20)]
+      view = _click(view, 'Center 12')
+      assert _texts(view)[:3] == ['Center 10', 'Center 11', 'Center 12 ✅']
+      assert self.users.get_subscription(1).vaccination_center_ids == ['c12']
+
+      view = _click(view, '▶')
+      assert _texts(view)[:5] == [f'Center {i:02}' for i in range(20, 25)]
+      assert '▶' not in _texts(view)
+      view = _click(view, '◀')
+      assert _texts(view)[2].startswith('Center 12')
+
+  def test_search(self) -> None:
+    with self.session:
+      assert self.subs.handle_message(1, 'center 1') is None
+      _click(self.subs._get_vaccination_center_picker_view(1), '🔍')
+      result = self.subs.handle_message(1, 'center 1')
+      assert result is not None
+      assert _texts(result)[:10] == [f'Center {i:02}' for i in range(10, 20)]
+      assert '▶' not in _texts(result)
+      assert self.subs.handle_message(1, 'center 1') is None
+
+      _click(self.subs._get_vaccination_center_picker_view(1), '🔍')
+      result = self.subs.handle_message(1, 'xyz')
+      assert result is not None
+      assert 'keine passenden' in result.message
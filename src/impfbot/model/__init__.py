@@ -1,4 +1,4 @@
 
 from .db import ISessionProvider, ScopedSession
-from .api import (AvailabilityInfo, VaccineType, VaccineRound, VaccinationCenter, User,
-  IAvailabilityStore, IUSerStore)
+from .api import (AvailabilityInfo, VaccineType, VaccineRound, VaccinationCenter, User, Subscription,
+  Notification, IAvailabilityStore, IUSerStore, INotificationStore)
@@ -1,5 +1,6 @@
 
 import abc
+import dataclasses
 import enum
 import datetime
 import typing as t
@@ -7,13 +8,42 @@ from dataclasses import dataclass, field
 
 from impfbot.utils.locale import get as _
 
+T = t.TypeVar('T')
 
+
+def _slots(cls: t.Type[T]) -> t.Type[T]:
+  """
+  Recreates a frozen dataclass with `__slots__` for its fields, like `dataclass(slots=True)` does
+  in Python 3.10+. The model types exist once per user and center in the hot paths, so they should
+  not carry a `__dict__` each.
+  """
+
+  names = tuple(f.name for f in dataclasses.fields(t.cast(t.Any, cls)))
+  namespace = {k: v for k, v in vars(cls).items() if k not in names + ('__dict__', '__weakref__')}
+  namespace['__slots__'] = names
+
+  # Frozen instances can't be unpickled with setattr().
+  def __getstate__(self: t.Any) -> t.Tuple[t.Any, ...]:
+    return tuple(getattr(self, name) for name in names)
+
+  def __setstate__(self: t.Any, state: t.Tuple[t.Any, ...]) -> None:
+    for name, value in zip(names, state):
+      object.__setattr__(self, name, value)
+
+  namespace['__getstate__'] = __getstate__
+  namespace['__setstate__'] = __setstate__
+  return t.cast(t.Type[T], type(cls.__name__, cls.__bases__, namespace))
+
+
+@_slots
 @dataclass(frozen=True)
 class VaccinationCenter:
   id: str
   name: str
   url: str
   location: str
+  latitude: t.Optional[float] = None
+  longitude: t.Optional[float] = None
 
 
 class VaccineType(enum.Enum):
@@ -40,6 +70,7 @@ class VaccineRound(t.NamedTuple):
     return name
 
 
+@_slots
 @dataclass(frozen=True)
 class AvailabilityInfo:
 
@@ -47,6 +78,7 @@ class AvailabilityInfo:
   dates: t.List[datetime.date] = field(default_factory=list)
 
 
+@_slots
 @dataclass(frozen=True)
 class User:
   id: int
@@ -54,14 +86,39 @@ class User:
   first_name: str
 
 
+@_slots
+@dataclass(frozen=True)
+class Notification:
+  id: int
+  user_id: int
+  chat_id: int
+  text: str
+
+
+@_slots
+@dataclass(frozen=True)
+class Area:
+  """
+  The area within *radius_km* around the center of a postcode.
+  """
+
+  postcode: str
+  latitude: float
+  longitude: float
+  radius_km: float
+
+
+@_slots
 @dataclass(frozen=True)
 class Subscription:
   vaccine_rounds: t.List[VaccineRound] = field(default_factory=list)
   vaccination_center_ids: t.List[str] = field(default_factory=list)
   vaccination_center_queries: t.List[str] = field(default_factory=list)
+  vaccination_center_areas: t.List[Area] = field(default_factory=list)
 
   def __bool__(self) -> bool:
-    return bool(self.vaccine_rounds or self.vaccination_center_ids or self.vaccination_center_queries)
+    return bool(self.vaccine_rounds or self.vaccination_center_ids or self.vaccination_center_queries or
+      self.vaccination_center_areas)
 
   def is_partial(self) -> bool:
     """
@@ -69,7 +126,8 @@ class Subscription:
     but not the other.
     """
 
-    return bool(self.vaccine_rounds) != bool(self.vaccination_center_ids or self.vaccination_center_queries)
+    return bool(self.vaccine_rounds) != bool(self.vaccination_center_ids or self.vaccination_center_queries or
+      self.vaccination_center_areas)
 
 
 class IAvailabilityStore(metaclass=abc.ABCMeta):
@@ -80,12 +138,39 @@ class IAvailabilityStore(metaclass=abc.ABCMeta):
   @abc.abstractmethod
   def upsert_vaccination_center(self, vaccination_center: VaccinationCenter) -> None: ...
 
+  @abc.abstractmethod
+  def refresh_vaccination_centers(self, vaccination_center_ids: t.Collection[str]) -> None:
+    """
+    Extends the lifetime of the specified vaccination centers in a single operation.
+    """
+
   @abc.abstractmethod
   def search_vaccination_centers(self,
     search_query: t.Optional[str],
     offset: t.Optional[int] = None,
     limit: t.Optional[int] = None) -> t.List[VaccinationCenter]: ...
 
+  @abc.abstractmethod
+  def search_vaccination_centers_by_prefix(self,
+    prefix: str,
+    offset: t.Optional[int] = None,
+    limit: t.Optional[int] = None) -> t.List[VaccinationCenter]:
+    """
+    Returns the vaccination centers whose name starts with *prefix* (ignoring case), ordered by
+    their name.
+    """
+
+  @abc.abstractmethod
+  def search_vaccination_centers_near(self,
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    limit: t.Optional[int] = None) -> t.List[t.Tuple[float, VaccinationCenter]]:
+    """
+    Returns the vaccination centers within *radius_km* of the coordinates and their distance in
+    kilometers, nearest first.
+    """
+
   @abc.abstractmethod
   def get_per_vaccine_round_availability(self,
     vaccination_center_id: str) -> t.List[t.Tuple[VaccineRound, AvailabilityInfo]]: ...
@@ -103,6 +188,10 @@ class IAvailabilityStore(metaclass=abc.ABCMeta):
 
 
 class IUSerStore(metaclass=abc.ABCMeta):
+  """
+  Users that blocked the bot (see #mark_users_blocked()) are excluded from all queries that return
+  or count multiple users, until they register again.
+  """
 
   @abc.abstractmethod
   def get_user_count(self, with_subscription_only: bool) -> int: ...
@@ -111,7 +200,19 @@ class IUSerStore(metaclass=abc.ABCMeta):
   def get_users(self, offset: t.Optional[int] = None, limit: t.Optional[int] = None) -> t.List[User]: ...
 
   @abc.abstractmethod
-  def register_user(self, user: User) -> None: ...
+  def register_user(self, user: User) -> None:
+    """
+    Registers or updates the user. A user that was marked as blocked becomes active again.
+    """
+
+  @abc.abstractmethod
+  def mark_users_blocked(self, user_ids: t.Collection[int]) -> None:
+    """
+    Marks users that can not be reached anymore because they blocked the bot or deleted the chat.
+    """
+
+  @abc.abstractmethod
+  def get_blocked_user_count(self) -> int: ...
 
   @abc.abstractmethod
   def get_subscription(self, user_id: int) -> Subscription: ...
@@ -138,6 +239,13 @@ class IUSerStore(metaclass=abc.ABCMeta):
     results yourself.
     """
 
+  @abc.abstractmethod
+  def get_subscriber_count(self, vaccination_center_id: str) -> int:
+    """
+    Count the users that have subscribed to the specified vaccination center, regardless of the
+    vaccine rounds they have subscribed to.
+    """
+
   @abc.abstractmethod
   def get_relevant_availability_for_user(self, user_id: int
     ) -> t.List[t.Tuple[VaccinationCenter, VaccineRound, AvailabilityInfo]]:
@@ -145,3 +253,58 @@ class IUSerStore(metaclass=abc.ABCMeta):
     Find the vaccination centers and rounds with availability currently known that match the
     user's subscriptions.
     """
+
+
+class INotificationStore(metaclass=abc.ABCMeta):
+  """
+  A queue of messages to send to users. Notifications are sharded by the user ID (`user_id %
+  num_shards`), and each notification is claimed by one worker for a limited time (the lease)
+  before it is sent, so that multiple workers can process the queue without sending a message
+  twice. Notifications of a worker that did not complete them before the lease expired can be
+  claimed again.
+  """
+
+  @abc.abstractmethod
+  def enqueue_notifications(self, notifications: t.Iterable[t.Tuple[User, str]]) -> None: ...
+
+  @abc.abstractmethod
+  def claim_notifications(self,
+    worker_id: str,
+    shard: int,
+    num_shards: int,
+    limit: int,
+    lease: datetime.timedelta) -> t.List[Notification]:
+    """
+    Claims up to *limit* pending notifications of the *shard* for the worker. The claim must
+    be committed before the notifications are sent.
+    """
+
+  @abc.abstractmethod
+  def renew_claim(self, worker_id: str, notification_id: int, lease: datetime.timedelta) -> bool:
+    """
+    Extends the lease of a notification that is still claimed by the worker and not completed.
+    Returns False if the lease expired or the notification was claimed by another worker, in
+    which case the worker must not send it.
+    """
+
+  @abc.abstractmethod
+  def complete_notifications(self,
+    worker_id: str,
+    notification_ids: t.Collection[int],
+    error: t.Optional[str] = None) -> int:
+    """
+    Marks the notifications as sent (or failed, if an *error* is specified). Only notifications
+    that are still claimed by the worker are updated. Returns the number of updated notifications.
+    """
+
+  @abc.abstractmethod
+  def get_notification_counts(self) -> t.Dict[str, int]:
+    """
+    Returns the number of notifications that are `pending`, `claimed`, `sent` and `failed`.
+    """
+
+  @abc.abstractmethod
+  def prune_notifications(self, older_than: datetime.timedelta) -> int:
+    """
+    Deletes completed notifications that are older than the specified time.
+    """
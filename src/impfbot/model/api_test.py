@@ -0,0 +1,28 @@
+
+import dataclasses
+import datetime
+import pickle
+from unittest import TestCase
+
+from .api import AvailabilityInfo, Subscription, User, VaccinationCenter, VaccineRound, VaccineType
+
+
+class ModelTest(TestCase):
+
+  def test_slots(self) -> None:
+    center = VaccinationCenter('abc', 'ABC Vacc', 'https://abc.vacc', 'Vaccheim')
+    assert not hasattr(center, '__dict__')
+    with self.assertRaises(dataclasses.FrozenInstanceError):
+      center.name = 'XYZ Vacc'  # type: ignore[misc]
+    assert dataclasses.replace(center, name='XYZ Vacc').name == 'XYZ Vacc'
+    assert {center, VaccinationCenter('abc', 'ABC Vacc', 'https://abc.vacc', 'Vaccheim')} == {center}
+
+  def test_pickle(self) -> None:
+    values = [
+      VaccinationCenter('abc', 'ABC Vacc', 'https://abc.vacc', 'Vaccheim'),
+      AvailabilityInfo(dates=[datetime.date(2021, 6, 21)]),
+      User(1, 10, 'u1'),
+      Subscription(vaccine_rounds=[VaccineRound(VaccineType.BIONTECH, 1)], vaccination_center_ids=['abc']),
+    ]
+    for value in values:
+      assert pickle.loads(pickle.dumps(value)) == value
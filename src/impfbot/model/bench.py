@@ -0,0 +1,131 @@
+
+"""
+Measures the time and memory allocations of the hot read paths of the #DefaultUserStore against a
+temporary SQLite database with synthetic users, and of the search for vaccination centers with
+the full-text index and without it.
+
+    $ python -m impfbot.model.bench --users 10000
+    $ python -m impfbot.model.bench --users 0 --centers 10000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import typing as t
+
+from . import db, search
+from .api import Subscription, User, VaccinationCenter, VaccineRound, VaccineType
+from .default import DefaultAvailabilityStore, DefaultUserStore
+
+VACCINE_ROUND = VaccineRound(VaccineType.BIONTECH, 1)
+PLACES = ['München', 'Dachau', 'Fürstenfeldbruck', 'Freising', 'Erding', 'Starnberg', 'Würmtal', 'Pfaffenhofen']
+
+
+class BenchResult(t.NamedTuple):
+  name: str
+  runs: int
+  seconds: float
+  peak_bytes: int
+
+  def __str__(self) -> str:
+    return (f'{self.name:40} {self.seconds / self.runs * 1000:9.2f}ms/run  '
+      f'{self.peak_bytes / 1024:10.1f}KiB peak')
+
+
+def measure(name: str, func: t.Callable[[], t.Any], runs: int = 5) -> BenchResult:
+  """
+  Calls *func* once to warm up, *runs* times to measure the time, and once more to measure the
+  peak of the memory allocated while it runs (tracing allocations slows down the call).
+  """
+
+  func()
+  started = time.perf_counter()
+  for _ in range(runs):
+    func()
+  seconds = time.perf_counter() - started
+  tracemalloc.start()
+  try:
+    func()
+    _current, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return BenchResult(name, runs, seconds, peak)
+
+
+def populate(session: db.ISessionProvider, num_users: int, num_centers: int, seed: int = 0) -> t.List[VaccinationCenter]:
+  rnd = random.Random(seed)
+  avail = DefaultAvailabilityStore(session, datetime.timedelta(days=1))
+  users = DefaultUserStore(session, avail)
+  centers = [VaccinationCenter(f'center-{i}', f'Center {i} {PLACES[i % len(PLACES)]}', f'https://example.org/{i}',
+    f'Ort {i % 7}') for i in range(num_centers)]
+  with session:
+    for center in centers:
+      avail.upsert_vaccination_center(center)
+    for user_id in range(1, num_users + 1):
+      users.register_user(User(user_id, user_id, f'User {user_id}'))
+      users.subscribe_user(user_id, Subscription(
+        vaccine_rounds=[VACCINE_ROUND],
+        vaccination_center_ids=[c.id for c in rnd.sample(centers, min(3, num_centers))],
+        vaccination_center_queries=['Ort 1'] if rnd.random() < 0.1 else []))
+  return centers
+
+
+def run(num_users: int, num_centers: int, runs: int = 5) -> t.List[BenchResult]:
+  with tempfile.TemporaryDirectory() as tempdir:
+    db.init_database('sqlite:///' + os.path.join(tempdir, 'bench.db'))
+    session = db.ScopedSession()
+    centers = populate(session, num_users, num_centers)
+    avail = DefaultAvailabilityStore(session, datetime.timedelta(days=1))
+    users = DefaultUserStore(session, avail)
+
+    def _match_all_centers() -> None:
+      with session:
+        for center in centers:
+          users.get_users_subscribed_to(center.id, VACCINE_ROUND)
+
+    def _get_users() -> None:
+      with session:
+        users.get_users()
+
+    def _search_centers() -> None:
+      with session:
+        avail.search_vaccination_centers(None)
+
+    def _full_text_search() -> None:
+      with session:
+        for query in ('wurmtal', 'Center 12', 'münchen 7', 'nothing'):
+          avail.search_vaccination_centers(query, 0, 10)
+
+    assert db.engine
+    index = search.get_index(db.engine)
+    try:
+      results = []
+      if num_users:
+        results.append(measure(f'match {num_users} users x {num_centers} centers', _match_all_centers, runs))
+        results.append(measure(f'get_users ({num_users})', _get_users, runs))
+      results.append(measure(f'search_vaccination_centers ({num_centers})', _search_centers, runs))
+      results.append(measure(f'4 searches ({type(index).__name__})', _full_text_search, runs))
+      search._indexes[db.engine] = search.LikeSearchIndex()
+      results.append(measure('4 searches (LikeSearchIndex)', _full_text_search, runs))
+      return results
+    finally:
+      assert db.engine
+      db.engine.dispose()
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--users', type=int, default=10000, help='Number of users.')
+  parser.add_argument('--centers', type=int, default=10, help='Number of vaccination centers.')
+  parser.add_argument('--runs', type=int, default=5, help='Number of measured runs per benchmark.')
+  args = parser.parse_args()
+  for result in run(args.users, args.centers, args.runs):
+    print(result)
+
+
+if __name__ == '__main__':
+  main()
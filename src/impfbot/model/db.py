@@ -4,27 +4,35 @@ import contextlib
 import datetime
 import enum
 import functools
+import re
 import typing as t
-from sqlalchemy import create_engine, Column, DateTime, Integer, String, ForeignKey, JSON
+from sqlalchemy import create_engine, event, inspect, text, Column, DateTime, Float, Integer, String, ForeignKey, JSON
 from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import aliased, Session
 from sqlalchemy.orm.attributes import QueryableAttribute
 from sqlalchemy_repr import RepresentableBase  # type: ignore
-from impfbot.model.api import AvailabilityInfo, User, VaccinationCenter, VaccineRound, VaccineType
+from impfbot.model.api import AvailabilityInfo, Notification, User, VaccinationCenter, VaccineRound, VaccineType
 
 from impfbot.utils.local import LocalList
 
 __all__ = [
   'ISessionProvider',
   'ScopedSession',
+  'ReadOnlySessionError',
   'VaccinationCenterV1',
   'UserV1',
   'SubscriptionV1',
+  'NotificationJobV1',
   'aliased',
 ]
 
 engine: t.Optional[Engine] = None
+
+#: The engine for the read-only sessions of #ISessionProvider.read_only(), if a read replica is
+#: configured.
+replica_engine: t.Optional[Engine] = None
+
 Base = declarative_base(cls=RepresentableBase)
 T_Callable = t.TypeVar('T_Callable', bound=t.Callable)
 
@@ -56,6 +64,14 @@ class ISessionProvider(metaclass=abc.ABCMeta):
   @abc.abstractmethod
   def __exit__(self, exc_type, exc_value, exc_tb) -> None: ...
 
+  @abc.abstractmethod
+  def read_only(self) -> t.ContextManager[Session]:
+    """
+    Opens a session for reads that tolerate stale data, which is routed to the read replica if
+    one is configured. The session becomes the current session until it is closed; flushing
+    changes in it raises a #ReadOnlySessionError.
+    """
+
   def ensure(self) -> t.ContextManager[Session]:
     try:
       session = self.__call__()
@@ -92,6 +108,29 @@ class ScopedSession(ISessionProvider):
     except IndexError:
       raise RuntimeError('No active ScopedSession in current thread.')
 
+  @contextlib.contextmanager
+  def read_only(self) -> t.Iterator[Session]:
+    bind = replica_engine or engine
+    assert bind is not None
+    session = Session(bind=bind, autoflush=False)
+    session.info['read_only'] = True
+    self._local.append(session)
+    try:
+      yield session
+    finally:
+      self._local.pop()
+      session.close()
+
+
+class ReadOnlySessionError(Exception):
+  pass
+
+
+@event.listens_for(Session, 'before_flush')
+def _check_read_only(session: Session, _flush_context: t.Any, _instances: t.Any) -> None:
+  if session.info.get('read_only') and (session.new or session.dirty or session.deleted):
+    raise ReadOnlySessionError('changes can not be flushed in a read-only session')
+
 
 class SchemaVersion(Base):
   """
@@ -100,7 +139,29 @@ class SchemaVersion(Base):
 
   __tablename__ = 'schema_version'
 
-  EXPECTED_SCHEMA_VERSION = 1
+  EXPECTED_SCHEMA_VERSION = 5
+
+  #: SQL statements to upgrade the schema from a version to the next. New tables are created by
+  #: #init_database() and don't need a migration; `ADD COLUMN` statements are skipped for columns
+  #: that exist already because their table was created with the current schema.
+  MIGRATIONS: t.Dict[int, t.List[str]] = {
+    1: ['ALTER TABLE user_v1 ADD COLUMN blocked_at TIMESTAMP'],
+    2: [
+      'ALTER TABLE vaccc_v1 ADD COLUMN latitude FLOAT',
+      'ALTER TABLE vaccc_v1 ADD COLUMN longitude FLOAT',
+      'ALTER TABLE sub_v1 ADD COLUMN latitude FLOAT',
+      'ALTER TABLE sub_v1 ADD COLUMN longitude FLOAT',
+      'ALTER TABLE sub_v1 ADD COLUMN radius_km FLOAT',
+      'CREATE INDEX IF NOT EXISTS ix_sub_v1_latitude ON sub_v1 (latitude)',
+    ],
+    3: [
+      'ALTER TABLE vaccc_v1 ADD COLUMN search_name VARCHAR',
+      'UPDATE vaccc_v1 SET search_name = lower(name)',
+      'CREATE INDEX IF NOT EXISTS ix_vaccc_v1_search_name ON vaccc_v1 (search_name)',
+    ],
+    # The search index is filled by search.init_index().
+    4: ['ALTER TABLE vaccc_v1 ADD COLUMN search_text VARCHAR'],
+  }
 
   version = Column(Integer, primary_key=True)
 
@@ -119,6 +180,14 @@ class SchemaVersion(Base):
   def validate() -> None:
     with ScopedSession() as session:
       version = SchemaVersion.get(session)
+      while version < SchemaVersion.EXPECTED_SCHEMA_VERSION and version in SchemaVersion.MIGRATIONS:
+        for statement in SchemaVersion.MIGRATIONS[version]:
+          match = re.match(r'ALTER TABLE (\w+) ADD COLUMN (\w+)', statement)
+          if match and match.group(2) in {c['name'] for c in inspect(session.connection()).get_columns(match.group(1))}:
+            continue
+          session.execute(text(statement))
+        session.query(SchemaVersion).update({SchemaVersion.version: version + 1})
+        version += 1
       if version != SchemaVersion.EXPECTED_SCHEMA_VERSION:
         raise RuntimeError(f'Current database schema version ({version}) does not match '
           f'the required schema version ({SchemaVersion.EXPECTED_SCHEMA_VERSION})')
@@ -132,6 +201,19 @@ class VaccinationCenterV1(Base):
   url = Column(String, nullable=False)
   location = Column(String, nullable=False)
   expires = Column(DateTime, nullable=False)
+  latitude = Column(Float, nullable=True)
+  longitude = Column(Float, nullable=True)
+
+  #: The #name as normalized by #normalize_search_name(), for the indexed prefix search.
+  search_name = Column(String, nullable=True, index=True)
+
+  #: The normalized tokens of the name, location and URL, for the full-text search (see
+  #: #impfbot.model.search).
+  search_text = Column(String, nullable=True)
+
+  @staticmethod
+  def normalize_search_name(name: str) -> str:
+    return name.casefold()
 
   @staticmethod
   @t.no_type_check  # ilike() type stubs expects str
@@ -143,7 +225,7 @@ class VaccinationCenterV1(Base):
            VaccinationCenterV1.url.ilike(query_col)
 
   def to_api(self) -> VaccinationCenter:
-    return VaccinationCenter(self.id, self.name, self.url, self.location)
+    return VaccinationCenter(self.id, self.name, self.url, self.location, self.latitude, self.longitude)
 
 
 class VaccinationCenterAvailabilityV1(Base):
@@ -180,7 +262,15 @@ class VaccinationCenterAvailabilityV1(Base):
     return VaccineRound(VaccineType[self.vaccine_type], self.vaccine_round)
 
   def get_availability_info(self) -> AvailabilityInfo:
-    return AvailabilityInfo(dates=[datetime.datetime.strptime(ds, '%Y-%m-%d').date() for ds in self.dates])
+    return parse_availability_info(self.dates)
+
+
+def parse_availability_info(dates: t.List[str]) -> AvailabilityInfo:
+  """
+  Parses the value of the #VaccinationCenterAvailabilityV1.dates column.
+  """
+
+  return AvailabilityInfo(dates=[datetime.date.fromisoformat(ds) for ds in dates])
 
 
 class UserV1(Base):
@@ -191,6 +281,10 @@ class UserV1(Base):
   first_name = Column(String, nullable=False)
   registered_at = Column(DateTime, nullable=False)
 
+  #: Set when a message to the user failed because they blocked the bot or deleted the chat.
+  #: Cleared when the user registers again (e.g. with /start).
+  blocked_at = Column(DateTime, nullable=True)
+
   def to_api(self) -> User:
     return User(self.id, self.chat_id, self.first_name)
 
@@ -203,6 +297,10 @@ class SubscriptionV1(Base):
     VACCINATION_CENTER_ID = enum.auto()
     VACCINATION_CENTER_QUERY = enum.auto()
 
+    #: Matches the vaccination centers within #radius_km around the #latitude and #longitude of
+    #: the postcode stored in #vaccination_center_query.
+    VACCINATION_CENTER_AREA = enum.auto()
+
   id = Column(Integer, primary_key=True, autoincrement=True)
   user_id = Column(Integer, ForeignKey(UserV1.id), nullable=False)
   type = Column(String, nullable=False)
@@ -210,14 +308,42 @@ class SubscriptionV1(Base):
   vaccine_round = Column(Integer, nullable=True)
   vaccination_center_id = Column(String, nullable=True)
   vaccination_center_query = Column(String, nullable=True)
+  latitude = Column(Float, nullable=True, index=True)
+  longitude = Column(Float, nullable=True)
+  radius_km = Column(Float, nullable=True)
 
 
-def init_database(spec: str) -> None:
+class NotificationJobV1(Base):
+  __tablename__ = 'notify_job_v1'
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  user_id = Column(Integer, nullable=False)
+  chat_id = Column(Integer, nullable=False)
+  text = Column(String, nullable=False)
+  created_at = Column(DateTime, nullable=False)
+  claimed_by = Column(String, nullable=True)
+  claimed_until = Column(DateTime, nullable=True)
+  completed_at = Column(DateTime, nullable=True, index=True)
+  error = Column(String, nullable=True)
+
+  def to_api(self) -> Notification:
+    return Notification(self.id, self.user_id, self.chat_id, self.text)
+
+
+def init_database(spec: str, replica_spec: t.Optional[str] = None) -> None:
   """
   Initializes the database according to the SqlAlchemy database connection URL string *spec*.
+  If a *replica_spec* is given, the sessions of #ISessionProvider.read_only() connect to it. The
+  replica is expected to receive the schema through replication; it is not created or migrated.
   """
 
-  global engine
+  global engine, replica_engine
   engine = create_engine(spec, echo=False, future=True)
   Base.metadata.create_all(engine)
   SchemaVersion.validate()
+  replica_engine = create_engine(replica_spec, echo=False, future=True) if replica_spec else None
+
+  from . import search  # Imports this module.
+  index = search.init_index(engine)
+  if replica_engine:
+    search.register_index(replica_engine, index)
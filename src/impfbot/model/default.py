@@ -1,11 +1,20 @@
 
 import datetime
+import math
+import threading
+import time
 import typing as t
 
+from sqlalchemy import false, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import join
 from sqlalchemy.orm.query import Query
+from sqlalchemy.sql import Select
 
-from . import db
-from .api import AvailabilityInfo, VaccineRound, IAvailabilityStore, IUSerStore, Subscription, User, VaccinationCenter, VaccineType
+from . import db, search
+from impfbot.utils import geo
+from .api import Area, AvailabilityInfo, VaccineRound, IAvailabilityStore, IUSerStore, INotificationStore, Notification, \
+  Subscription, User, VaccinationCenter, VaccineType
 
 
 class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
@@ -17,11 +26,19 @@ class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
     center isn't refreshed within this time frame, it will be assumed that the center is not
     available anymore (the whole center, not just the availability info).
     availability. It will also be assumed that the vaccination center is not available anymore
+
+  Radius searches use a #geo.GridIndex of the vaccination centers that is rebuilt from the
+  database when a center was changed by this store, or after #GEO_INDEX_TTL seconds otherwise.
   """
 
+  GEO_INDEX_TTL = 60.0
+
   def __init__(self, session: db.ISessionProvider, ttl: datetime.timedelta) -> None:
     super().__init__(session)
     self.ttl = ttl
+    self._geo_lock = threading.Lock()
+    self._geo_index: t.Optional[geo.GridIndex[VaccinationCenter]] = None
+    self._geo_index_loaded = 0.0
 
   @db.HasSession.ensured
   def delete_vaccination_center(self, vaccination_center_id: str) -> None:
@@ -29,6 +46,8 @@ class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
     obj = self.session().query(db.VaccinationCenterV1).get(vaccination_center_id)
     if obj:
       self.session().delete(obj)
+      self._search_index().delete(self.session().connection(), vaccination_center_id)
+    self._geo_index = None
 
   @db.HasSession.ensured
   def upsert_vaccination_center(self, vaccination_center: VaccinationCenter) -> None:
@@ -37,8 +56,26 @@ class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
       name=vaccination_center.name,
       url=vaccination_center.url,
       location=vaccination_center.location,
+      search_name=db.VaccinationCenterV1.normalize_search_name(vaccination_center.name),
+      search_text=search.get_search_text(vaccination_center.name, vaccination_center.location, vaccination_center.url),
+      latitude=vaccination_center.latitude,
+      longitude=vaccination_center.longitude,
       expires=datetime.datetime.now() + self.ttl)
     self.session().merge(db_obj)
+    self._search_index().update(self.session().connection(), vaccination_center.id, vaccination_center.name,
+      vaccination_center.location, vaccination_center.url)
+    self._geo_index = None
+
+  def _search_index(self) -> search.ISearchIndex:
+    return search.get_index(t.cast(Engine, self.session().get_bind()))
+
+  @db.HasSession.ensured
+  def refresh_vaccination_centers(self, vaccination_center_ids: t.Collection[str]) -> None:
+    if not vaccination_center_ids:
+      return
+    self.session().query(db.VaccinationCenterV1)\
+      .filter(db.VaccinationCenterV1.id.in_(vaccination_center_ids))\
+      .update({db.VaccinationCenterV1.expires: datetime.datetime.now() + self.ttl}, synchronize_session=False)
 
   @db.HasSession.ensured
   def search_vaccination_centers(self,
@@ -47,37 +84,70 @@ class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
     limit: t.Optional[int] = None,
   ) -> t.List[VaccinationCenter]:
 
-    query = self.session().query(db.VaccinationCenterV1) \
-      .filter(db.VaccinationCenterV1.expires > datetime.datetime.now()) \
-      .order_by(db.VaccinationCenterV1.id) \
-      .offset(offset)\
-      .limit(limit)
+    vcenter = db.VaccinationCenterV1
+    stmt = select(vcenter.id, vcenter.name, vcenter.url, vcenter.location, vcenter.latitude, vcenter.longitude)\
+      .where(vcenter.expires > datetime.datetime.now())
 
     if search_query is not None:
-      query = query.filter(
-        db.VaccinationCenterV1.name.ilike('%' + search_query + '%') |
-        db.VaccinationCenterV1.url.ilike('%' + search_query + '%') |
-        db.VaccinationCenterV1.location.ilike('%' + search_query + '%'))
+      stmt = self._search_index().search(stmt, search_query)
 
-    result = []
-    for db_obj in query:
-      result.append(db_obj.to_api())
-    return result
+    stmt = stmt.order_by(vcenter.id).offset(offset).limit(limit)
+    return [VaccinationCenter(*row) for row in self.session().execute(stmt)]
+
+  @db.HasSession.ensured
+  def search_vaccination_centers_by_prefix(self,
+    prefix: str,
+    offset: t.Optional[int] = None,
+    limit: t.Optional[int] = None,
+  ) -> t.List[VaccinationCenter]:
+
+    # A range instead of a LIKE condition, so that the index on the search name is used with
+    # every database and regardless of the column's collation.
+    vcenter = db.VaccinationCenterV1
+    prefix = vcenter.normalize_search_name(prefix)
+    stmt = select(vcenter.id, vcenter.name, vcenter.url, vcenter.location, vcenter.latitude, vcenter.longitude)\
+      .where(vcenter.search_name >= prefix)\
+      .where(vcenter.search_name < prefix + '\U0010ffff')\
+      .where(vcenter.expires > datetime.datetime.now())\
+      .order_by(vcenter.search_name, vcenter.id).offset(offset).limit(limit)
+    return [VaccinationCenter(*row) for row in self.session().execute(stmt)]
+
+  def _get_geo_index(self) -> geo.GridIndex[VaccinationCenter]:
+    with self._geo_lock:
+      index = self._geo_index
+      if index is None or time.monotonic() - self._geo_index_loaded > self.GEO_INDEX_TTL:
+        index = geo.GridIndex()
+        for center in self.search_vaccination_centers(None):
+          if center.latitude is not None and center.longitude is not None:
+            index.insert(geo.Coordinates(center.latitude, center.longitude), center)
+        self._geo_index = index
+        self._geo_index_loaded = time.monotonic()
+      return index
+
+  @db.HasSession.ensured
+  def search_vaccination_centers_near(self,
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    limit: t.Optional[int] = None,
+  ) -> t.List[t.Tuple[float, VaccinationCenter]]:
+    return self._get_geo_index().query(geo.Coordinates(latitude, longitude), radius_km)[:limit]
 
   def _availability_query(self,
     vaccination_center_id: str,
     vaccine_round: t.Optional[VaccineRound],
-  ) -> 'Query[db.VaccinationCenterAvailabilityV1]':
+  ) -> Select:
 
-    query = self.session().query(db.VaccinationCenterAvailabilityV1)\
-      .filter(db.VaccinationCenterAvailabilityV1.vaccination_center_id == vaccination_center_id)\
-      .filter(db.VaccinationCenterAvailabilityV1.expires > datetime.datetime.now())
+    avail = db.VaccinationCenterAvailabilityV1
+    stmt = select(avail.vaccine_type, avail.vaccine_round, avail.dates)\
+      .where(avail.vaccination_center_id == vaccination_center_id)\
+      .where(avail.expires > datetime.datetime.now())
 
     if vaccine_round is not None:
-      query = query.filter(db.VaccinationCenterAvailabilityV1.vaccine_type == vaccine_round[0].name)
-      query = query.filter(db.VaccinationCenterAvailabilityV1.vaccine_round == vaccine_round[1])
+      stmt = stmt.where(avail.vaccine_type == vaccine_round[0].name)
+      stmt = stmt.where(avail.vaccine_round == vaccine_round[1])
 
-    return query
+    return stmt
 
   @db.HasSession.ensured
   def get_per_vaccine_round_availability(self,
@@ -86,8 +156,8 @@ class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
 
     query = self._availability_query(vaccination_center_id, None)
     result = []
-    for item in query:
-      result.append((item.get_vaccine_round(), item.get_availability_info()))
+    for vaccine_type, vaccine_round, dates in self.session().execute(query):
+      result.append((VaccineRound(VaccineType[vaccine_type], vaccine_round), db.parse_availability_info(dates)))
     return result
 
   @db.HasSession.ensured
@@ -98,8 +168,8 @@ class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
 
     query = self._availability_query(vaccination_center_id, vaccine_round)
     dates: t.Set[datetime.date] = set()
-    for result in query:
-      dates.update(result.get_availability_info().dates)
+    for _vaccine_type, _vaccine_round, values in self.session().execute(query):
+      dates.update(db.parse_availability_info(values).dates)
     return AvailabilityInfo(dates=sorted(dates))
 
   @db.HasSession.ensured
@@ -109,20 +179,31 @@ class DefaultAvailabilityStore(IAvailabilityStore, db.HasSession):
     data: AvailabilityInfo
   ) -> None:
 
+    # The expiry of the vaccination center itself is extended in bulk with
+    # #refresh_vaccination_centers().
     center = self.session().query(db.VaccinationCenterV1).get(vaccination_center_id)
     if not center:
       raise ValueError(f'Unknown vaccination center id: {vaccination_center_id!r}')
-    center.expires = datetime.datetime.now() + self.ttl
     db_obj = db.VaccinationCenterAvailabilityV1(
       vaccination_center_id=vaccination_center_id,
       vaccine_round=vaccine_round,
       availability_info=data,
-      expires=center.expires,
+      expires=datetime.datetime.now() + self.ttl,
     )
     self.session().merge(db_obj)
 
 
 class DefaultUserStore(IUSerStore, db.HasSession):
+  """
+  Stores users and their subscriptions in the database. The vaccination centers in the areas that
+  users subscribed to are found with the radius search of *avail*, which should be the store that
+  also updates the centers so that they share one geo index.
+  """
+
+  def __init__(self, session: db.ISessionProvider, avail: t.Optional[IAvailabilityStore] = None) -> None:
+    super().__init__(session)
+    # The availability store is only used for radius searches, so its TTL does not matter.
+    self.avail = avail or DefaultAvailabilityStore(session, datetime.timedelta(0))
 
   def _get_user(self, user_id: int) -> t.Optional[User]:
     userv1 = self.session().query(db.UserV1).get(user_id)
@@ -130,46 +211,70 @@ class DefaultUserStore(IUSerStore, db.HasSession):
 
   @db.HasSession.ensured
   def get_user_count(self, with_subscription_only: bool) -> int:
-    query = self.session().query(db.UserV1)
+    stmt = select(func.count(db.UserV1.id.distinct())).where(db.UserV1.blocked_at == None)
     if with_subscription_only:
-      query = query.join(db.SubscriptionV1).filter(db.SubscriptionV1.id != None)
-    return query.distinct(db.UserV1.id).count()
+      stmt = stmt.join_from(db.UserV1, db.SubscriptionV1, db.SubscriptionV1.user_id == db.UserV1.id)
+    return self.session().execute(stmt).scalar_one()
 
   @db.HasSession.ensured
   def get_users(self, offset: t.Optional[int] = None, limit: t.Optional[int] = None) -> t.List[User]:
-    query = self.session().query(db.UserV1).order_by(db.UserV1.id).offset(offset).limit(limit)
-    result = []
-    for user in query:
-      result.append(user.to_api())
-    return result
+    stmt = select(db.UserV1.id, db.UserV1.chat_id, db.UserV1.first_name)\
+      .where(db.UserV1.blocked_at == None)\
+      .order_by(db.UserV1.id)\
+      .offset(offset)\
+      .limit(limit)
+    return [User(*row) for row in self.session().execute(stmt)]
 
   @db.HasSession.ensured
   def register_user(self, user: User) -> None:
-    has_user = self._get_user(user.id)
-    if not has_user or has_user != user:
+    userv1 = self.session().query(db.UserV1).get(user.id)
+    if not userv1 or userv1.to_api() != user or userv1.blocked_at is not None:
       self.session().merge(db.UserV1(
         id=user.id,
         chat_id=user.chat_id,
         first_name=user.first_name,
-        registered_at=datetime.datetime.now()
+        registered_at=datetime.datetime.now(),
+        blocked_at=None,
       ))
 
+  @db.HasSession.ensured
+  def mark_users_blocked(self, user_ids: t.Collection[int]) -> None:
+    if not user_ids:
+      return
+    self.session().query(db.UserV1)\
+      .filter(db.UserV1.id.in_(user_ids))\
+      .filter(db.UserV1.blocked_at == None)\
+      .update({db.UserV1.blocked_at: datetime.datetime.now()}, synchronize_session=False)
+
+  @db.HasSession.ensured
+  def get_blocked_user_count(self) -> int:
+    return self.session().query(db.UserV1).filter(db.UserV1.blocked_at != None).count()
+
   @db.HasSession.ensured
   def get_subscription(self, user_id: int) -> Subscription:
+    sub = db.SubscriptionV1
+    stmt = select(sub.type, sub.vaccine_type, sub.vaccine_round, sub.vaccination_center_id, sub.vaccination_center_query,
+        sub.latitude, sub.longitude, sub.radius_km)\
+      .where(sub.user_id == user_id)\
+      .order_by(sub.id)
     result = Subscription()
-    for sub in self.session().query(db.SubscriptionV1).filter(db.SubscriptionV1.user_id == user_id):
-      if sub.type == db.SubscriptionV1.Type.VACCINE_TYPE_AND_ROUND.name:
-        assert sub.vaccine_type is not None
-        assert sub.vaccine_round is not None
-        result.vaccine_rounds.append(VaccineRound(VaccineType[sub.vaccine_type], sub.vaccine_round))
-      elif sub.type == db.SubscriptionV1.Type.VACCINATION_CENTER_ID.name:
-        assert sub.vaccination_center_id is not None
-        result.vaccination_center_ids.append(sub.vaccination_center_id)
-      elif sub.type == db.SubscriptionV1.Type.VACCINATION_CENTER_QUERY.name:
-        assert sub.vaccination_center_query is not None
-        result.vaccination_center_queries.append(sub.vaccination_center_query)
+    for type_, vaccine_type, vaccine_round, vaccination_center_id, vaccination_center_query, latitude, longitude, \
+        radius_km in self.session().execute(stmt):
+      if type_ == db.SubscriptionV1.Type.VACCINE_TYPE_AND_ROUND.name:
+        assert vaccine_type is not None
+        assert vaccine_round is not None
+        result.vaccine_rounds.append(VaccineRound(VaccineType[vaccine_type], vaccine_round))
+      elif type_ == db.SubscriptionV1.Type.VACCINATION_CENTER_ID.name:
+        assert vaccination_center_id is not None
+        result.vaccination_center_ids.append(vaccination_center_id)
+      elif type_ == db.SubscriptionV1.Type.VACCINATION_CENTER_QUERY.name:
+        assert vaccination_center_query is not None
+        result.vaccination_center_queries.append(vaccination_center_query)
+      elif type_ == db.SubscriptionV1.Type.VACCINATION_CENTER_AREA.name:
+        assert vaccination_center_query is not None
+        result.vaccination_center_areas.append(Area(vaccination_center_query, latitude, longitude, radius_km))
       else:
-        raise RuntimeError(f'unhandled subscription type: {sub.type}')
+        raise RuntimeError(f'unhandled subscription type: {type_}')
     return result
 
   @db.HasSession.ensured
@@ -196,6 +301,15 @@ class DefaultUserStore(IUSerStore, db.HasSession):
         type=db.SubscriptionV1.Type.VACCINATION_CENTER_QUERY.name,
         vaccination_center_query=vaccination_center_query,
       ))
+    for area in subscription.vaccination_center_areas:
+      s.add(db.SubscriptionV1(
+        user_id=user_id,
+        type=db.SubscriptionV1.Type.VACCINATION_CENTER_AREA.name,
+        vaccination_center_query=area.postcode,
+        latitude=area.latitude,
+        longitude=area.longitude,
+        radius_km=area.radius_km,
+      ))
 
   @db.HasSession.ensured
   def unsubscribe_user(self, user_id: int) -> None:
@@ -204,27 +318,41 @@ class DefaultUserStore(IUSerStore, db.HasSession):
 
   def _subscription_query(
     self,
+    columns: t.Sequence[t.Any],
     vaccination_center_id: t.Optional[str] = None,
     vaccine_round: t.Optional[VaccineRound] = None,
     user_id: t.Optional[int] = None,
-  ) -> Query:
+  ) -> Select:
+    """
+    Selects the *columns* for every pair of a user and a vaccination center (with availability,
+    if no *vaccination_center_id* is specified) that matches one of the user's subscriptions.
+
+    Exactly one of *vaccination_center_id* and *user_id* must be specified for subscriptions to
+    areas to match, as they are resolved with #_get_area_user_ids() or #_get_area_center_ids().
+    """
 
     now = datetime.datetime.now()
     subs1 = db.aliased(db.SubscriptionV1)
     subs2 = db.aliased(db.SubscriptionV1)
-    query = self.session().query(db.VaccinationCenterV1, db.UserV1)
-    query = query.filter(db.VaccinationCenterV1.expires > now)
+    vcenter = db.VaccinationCenterV1
+    avail = db.VaccinationCenterAvailabilityV1
+    users = join(db.UserV1, subs1, subs1.user_id == db.UserV1.id).join(subs2, subs2.user_id == db.UserV1.id)
+    if vaccination_center_id:
+      centers = vcenter.__table__
+    else:
+      centers = join(vcenter, avail, avail.vaccination_center_id == vcenter.id)
+    stmt = select(*columns).select_from(users, centers).distinct()
+    stmt = stmt.where(vcenter.expires > now)
     if vaccination_center_id:
-      query = query.filter(db.VaccinationCenterV1.id == vaccination_center_id)
+      stmt = stmt.where(vcenter.id == vaccination_center_id)
     else:
-      query = query.join(db.VaccinationCenterAvailabilityV1).add_entity(db.VaccinationCenterAvailabilityV1)
-      query = query.filter(db.VaccinationCenterAvailabilityV1.expires > now)
-      query = query.filter(db.VaccinationCenterAvailabilityV1.num_dates > 0)
-    query = query.join(subs1, subs1.user_id == db.UserV1.id).join(subs2, subs2.user_id == db.UserV1.id)
-    query = query.order_by(db.UserV1.id, db.VaccinationCenterV1.id, subs1.id, subs2.id)
+      stmt = stmt.where(avail.expires > now)
+      stmt = stmt.where(avail.num_dates > 0)
 
     if user_id is not None:
-      query = query.filter(db.UserV1.id == user_id)
+      stmt = stmt.where(db.UserV1.id == user_id)
+    else:
+      stmt = stmt.where(db.UserV1.blocked_at == None)
 
     if vaccine_round is not None:
       vaccine_type_filter: t.Union[str, db.Column] = vaccine_round[0].name
@@ -233,9 +361,9 @@ class DefaultUserStore(IUSerStore, db.HasSession):
       else:
         vaccine_round_filter = (subs1.vaccine_round == vaccine_round[1])
     else:
-      vaccine_type_filter = db.VaccinationCenterAvailabilityV1.vaccine_type
-      vaccine_round_filter = subs1.vaccine_round == db.VaccinationCenterAvailabilityV1.vaccine_round
-    query = query.filter(
+      vaccine_type_filter = avail.vaccine_type
+      vaccine_round_filter = subs1.vaccine_round == avail.vaccine_round
+    stmt = stmt.where(
       (subs1.type == subs1.Type.VACCINE_TYPE_AND_ROUND.name) &
       (subs1.vaccine_type == vaccine_type_filter) &
       vaccine_round_filter
@@ -243,17 +371,56 @@ class DefaultUserStore(IUSerStore, db.HasSession):
 
     if vaccination_center_id:
       vaccination_center_filter: t.Union[str, db.Column] = vaccination_center_id
+      area_filter = subs2.user_id.in_(self._get_area_user_ids(vaccination_center_id))
     else:
-      vaccination_center_filter = db.VaccinationCenterV1.id
-    query = query.filter((
+      vaccination_center_filter = vcenter.id
+      area_filter = vcenter.id.in_(self._get_area_center_ids(user_id)) if user_id is not None else false()
+    stmt = stmt.where((
         (subs2.type == subs2.Type.VACCINATION_CENTER_ID.name) &
         (subs2.vaccination_center_id == vaccination_center_filter)
       )|(
         (subs2.type == subs2.Type.VACCINATION_CENTER_QUERY.name) &
-        (db.VaccinationCenterV1.construct_search_query(subs2.vaccination_center_query))
+        (vcenter.construct_search_query(subs2.vaccination_center_query))
+      )|(
+        (subs2.type == subs2.Type.VACCINATION_CENTER_AREA.name) & area_filter
     ))
 
-    return query
+    return stmt
+
+  def _get_area_user_ids(self, vaccination_center_id: str) -> t.List[int]:
+    """
+    Returns the IDs of the users with a subscription to an area that contains the vaccination
+    center. Only the subscriptions within the bounding box of the largest radius around the
+    center are loaded (using the index on their latitude).
+    """
+
+    vcenter = db.VaccinationCenterV1
+    coordinates = self.session().execute(select(vcenter.latitude, vcenter.longitude)
+      .where(vcenter.id == vaccination_center_id)).first()
+    if not coordinates or None in coordinates:
+      return []
+    center = geo.Coordinates(*coordinates)
+    dlat = geo.MAX_RADIUS_KM / geo.KM_PER_DEGREE
+    dlon = dlat / max(math.cos(math.radians(center.latitude)), 1e-6)
+    sub = db.SubscriptionV1
+    stmt = select(sub.user_id, sub.latitude, sub.longitude, sub.radius_km)\
+      .where(sub.type == sub.Type.VACCINATION_CENTER_AREA.name)\
+      .where(sub.latitude.between(center.latitude - dlat, center.latitude + dlat))\
+      .where(sub.longitude.between(center.longitude - dlon, center.longitude + dlon))
+    return sorted({user_id for user_id, latitude, longitude, radius_km in self.session().execute(stmt)
+      if geo.distance_km(center, geo.Coordinates(latitude, longitude)) <= radius_km})
+
+  def _get_area_center_ids(self, user_id: int) -> t.List[str]:
+    """
+    Returns the IDs of the vaccination centers in the areas that the user subscribed to.
+    """
+
+    sub = db.SubscriptionV1
+    areas = self.session().execute(select(sub.latitude, sub.longitude, sub.radius_km)
+      .where(sub.user_id == user_id)
+      .where(sub.type == sub.Type.VACCINATION_CENTER_AREA.name)).all()
+    return sorted({center.id for latitude, longitude, radius_km in areas
+      for _distance, center in self.avail.search_vaccination_centers_near(latitude, longitude, radius_km)})
 
   @db.HasSession.ensured
   def get_users_subscribed_to(
@@ -264,13 +431,30 @@ class DefaultUserStore(IUSerStore, db.HasSession):
     limit: t.Optional[int] = None,
   ) -> t.List[User]:
 
-    query = self._subscription_query(vaccination_center_id, vaccine_round, None)
-    query = query.offset(offset).limit(limit)
-    result = []
-    user: db.UserV1
-    for _vcenter, user in query:
-      result.append(user.to_api())
-    return result
+    stmt = self._subscription_query(
+      [db.UserV1.id, db.UserV1.chat_id, db.UserV1.first_name], vaccination_center_id, vaccine_round, None)
+    stmt = stmt.order_by(db.UserV1.id).offset(offset).limit(limit)
+    return [User(*row) for row in self.session().execute(stmt)]
+
+  @db.HasSession.ensured
+  def get_subscriber_count(self, vaccination_center_id: str) -> int:
+    subs = db.aliased(db.SubscriptionV1)
+    vcenter = db.VaccinationCenterV1
+    stmt = select(func.count(subs.user_id.distinct()))\
+      .select_from(join(subs, db.UserV1, db.UserV1.id == subs.user_id), vcenter)\
+      .where(vcenter.id == vaccination_center_id)\
+      .where(db.UserV1.blocked_at == None)\
+      .where((
+          (subs.type == subs.Type.VACCINATION_CENTER_ID.name) &
+          (subs.vaccination_center_id == vaccination_center_id)
+        )|(
+          (subs.type == subs.Type.VACCINATION_CENTER_QUERY.name) &
+          (vcenter.construct_search_query(subs.vaccination_center_query))
+        )|(
+          (subs.type == subs.Type.VACCINATION_CENTER_AREA.name) &
+          subs.user_id.in_(self._get_area_user_ids(vaccination_center_id))
+      ))
+    return self.session().execute(stmt).scalar_one()
 
   @db.HasSession.ensured
   def get_relevant_availability_for_user(
@@ -278,10 +462,103 @@ class DefaultUserStore(IUSerStore, db.HasSession):
     user_id: int,
   ) -> t.List[t.Tuple[VaccinationCenter, VaccineRound, AvailabilityInfo]]:
 
-    query = self._subscription_query(None, None, user_id)
+    vcenter = db.VaccinationCenterV1
+    avail = db.VaccinationCenterAvailabilityV1
+    stmt = self._subscription_query([vcenter.id, vcenter.name, vcenter.url, vcenter.location, vcenter.latitude,
+      vcenter.longitude, avail.vaccine_type, avail.vaccine_round, avail.dates], None, None, user_id)
+    stmt = stmt.order_by(vcenter.id, avail.vaccine_type, avail.vaccine_round)
     result = []
-    vcenter: db.VaccinationCenterV1
-    availability: db.VaccinationCenterAvailabilityV1
-    for vcenter, _user, availability in query:
-      result.append((vcenter.to_api(), availability.get_vaccine_round(), availability.get_availability_info()))
+    for center_id, name, url, location, latitude, longitude, vaccine_type, vaccine_round, dates in self.session().execute(stmt):
+      result.append((
+        VaccinationCenter(center_id, name, url, location, latitude, longitude),
+        VaccineRound(VaccineType[vaccine_type], vaccine_round),
+        db.parse_availability_info(dates)))
     return result
+
+
+class DefaultNotificationStore(INotificationStore, db.HasSession):
+  """
+  Stores the notification queue in the database. Notifications are claimed with a conditional
+  `UPDATE` that only matches notifications that are not claimed (or whose lease expired), so
+  concurrent workers never claim the same notification.
+  """
+
+  @db.HasSession.ensured
+  def enqueue_notifications(self, notifications: t.Iterable[t.Tuple[User, str]]) -> None:
+    now = datetime.datetime.now()
+    self.session().bulk_insert_mappings(db.NotificationJobV1, [
+      {'user_id': user.id, 'chat_id': user.chat_id, 'text': text, 'created_at': now}
+      for user, text in notifications])
+
+  @db.HasSession.ensured
+  def claim_notifications(self,
+    worker_id: str,
+    shard: int,
+    num_shards: int,
+    limit: int,
+    lease: datetime.timedelta,
+  ) -> t.List[Notification]:
+
+    job = db.NotificationJobV1
+    now = datetime.datetime.now()
+    claimed_until = now + lease
+    claimable = (job.completed_at == None) & ((job.claimed_until == None) | (job.claimed_until < now)) & \
+      (job.user_id % num_shards == shard)
+    candidates = self.session().query(job.id).filter(claimable).order_by(job.id).limit(limit).subquery()
+    self.session().query(job)\
+      .filter(job.id.in_(candidates.select()))\
+      .filter(claimable)\
+      .update({job.claimed_by: worker_id, job.claimed_until: claimed_until}, synchronize_session=False)
+    query = self.session().query(job)\
+      .filter(job.claimed_by == worker_id)\
+      .filter(job.claimed_until == claimed_until)\
+      .filter(job.completed_at == None)\
+      .order_by(job.id)
+    return [x.to_api() for x in query]
+
+  @db.HasSession.ensured
+  def renew_claim(self, worker_id: str, notification_id: int, lease: datetime.timedelta) -> bool:
+    job = db.NotificationJobV1
+    now = datetime.datetime.now()
+    return self.session().query(job)\
+      .filter(job.id == notification_id)\
+      .filter(job.claimed_by == worker_id)\
+      .filter(job.claimed_until >= now)\
+      .filter(job.completed_at == None)\
+      .update({job.claimed_until: now + lease}, synchronize_session=False) == 1
+
+  @db.HasSession.ensured
+  def complete_notifications(self,
+    worker_id: str,
+    notification_ids: t.Collection[int],
+    error: t.Optional[str] = None,
+  ) -> int:
+
+    if not notification_ids:
+      return 0
+    job = db.NotificationJobV1
+    return self.session().query(job)\
+      .filter(job.id.in_(notification_ids))\
+      .filter(job.claimed_by == worker_id)\
+      .filter(job.completed_at == None)\
+      .update({job.completed_at: datetime.datetime.now(), job.error: error}, synchronize_session=False)
+
+  @db.HasSession.ensured
+  def get_notification_counts(self) -> t.Dict[str, int]:
+    job = db.NotificationJobV1
+    now = datetime.datetime.now()
+    query = self.session().query(job)
+    pending = query.filter(job.completed_at == None)
+    return {
+      'pending': pending.filter((job.claimed_until == None) | (job.claimed_until < now)).count(),
+      'claimed': pending.filter(job.claimed_until >= now).count(),
+      'sent': query.filter(job.completed_at != None).filter(job.error == None).count(),
+      'failed': query.filter(job.error != None).count(),
+    }
+
+  @db.HasSession.ensured
+  def prune_notifications(self, older_than: datetime.timedelta) -> int:
+    job = db.NotificationJobV1
+    return self.session().query(job)\
+      .filter(job.completed_at < datetime.datetime.now() - older_than)\
+      .delete(synchronize_session=False)
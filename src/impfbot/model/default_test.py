@@ -1,10 +1,13 @@
 
 import datetime
+import os
+import sqlite3
+import tempfile
 import typing as t
 from unittest import TestCase
 from impfbot.contrib.de.bavaria.dachau import ASTRA_2_URL
 
-from impfbot.model.api import AvailabilityInfo, VaccineRound, VaccineType, Subscription, User, VaccinationCenter
+from impfbot.model.api import Area, AvailabilityInfo, VaccineRound, VaccineType, Subscription, User, VaccinationCenter
 from . import db
 from .default import DefaultAvailabilityStore, DefaultUserStore
 
@@ -15,7 +18,7 @@ class DefaultTest(TestCase):
     db.init_database('sqlite:///:memory:')
     self.scoped_session = db.ScopedSession()
     self.avail = DefaultAvailabilityStore(self.scoped_session, datetime.timedelta(1))
-    self.users = DefaultUserStore(self.scoped_session)
+    self.users = DefaultUserStore(self.scoped_session, self.avail)
 
   def setup_test_centers(self) -> None:
     with self.scoped_session:
@@ -32,6 +35,25 @@ class DefaultTest(TestCase):
       assert set(self.avail.search_vaccination_centers('XyZ')) == set([self.xyz])
       assert set(self.avail.search_vaccination_centers('.vacc')) == set([self.abc, self.xyz])
 
+  def test_search_vaccination_centers_by_prefix(self) -> None:
+    self.setup_test_centers()
+    with self.scoped_session:
+      self.avail.upsert_vaccination_center(VaccinationCenter('abd', 'Äbd Vacc', 'https://abd.vacc', 'Vaccheim'))
+      assert self.avail.search_vaccination_centers_by_prefix('ab') == [self.abc]
+      assert self.avail.search_vaccination_centers_by_prefix('äB')[0].id == 'abd'
+      assert self.avail.search_vaccination_centers_by_prefix('XYZ vacc') == [self.xyz]
+      assert self.avail.search_vaccination_centers_by_prefix('vacc') == []
+      assert self.avail.search_vaccination_centers_by_prefix('') == self.avail.search_vaccination_centers_by_prefix('', 0, 3)
+      assert self.avail.search_vaccination_centers_by_prefix('', 1, 1) == [self.xyz]
+
+  def test_refresh_vaccination_centers(self) -> None:
+    expired = DefaultAvailabilityStore(self.scoped_session, datetime.timedelta(-1))
+    with self.scoped_session:
+      expired.upsert_vaccination_center(VaccinationCenter('abc', 'ABC Vacc', 'https://abc.vacc', 'Vaccheim'))
+      assert self.avail.search_vaccination_centers(None) == []
+      self.avail.refresh_vaccination_centers(['abc'])
+      assert [x.id for x in self.avail.search_vaccination_centers(None)] == ['abc']
+
   def setup_test_users(self) -> None:
     with self.scoped_session:
 
@@ -76,6 +98,160 @@ class DefaultTest(TestCase):
       assert set(self.users.get_users_subscribed_to(
         'xyz', VaccineRound(VaccineType.JOHNSON_AND_JOHNSON, 0))) == set([self.u4])
 
+  def test_get_subscriber_count(self) -> None:
+    self.setup_test_centers()
+    self.setup_test_users()
+    with self.scoped_session:
+      assert self.users.get_subscriber_count('abc') == 1
+      assert self.users.get_subscriber_count('xyz') == 3
+
+  def test_blocked_users_are_excluded(self) -> None:
+    self.setup_test_centers()
+    self.setup_test_users()
+    with self.scoped_session:
+      self.users.mark_users_blocked([self.u4.id])
+      assert self.users.get_blocked_user_count() == 1
+      assert self.u4 not in self.users.get_users()
+      assert self.users.get_user_count(False) == 3
+      assert self.users.get_user_count(True) == 3
+      assert set(self.users.get_users_subscribed_to(
+        'xyz', VaccineRound(VaccineType.JOHNSON_AND_JOHNSON, 0))) == set()
+      assert self.users.get_subscriber_count('xyz') == 2
+
+  def test_register_user_reactivates_blocked_user(self) -> None:
+    self.setup_test_centers()
+    self.setup_test_users()
+    with self.scoped_session:
+      self.users.mark_users_blocked([self.u4.id])
+      self.users.register_user(self.u4)
+      assert self.users.get_blocked_user_count() == 0
+      assert set(self.users.get_users_subscribed_to(
+        'xyz', VaccineRound(VaccineType.JOHNSON_AND_JOHNSON, 0))) == set([self.u4])
+
+  def setup_test_areas(self) -> None:
+    with self.scoped_session:
+      self.dachau = VaccinationCenter('dachau', 'Dachau Vacc', 'https://dachau.vacc', 'Dachau', 48.26, 11.434)
+      self.munich = VaccinationCenter('munich', 'Munich Vacc', 'https://munich.vacc', 'München', 48.137, 11.575)
+      self.avail.upsert_vaccination_center(self.dachau)
+      self.avail.upsert_vaccination_center(self.munich)
+      self.avail.set_availability('dachau', VaccineRound(VaccineType.BIONTECH, 1),
+        AvailabilityInfo(dates=[datetime.date(2021, 6, 21)]))
+      self.avail.set_availability('munich', VaccineRound(VaccineType.BIONTECH, 1),
+        AvailabilityInfo(dates=[datetime.date(2021, 6, 22)]))
+
+      # Karlsfeld is about 5 km from Dachau and 12 km from Munich.
+      self.u5 = User(5, 5, 'u5')
+      self.users.register_user(self.u5)
+      self.users.subscribe_user(self.u5.id, Subscription(
+        vaccine_rounds=[VaccineRound(VaccineType.BIONTECH, 1)],
+        vaccination_center_areas=[Area('85757', 48.2200, 11.4750, 10.0)]))
+
+  def test_search_vaccination_centers_near(self) -> None:
+    self.setup_test_centers()
+    self.setup_test_areas()
+    with self.scoped_session:
+      result = self.avail.search_vaccination_centers_near(48.2200, 11.4750, 15.0)
+      assert [center for _, center in result] == [self.dachau, self.munich]
+      assert 5 < result[0][0] < 6 and 11 < result[1][0] < 13
+      assert self.avail.search_vaccination_centers_near(48.2200, 11.4750, 15.0, limit=1) == result[:1]
+      assert self.avail.search_vaccination_centers_near(48.2200, 11.4750, 1.0) == []
+
+  def test_area_subscriptions(self) -> None:
+    self.setup_test_centers()
+    self.setup_test_areas()
+    with self.scoped_session:
+      assert self.users.get_subscription(self.u5.id) == Subscription(
+        vaccine_rounds=[VaccineRound(VaccineType.BIONTECH, 1)],
+        vaccination_center_areas=[Area('85757', 48.2200, 11.4750, 10.0)])
+      assert self.users.get_users_subscribed_to('dachau', VaccineRound(VaccineType.BIONTECH, 1)) == [self.u5]
+      assert self.users.get_users_subscribed_to('munich', VaccineRound(VaccineType.BIONTECH, 1)) == []
+      assert self.users.get_users_subscribed_to('abc', VaccineRound(VaccineType.BIONTECH, 1)) == []
+      assert self.users.get_subscriber_count('dachau') == 1
+      assert self.users.get_subscriber_count('munich') == 0
+      assert self.users.get_relevant_availability_for_user(self.u5.id) == [
+        (self.dachau, VaccineRound(VaccineType.BIONTECH, 1), AvailabilityInfo(dates=[datetime.date(2021, 6, 21)]))]
+
+  def test_migrate_schema_v2(self) -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+      filename = os.path.join(tempdir, 'v2.db')
+      conn = sqlite3.connect(filename)
+      conn.executescript('''
+        CREATE TABLE schema_version (version INTEGER PRIMARY KEY);
+        INSERT INTO schema_version VALUES (2);
+        CREATE TABLE vaccc_v1 (id VARCHAR PRIMARY KEY, name VARCHAR NOT NULL, url VARCHAR NOT NULL,
+          location VARCHAR NOT NULL, expires DATETIME NOT NULL);
+        CREATE TABLE sub_v1 (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, type VARCHAR NOT NULL,
+          vaccine_type VARCHAR, vaccine_round INTEGER, vaccination_center_id VARCHAR,
+          vaccination_center_query VARCHAR);
+        INSERT INTO sub_v1 (user_id, type, vaccination_center_query) VALUES (1, 'VACCINATION_CENTER_QUERY', '%');
+        INSERT INTO vaccc_v1 VALUES ('x', 'Xanten Vacc', 'https://x.vacc', 'Xanten', '2999-01-01 00:00:00.000000');
+      ''')
+      conn.close()
+
+      db.init_database('sqlite:///' + filename)
+      with self.scoped_session as session:
+        assert db.SchemaVersion.get(session) == db.SchemaVersion.EXPECTED_SCHEMA_VERSION
+        assert self.users.get_subscription(1) == Subscription(vaccination_center_queries=['%'])
+        assert [c.id for c in self.avail.search_vaccination_centers('xant')] == ['x']
+        self.avail.upsert_vaccination_center(VaccinationCenter('a', 'A', 'https://a', 'A', 48.0, 11.0))
+        assert self.avail.search_vaccination_centers(None)[0].latitude == 48.0
+      assert db.engine
+      db.engine.dispose()
+
+  def test_migrate_schema_v1(self) -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+      filename = os.path.join(tempdir, 'v1.db')
+      conn = sqlite3.connect(filename)
+      conn.executescript('''
+        CREATE TABLE schema_version (version INTEGER PRIMARY KEY);
+        INSERT INTO schema_version VALUES (1);
+        CREATE TABLE user_v1 (id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL,
+          first_name VARCHAR NOT NULL, registered_at DATETIME NOT NULL);
+        INSERT INTO user_v1 VALUES (1, 1, 'u1', '2021-06-01 00:00:00.000000');
+      ''')
+      conn.close()
+
+      db.init_database('sqlite:///' + filename)
+      with self.scoped_session as session:
+        assert db.SchemaVersion.get(session) == db.SchemaVersion.EXPECTED_SCHEMA_VERSION
+        assert self.users.get_users() == [User(1, 1, 'u1')]
+        self.users.mark_users_blocked([1])
+        assert self.users.get_blocked_user_count() == 1
+      assert db.engine
+      db.engine.dispose()
+
+  def test_read_replica(self) -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+      primary, replica = os.path.join(tempdir, 'primary.db'), os.path.join(tempdir, 'replica.db')
+      db.init_database('sqlite:///' + primary)
+      with self.scoped_session:
+        self.users.register_user(User(1, 1, 'u1'))
+      assert db.engine
+      db.engine.dispose()
+      source, target = sqlite3.connect(primary), sqlite3.connect(replica)
+      source.backup(target)
+      source.close()
+      target.close()
+
+      db.init_database('sqlite:///' + primary, 'sqlite:///' + replica)
+      self.addCleanup(db.engine.dispose)
+      assert db.replica_engine
+      self.addCleanup(db.replica_engine.dispose)
+      with self.scoped_session:
+        self.users.register_user(User(2, 2, 'u2'))
+      with self.scoped_session.read_only():
+        assert self.users.get_users() == [User(1, 1, 'u1')]
+      with self.scoped_session:
+        assert len(self.users.get_users()) == 2
+        # The current session is restored when the read-only session is closed.
+        with self.scoped_session.read_only():
+          assert len(self.users.get_users()) == 1
+        assert len(self.users.get_users()) == 2
+
+      with self.assertRaises(db.ReadOnlySessionError), self.scoped_session.read_only():
+        self.users.register_user(User(3, 3, 'u3'))
+        self.scoped_session().flush()
+
   def setup_test_availability(self) -> None:
     def _register(v: t.Tuple[VaccinationCenter, VaccineRound, AvailabilityInfo]) -> None:
       self.avail.set_availability(v[0].id, v[1], v[2])
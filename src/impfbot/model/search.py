@@ -0,0 +1,219 @@
+
+"""
+The full-text index for the search of vaccination centers by their name, location and URL.
+
+Search queries are split into tokens and every token must be a prefix of a token of the center,
+ignoring case and diacritics (so `munch` finds `München`). Results are ranked by relevance,
+matches in the name rank highest. The index depends on the database:
+
+* SQLite: an FTS5 table (`vaccc_fts_v1`), ranked with BM25.
+* PostgreSQL: a GIN index on the `tsvector` of the #db.VaccinationCenterV1.search_text, ranked
+  with `ts_rank()`.
+* Otherwise (or if SQLite is built without FTS5): `LIKE` conditions on the search text, ordered
+  by name.
+
+The index is created by #db.init_database() and kept in sync by the #DefaultAvailabilityStore.
+"""
+
+import abc
+import logging
+import re
+import typing as t
+import unicodedata
+import weakref
+from sqlalchemy import column, func, literal_column, select, table, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import Select
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value: str) -> str:
+  """
+  Converts *value* to lower case and removes diacritics, like the FTS5 `unicode61` tokenizer.
+  """
+
+  decomposed = unicodedata.normalize('NFKD', value.lower())
+  return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(value: str) -> t.List[str]:
+  return re.findall(r'\w+', normalize(value))
+
+
+def get_search_text(name: str, location: str, url: str) -> str:
+  return ' '.join(tokenize(name) + tokenize(location) + tokenize(url))
+
+
+class ISearchIndex(metaclass=abc.ABCMeta):
+
+  @abc.abstractmethod
+  def create(self, conn: Connection) -> None:
+    """
+    Creates the index if it does not exist and adds the vaccination centers that are missing in
+    it, e.g. after an upgrade.
+    """
+
+  @abc.abstractmethod
+  def rebuild(self, conn: Connection) -> None:
+    """
+    Rebuilds the index from the vaccination centers, e.g. after they were imported.
+    """
+
+  @abc.abstractmethod
+  def update(self, conn: Connection, vaccination_center_id: str, name: str, location: str, url: str) -> None: ...
+
+  @abc.abstractmethod
+  def delete(self, conn: Connection, vaccination_center_id: str) -> None: ...
+
+  @abc.abstractmethod
+  def search(self, stmt: Select, query: str) -> Select:
+    """
+    Filters the *stmt*, which selects from #db.VaccinationCenterV1, by the search *query* and
+    orders it by relevance. A query without tokens matches all centers.
+    """
+
+
+class LikeSearchIndex(ISearchIndex):
+  """
+  Matches the tokens with `LIKE` conditions on the #db.VaccinationCenterV1.search_text, which
+  requires a scan of the table. The search text is set by the store when a center is updated.
+  """
+
+  def create(self, conn: Connection) -> None:
+    vcenter = db.VaccinationCenterV1
+    rows = conn.execute(select(vcenter.id, vcenter.name, vcenter.location, vcenter.url)
+      .where(vcenter.search_text == None)).all()
+    for center_id, name, location, url in rows:
+      conn.execute(update(vcenter).where(vcenter.id == center_id)
+        .values(search_text=get_search_text(name, location, url)))
+    if rows:
+      logger.info('Added %d vaccination center(s) to the search index', len(rows))
+
+  def rebuild(self, conn: Connection) -> None:
+    self.create(conn)
+
+  def update(self, conn: Connection, vaccination_center_id: str, name: str, location: str, url: str) -> None:
+    pass
+
+  def delete(self, conn: Connection, vaccination_center_id: str) -> None:
+    pass
+
+  def search(self, stmt: Select, query: str) -> Select:
+    vcenter = db.VaccinationCenterV1
+    for token in tokenize(query):
+      # Tokens only contain word characters, so they need no escaping for LIKE.
+      stmt = stmt.where(vcenter.search_text.like(token + '%') | vcenter.search_text.like('% ' + token + '%'))
+    return stmt.order_by(vcenter.name)
+
+
+class Fts5SearchIndex(ISearchIndex):
+  """
+  An SQLite FTS5 table with the name, location and URL of every vaccination center.
+  """
+
+  TABLE = 'vaccc_fts_v1'
+
+  #: Weights of the name, location and URL columns for the BM25 rank.
+  WEIGHTS = (10.0, 5.0, 1.0)
+
+  _fts = table(TABLE, column('id'), column('name'), column('location'), column('url'))
+
+  def create(self, conn: Connection) -> None:
+    conn.execute(text(f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} USING fts5('
+      "id UNINDEXED, name, location, url, tokenize = 'unicode61 remove_diacritics 2')"))
+    result = conn.execute(text(f'INSERT INTO {self.TABLE} (id, name, location, url) '
+      f'SELECT id, name, location, url FROM vaccc_v1 WHERE id NOT IN (SELECT id FROM {self.TABLE})'))
+    if result.rowcount:
+      logger.info('Added %d vaccination center(s) to the search index', result.rowcount)
+
+  def rebuild(self, conn: Connection) -> None:
+    conn.execute(text(f'DELETE FROM {self.TABLE}'))
+    self.create(conn)
+
+  def update(self, conn: Connection, vaccination_center_id: str, name: str, location: str, url: str) -> None:
+    self.delete(conn, vaccination_center_id)
+    conn.execute(self._fts.insert().values(id=vaccination_center_id, name=name, location=location, url=url))
+
+  def delete(self, conn: Connection, vaccination_center_id: str) -> None:
+    conn.execute(self._fts.delete().where(self._fts.c.id == vaccination_center_id))
+
+  def search(self, stmt: Select, query: str) -> Select:
+    tokens = tokenize(query)
+    if not tokens:
+      return stmt
+    # Quoted tokens with a prefix wildcard, implicitly combined with AND.
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    rank = func.bm25(literal_column(self.TABLE), *self.WEIGHTS)
+    vcenter = db.VaccinationCenterV1
+    return stmt.join(self._fts, self._fts.c.id == vcenter.id)\
+      .where(literal_column(self.TABLE).op('MATCH')(match))\
+      .order_by(rank)
+
+
+class PostgresSearchIndex(LikeSearchIndex):
+  """
+  A GIN index on the `tsvector` of the #db.VaccinationCenterV1.search_text. The search text is
+  normalized in Python, so the `simple` configuration is used and no extension is required.
+  """
+
+  INDEX = 'ix_vaccc_v1_search_text'
+
+  def create(self, conn: Connection) -> None:
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {self.INDEX} ON vaccc_v1 '
+      "USING GIN (to_tsvector('simple', coalesce(search_text, '')))"))
+    super().create(conn)
+
+  def search(self, stmt: Select, query: str) -> Select:
+    tokens = tokenize(query)
+    if not tokens:
+      return stmt
+    vcenter = db.VaccinationCenterV1
+    vector = func.to_tsvector('simple', func.coalesce(vcenter.search_text, ''))
+    tsquery = func.to_tsquery('simple', ' & '.join(token + ':*' for token in tokens))
+    return stmt.where(vector.op('@@')(tsquery))\
+      .order_by(func.ts_rank(vector, tsquery).desc())
+
+
+_indexes: 'weakref.WeakKeyDictionary[Engine, ISearchIndex]' = weakref.WeakKeyDictionary()
+
+
+def init_index(engine: Engine) -> ISearchIndex:
+  """
+  Creates the search index that fits the database of the *engine*.
+  """
+
+  index: ISearchIndex
+  if engine.dialect.name == 'sqlite':
+    index = Fts5SearchIndex()
+  elif engine.dialect.name == 'postgresql':
+    index = PostgresSearchIndex()
+  else:
+    index = LikeSearchIndex()
+  try:
+    with engine.begin() as conn:
+      index.create(conn)
+  except OperationalError:
+    if not isinstance(index, Fts5SearchIndex):
+      raise
+    logger.warning('SQLite is built without FTS5, falling back to a search without index.')
+    index = LikeSearchIndex()
+    with engine.begin() as conn:
+      index.create(conn)
+  _indexes[engine] = index
+  return index
+
+
+def register_index(engine: Engine, index: ISearchIndex) -> None:
+  """
+  Uses the *index* for the *engine* without creating it, e.g. for a read replica.
+  """
+
+  _indexes[engine] = index
+
+
+def get_index(engine: Engine) -> ISearchIndex:
+  return _indexes.get(engine) or LikeSearchIndex()
@@ -0,0 +1,56 @@
+
+import datetime
+from unittest import TestCase
+
+from impfbot.model.api import VaccinationCenter
+from . import db, search
+from .default import DefaultAvailabilityStore
+
+
+class SearchTest(TestCase):
+
+  def setUp(self) -> None:
+    db.init_database('sqlite:///:memory:')
+    self.session = db.ScopedSession()
+    self.avail = DefaultAvailabilityStore(self.session, datetime.timedelta(1))
+    self.centers = [
+      VaccinationCenter('a', 'Praxis Dr. Müller', 'https://praxis-mueller.de', 'Fürstenfeldbruck'),
+      VaccinationCenter('b', 'Impfzentrum Dachau', 'https://impfzentrum.example', 'Dachau'),
+      VaccinationCenter('c', 'Hausarztpraxis Süd', 'https://dachau-sued.example', 'Karlsfeld'),
+      VaccinationCenter('d', 'Impfzentrum München', 'https://muenchen.example', 'München'),
+    ]
+    with self.session:
+      for center in self.centers:
+        self.avail.upsert_vaccination_center(center)
+
+  def _search(self, query: str) -> str:
+    with self.session:
+      return ''.join(c.id for c in self.avail.search_vaccination_centers(query))
+
+  def test_tokenize(self) -> None:
+    assert search.tokenize('Praxis Dr. Müller, Fürstenfeldbruck') == ['praxis', 'dr', 'muller', 'furstenfeldbruck']
+
+  def test_search(self) -> None:
+    assert self._search('dachau') == 'bc'  # The name ranks higher than the URL.
+    assert self._search('Impf') == 'bd'
+    assert self._search('impfzentrum münch') == 'd'
+    assert self._search('MUNCHEN') == 'd'
+    assert self._search('furstenf') == 'a'
+    assert self._search('praxis') == 'a'
+    assert self._search('zentrum') == ''
+    assert self._search('"') == 'abcd'
+
+  def test_search_is_updated(self) -> None:
+    with self.session:
+      self.avail.upsert_vaccination_center(VaccinationCenter('d', 'Impfzentrum Erding', 'https://erding.example', 'Erding'))
+      self.avail.delete_vaccination_center('b')
+    assert self._search('impfzentrum') == 'd'
+    assert self._search('münchen') == ''
+
+  def test_like_search(self) -> None:
+    assert db.engine
+    self.addCleanup(search._indexes.__setitem__, db.engine, search.get_index(db.engine))
+    search._indexes[db.engine] = search.LikeSearchIndex()
+    assert self._search('dachau') == 'cb'  # Ordered by name.
+    assert self._search('impfzentrum münch') == 'd'
+    assert self._search('zentrum') == ''
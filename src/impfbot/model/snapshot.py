@@ -0,0 +1,195 @@
+
+"""
+Export and import of the bot's state (vaccination centers, availability, users and subscriptions)
+as a snapshot, e.g. to move a deployment or to seed a staging instance.
+
+A snapshot is a gzip compressed stream of JSON lines. The first line is a header with the format
+version, the following lines are chunks of rows of one table each:
+
+```
+{"format": "impfbot-snapshot", "version": 1, "schema_version": 2, "created_at": "...", "tables": [...]}
+{"table": "user_v1", "columns": ["id", "chat_id", ...], "rows": [[1, 1, ...], ...]}
+```
+
+Snapshots are read from a consistent view of the database: SQLite databases are first copied
+with the online backup API (which only locks the database for the duration of every step), other
+databases are read in a single `REPEATABLE READ` transaction. Imports insert the rows in batches
+with Core statements, bypassing the ORM.
+
+    $ python -m impfbot --export-snapshot data/snapshot.jsonl.gz
+    $ python -m impfbot --import-snapshot data/snapshot.jsonl.gz
+"""
+
+import contextlib
+import datetime
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import typing as t
+from sqlalchemy import DateTime, Integer, Table, create_engine, delete, func, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import db, search
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 'impfbot-snapshot'
+VERSION = 1
+
+#: The tables in a snapshot, in an order that satisfies their foreign keys.
+TABLES: t.List[Table] = [
+  t.cast(Table, db.VaccinationCenterV1.__table__),
+  t.cast(Table, db.VaccinationCenterAvailabilityV1.__table__),
+  t.cast(Table, db.UserV1.__table__),
+  t.cast(Table, db.SubscriptionV1.__table__),
+]
+
+
+class SnapshotError(Exception):
+  """
+  Raised when a snapshot can not be imported.
+  """
+
+
+def _encode(value: t.Any) -> t.Any:
+  if isinstance(value, datetime.datetime):
+    return value.isoformat()
+  return value
+
+
+@contextlib.contextmanager
+def _consistent_connection(engine: Engine) -> t.Iterator[Connection]:
+  if engine.dialect.name != 'sqlite':
+    with engine.connect() as conn:
+      conn = conn.execution_options(isolation_level='REPEATABLE READ', stream_results=True)
+      with conn.begin():
+        yield conn
+    return
+
+  with tempfile.TemporaryDirectory() as tempdir:
+    filename = os.path.join(tempdir, 'snapshot.db')
+    source = engine.raw_connection()
+    try:
+      target = sqlite3.connect(filename)
+      try:
+        t.cast(sqlite3.Connection, source.connection).backup(target, pages=1024)
+      finally:
+        target.close()
+    finally:
+      source.close()
+    copy = create_engine('sqlite:///' + filename, future=True)
+    try:
+      with copy.connect() as conn:
+        yield conn
+    finally:
+      copy.dispose()
+
+
+def export_snapshot(fp: t.BinaryIO, engine: t.Optional[Engine] = None, chunk_size: int = 5000) -> t.Dict[str, int]:
+  """
+  Writes a snapshot of the database to the binary file *fp*, in chunks of up to *chunk_size*
+  rows. Returns the number of rows per table.
+  """
+
+  engine = engine or db.engine
+  assert engine is not None, 'database is not initialized'
+  counts: t.Dict[str, int] = {}
+  with _consistent_connection(engine) as conn, gzip.GzipFile(fileobj=fp, mode='wb', compresslevel=6) as gz:
+    header = {
+      'format': FORMAT,
+      'version': VERSION,
+      'schema_version': db.SchemaVersion.EXPECTED_SCHEMA_VERSION,
+      'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+      'tables': [table.name for table in TABLES],
+    }
+    gz.write(json.dumps(header).encode('utf8') + b'\n')
+    for table in TABLES:
+      columns = [c.name for c in table.columns]
+      counts[table.name] = 0
+      result = conn.execute(select(table).order_by(*table.primary_key.columns))
+      for rows in result.partitions(chunk_size):
+        chunk = {'table': table.name, 'columns': columns, 'rows': [[_encode(v) for v in row] for row in rows]}
+        gz.write(json.dumps(chunk, separators=(',', ':')).encode('utf8') + b'\n')
+        counts[table.name] += len(rows)
+  logger.info('Exported snapshot: %s', counts)
+  return counts
+
+
+def _read_header(gz: gzip.GzipFile) -> t.Dict[str, t.Any]:
+  try:
+    header = json.loads(gz.readline())
+  except (OSError, ValueError) as exc:
+    raise SnapshotError(f'not a snapshot: {exc}')
+  if not isinstance(header, dict) or header.get('format') != FORMAT:
+    raise SnapshotError('not a snapshot: missing header')
+  if header.get('version') != VERSION:
+    raise SnapshotError(f'unsupported snapshot version: {header.get("version")!r} (expected {VERSION})')
+  schema_version = header.get('schema_version')
+  if not isinstance(schema_version, int) or schema_version > db.SchemaVersion.EXPECTED_SCHEMA_VERSION:
+    raise SnapshotError(f'unsupported schema version: {schema_version!r} '
+      f'(expected at most {db.SchemaVersion.EXPECTED_SCHEMA_VERSION})')
+  return header
+
+
+def _reset_sequences(conn: Connection) -> None:
+  """
+  Advances the sequences of the integer primary keys past the imported rows. PostgreSQL does not
+  advance a sequence when rows are inserted with explicit keys; SQLite and MySQL do.
+  """
+
+  if conn.dialect.name != 'postgresql':
+    return
+  for table in TABLES:
+    for column in table.primary_key.columns:
+      if isinstance(column.type, Integer):
+        # setval() ignores tables without a sequence, as pg_get_serial_sequence() returns NULL.
+        conn.execute(text(f'SELECT setval(pg_get_serial_sequence(:table, :column), '
+          f'coalesce(max({column.name}), 1), max({column.name}) IS NOT NULL) FROM {table.name}'),
+          {'table': table.name, 'column': column.name})
+
+
+def import_snapshot(fp: t.BinaryIO, engine: t.Optional[Engine] = None, replace: bool = False) -> t.Dict[str, int]:
+  """
+  Loads a snapshot from the binary file *fp* into the database in a single transaction. The
+  tables must be empty, unless *replace* is set, in which case their rows are deleted first.
+  Columns that are missing in the snapshot (e.g. because it was written with an older schema)
+  take their default values, snapshots of a newer schema are rejected. The search index is
+  rebuilt and the sequences of the primary keys are reset. Returns the number of rows per table.
+  """
+
+  engine = engine or db.engine
+  assert engine is not None, 'database is not initialized'
+  tables = {table.name: table for table in TABLES}
+  counts = {name: 0 for name in tables}
+  with gzip.GzipFile(fileobj=fp, mode='rb') as gz, engine.begin() as conn:
+    _read_header(gz)
+    for table in reversed(TABLES):
+      if replace:
+        conn.execute(delete(table))
+      elif conn.execute(select(func.count()).select_from(table)).scalar():
+        raise SnapshotError(f'table {table.name!r} is not empty')
+
+    for line in gz:
+      chunk = json.loads(line)
+      table = tables.get(chunk['table'])
+      if table is None:
+        raise SnapshotError(f'unknown table {chunk["table"]!r}')
+      unknown = set(chunk['columns']) - set(table.columns.keys())
+      if unknown:
+        raise SnapshotError(f'unknown columns in table {table.name!r}: {sorted(unknown)}')
+      datetimes = [isinstance(table.columns[c].type, DateTime) for c in chunk['columns']]
+      rows = [
+        {c: datetime.datetime.fromisoformat(v) if d and v is not None else v
+          for c, d, v in zip(chunk['columns'], datetimes, row)}
+        for row in chunk['rows']
+      ]
+      if rows:
+        conn.execute(insert(table), rows)
+      counts[table.name] += len(rows)
+    _reset_sequences(conn)
+    search.get_index(engine).rebuild(conn)
+  logger.info('Imported snapshot: %s', counts)
+  return counts
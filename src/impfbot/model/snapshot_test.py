@@ -0,0 +1,77 @@
+
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase
+from sqlalchemy import create_engine, insert, select
+
+from .api import AvailabilityInfo, Subscription, User, VaccinationCenter, VaccineRound, VaccineType
+from . import db
+from .default import DefaultAvailabilityStore, DefaultUserStore
+from .snapshot import TABLES, SnapshotError, export_snapshot, import_snapshot
+
+
+class SnapshotTest(TestCase):
+
+  def setUp(self) -> None:
+    tempdir = tempfile.TemporaryDirectory()
+    self.addCleanup(tempdir.cleanup)
+    db.init_database('sqlite:///' + os.path.join(tempdir.name, 'source.db'))
+    assert db.engine
+    self.addCleanup(db.engine.dispose)
+    self.source = db.engine
+    self.target = create_engine('sqlite:///' + os.path.join(tempdir.name, 'target.db'), future=True)
+    self.addCleanup(self.target.dispose)
+    db.Base.metadata.create_all(self.target)
+
+    session = db.ScopedSession()
+    avail = DefaultAvailabilityStore(session, datetime.timedelta(days=1))
+    users = DefaultUserStore(session)
+    vaccine_round = VaccineRound(VaccineType.BIONTECH, 1)
+    with session:
+      avail.upsert_vaccination_center(VaccinationCenter('abc', 'ABC Vacc', 'https://abc.vacc', 'Vaccheim'))
+      avail.set_availability('abc', vaccine_round, AvailabilityInfo([datetime.date(2021, 11, 22)]))
+      for user_id in range(1, 11):
+        users.register_user(User(user_id, user_id, f'User {user_id}'))
+        users.subscribe_user(user_id, Subscription(vaccine_rounds=[vaccine_round], vaccination_center_ids=['abc']))
+      users.mark_users_blocked([3])
+
+  def _rows(self, engine) -> dict:
+    with engine.connect() as conn:
+      return {table.name: conn.execute(select(table)).all() for table in TABLES}
+
+  def test_roundtrip(self) -> None:
+    fp = io.BytesIO()
+    counts = export_snapshot(fp, self.source, chunk_size=3)
+    assert counts == {'vaccc_v1': 1, 'vav_v1': 1, 'user_v1': 10, 'sub_v1': 20}
+    fp.seek(0)
+    assert import_snapshot(fp, self.target) == counts
+    assert self._rows(self.target) == self._rows(self.source)
+    # New rows get keys after the imported ones.
+    with self.target.begin() as conn:
+      result = conn.execute(insert(db.SubscriptionV1.__table__).values(user_id=1, type=db.SubscriptionV1.Type.VACCINE_TYPE_AND_ROUND.name))
+      assert result.inserted_primary_key[0] == 21
+
+  def test_refuses_to_import_into_non_empty_database(self) -> None:
+    fp = io.BytesIO()
+    export_snapshot(fp, self.source)
+    fp.seek(0)
+    with self.assertRaises(SnapshotError):
+      import_snapshot(fp, self.source)
+    fp.seek(0)
+    import_snapshot(fp, self.source, replace=True)
+    assert len(self._rows(self.source)['user_v1']) == 10
+
+  def test_rejects_unsupported_version(self) -> None:
+    fp = io.BytesIO(gzip.compress(json.dumps({'format': 'impfbot-snapshot', 'version': 99}).encode() + b'\n'))
+    with self.assertRaises(SnapshotError):
+      import_snapshot(fp, self.target)
+
+  def test_rejects_newer_schema_version(self) -> None:
+    header = {'format': 'impfbot-snapshot', 'version': 1, 'schema_version': db.SchemaVersion.EXPECTED_SCHEMA_VERSION + 1}
+    fp = io.BytesIO(gzip.compress(json.dumps(header).encode() + b'\n'))
+    with self.assertRaises(SnapshotError):
+      import_snapshot(fp, self.target)
@@ -1,2 +1,3 @@
 
 from .api import IDataReceiver, IVaccinationCenter, IPlugin
+from .breaker import BreakerState, CircuitBreaker, CircuitBreakerOpen, CircuitBreakerRegistry
@@ -1,9 +1,15 @@
 
 import abc
+import concurrent.futures
 import logging
-import pkg_resources
+import threading
 import typing as t
 
+try:
+  import importlib.metadata as importlib_metadata
+except ImportError:
+  import importlib_metadata  # type: ignore
+
 from impfbot import model
 
 logger = logging.getLogger(__name__)
@@ -11,15 +17,76 @@ logger = logging.getLogger(__name__)
 
 class IPlugin(metaclass=abc.ABCMeta):
 
+  ENTRYPOINT_GROUP = 'impfbot.api.IPlugin'
+
+  def get_id(self) -> str:
+    return type(self).__module__ + '.' + type(self).__qualname__
+
   @abc.abstractmethod
   def get_vaccination_centers(self) -> t.Sequence['IVaccinationCenter']: ...
 
   @staticmethod
-  def load_plugins() -> t.List['IPlugin']:
-    result = []
-    for ep in pkg_resources.iter_entry_points('impfbot.api.IPlugin'):
-      result.append(ep.load()())
-    return result
+  def load_plugins(
+    preload: bool = True,
+    on_loaded: t.Optional[t.Callable[['IPlugin'], None]] = None,
+  ) -> t.List['IPlugin']:
+    """
+    Returns the plugins registered under the #ENTRYPOINT_GROUP. The plugins are imported and
+    instantiated lazily when they are first used. If *preload* is enabled, they are imported in
+    parallel in background threads so that startup does not have to wait for them.
+
+    *on_loaded* is called with every plugin after it was instantiated and before it is used,
+    e.g. to configure it.
+    """
+
+    entry_points = importlib_metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+      selected = entry_points.select(group=IPlugin.ENTRYPOINT_GROUP)
+    else:
+      selected = t.cast(t.Any, entry_points).get(IPlugin.ENTRYPOINT_GROUP, [])  # Python < 3.10
+    result = [_LazyPlugin(ep, on_loaded) for ep in selected]
+    if preload and result:
+      executor = concurrent.futures.ThreadPoolExecutor(len(result), thread_name_prefix='load_plugins')
+      for plugin in result:
+        executor.submit(plugin.preload)
+      executor.shutdown(wait=False)
+    return t.cast(t.List[IPlugin], result)
+
+
+class _LazyPlugin(IPlugin):
+  """
+  Imports and instantiates a plugin from an entrypoint on first use.
+  """
+
+  def __init__(self,
+    entry_point: 'importlib_metadata.EntryPoint',
+    on_loaded: t.Optional[t.Callable[[IPlugin], None]] = None,
+  ) -> None:
+    self._entry_point = entry_point
+    self._on_loaded = on_loaded
+    self._plugin: t.Optional[IPlugin] = None
+    self._lock = threading.Lock()
+
+  def get_id(self) -> str:
+    return self._entry_point.value.replace(':', '.')
+
+  def load(self) -> IPlugin:
+    with self._lock:
+      if self._plugin is None:
+        plugin = self._entry_point.load()()
+        if self._on_loaded:
+          self._on_loaded(plugin)
+        self._plugin = plugin
+      return self._plugin
+
+  def preload(self) -> None:
+    try:
+      self.load()
+    except Exception:
+      logger.exception('Unable to load plugin %s.', self.get_id())
+
+  def get_vaccination_centers(self) -> t.Sequence['IVaccinationCenter']:
+    return self.load().get_vaccination_centers()
 
 
 class IVaccinationCenter(metaclass=abc.ABCMeta):
@@ -28,7 +95,12 @@ class IVaccinationCenter(metaclass=abc.ABCMeta):
   def get_metadata(self) -> model.VaccinationCenter: ...
 
   @abc.abstractmethod
-  def check_availability(self) -> t.Dict[model.VaccineRound, model.AvailabilityInfo]: ...
+  def check_availability(self) -> t.Dict[model.VaccineRound, model.AvailabilityInfo]:
+    """
+    Retrieves the current availability from the remote. Implementations must set a timeout on
+    every request they make; a call that exceeds the poller's deadline is abandoned and counted
+    as a failure, but keeps running in the background.
+    """
 
 
 class IDataReceiver(metaclass=abc.ABCMeta):
@@ -0,0 +1,164 @@
+
+import datetime
+import enum
+import logging
+import threading
+import time
+import typing as t
+
+logger = logging.getLogger(__name__)
+T = t.TypeVar('T')
+
+
+class BreakerState(enum.Enum):
+  CLOSED = 0
+  HALF_OPEN = 1
+  OPEN = 2
+
+
+class CircuitBreakerOpen(Exception):
+  """
+  Raised by #CircuitBreaker.call() if the breaker does not allow the call.
+  """
+
+
+class CircuitBreakerTimeout(Exception):
+  """
+  Raised by #CircuitBreaker.call() if the call did not return within the breaker's *timeout*.
+  """
+
+
+class CircuitBreaker:
+  """
+  Stops calling a failing remote for an exponentially growing backoff period. The breaker opens
+  after *failure_threshold* consecutive failures. Once the backoff has elapsed, it lets a single
+  probe call through (half-open); if the probe succeeds, the breaker closes again, otherwise it
+  re-opens with twice the previous backoff, up to *max_backoff*.
+
+  If a *timeout* is specified, calls run in a separate thread and count as failed when they did
+  not return in time. The thread can not be interrupted and keeps running in the background, so
+  calls should still enforce their own (shorter) timeouts, e.g. for every HTTP request.
+  """
+
+  def __init__(self,
+    name: str,
+    failure_threshold: int = 3,
+    backoff: datetime.timedelta = datetime.timedelta(minutes=1),
+    max_backoff: datetime.timedelta = datetime.timedelta(hours=1),
+    on_state_changed: t.Optional[t.Callable[[str, BreakerState], None]] = None,
+    clock: t.Callable[[], float] = time.monotonic,
+    timeout: t.Optional[datetime.timedelta] = None,
+  ) -> None:
+
+    self.name = name
+    self.failure_threshold = failure_threshold
+    self.backoff = backoff.total_seconds()
+    self.max_backoff = max_backoff.total_seconds()
+    self.on_state_changed = on_state_changed
+    self.clock = clock
+    self.timeout = timeout.total_seconds() if timeout is not None else None
+    self._lock = threading.Lock()
+    self._state = BreakerState.CLOSED
+    self._failures = 0
+    self._current_backoff = self.backoff
+    self._open_until = 0.0
+
+  @property
+  def state(self) -> BreakerState:
+    return self._state
+
+  def _set_state(self, state: BreakerState) -> None:
+    if state == self._state:
+      return
+    self._state = state
+    if state == BreakerState.OPEN:
+      logger.warning('Circuit breaker %s opened after %d failure(s), retrying in %ds.',
+        self.name, self._failures, self._current_backoff)
+    else:
+      logger.info('Circuit breaker %s is now %s.', self.name, state.name)
+    if self.on_state_changed:
+      self.on_state_changed(self.name, state)
+
+  def allow(self) -> bool:
+    """
+    Returns True if a call may be made now. If the breaker is open and the backoff elapsed, the
+    breaker becomes half-open and this call is the probe.
+    """
+
+    with self._lock:
+      if self._state == BreakerState.CLOSED:
+        return True
+      if self._state == BreakerState.OPEN and self.clock() >= self._open_until:
+        self._set_state(BreakerState.HALF_OPEN)
+        return True
+      return False
+
+  def record_success(self) -> None:
+    with self._lock:
+      self._failures = 0
+      self._current_backoff = self.backoff
+      self._set_state(BreakerState.CLOSED)
+
+  def record_failure(self) -> None:
+    with self._lock:
+      self._failures += 1
+      if self._state == BreakerState.HALF_OPEN:
+        self._current_backoff = min(self.max_backoff, self._current_backoff * 2)
+      elif self._failures < self.failure_threshold:
+        return
+      self._open_until = self.clock() + self._current_backoff
+      self._set_state(BreakerState.OPEN)
+
+  def call(self, func: t.Callable[..., T], *args: t.Any, **kwargs: t.Any) -> T:
+    if not self.allow():
+      raise CircuitBreakerOpen(f'circuit breaker {self.name} is open')
+    try:
+      if self.timeout is None:
+        result = func(*args, **kwargs)
+      else:
+        result = self._call_with_timeout(self.timeout, func, *args, **kwargs)
+    except Exception:
+      self.record_failure()
+      raise
+    self.record_success()
+    return result
+
+  def _call_with_timeout(self, timeout: float, func: t.Callable[..., T], *args: t.Any, **kwargs: t.Any) -> T:
+    outcome: t.List[t.Tuple[bool, t.Any]] = []
+
+    def _run() -> None:
+      try:
+        outcome.append((True, func(*args, **kwargs)))
+      except BaseException as exc:
+        outcome.append((False, exc))
+
+    thread = threading.Thread(target=_run, name=f'CircuitBreaker-{self.name}', daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if not outcome:
+      raise CircuitBreakerTimeout(f'call through circuit breaker {self.name} did not return within {timeout}s')
+    ok, value = outcome[0]
+    if not ok:
+      raise value
+    return t.cast(T, value)
+
+
+class CircuitBreakerRegistry:
+  """
+  Creates one #CircuitBreaker per name (e.g. per plugin or remote host) with the same settings.
+  """
+
+  def __init__(self, **kwargs: t.Any) -> None:
+    self._kwargs = kwargs
+    self._breakers: t.Dict[str, CircuitBreaker] = {}
+    self._lock = threading.Lock()
+
+  def __iter__(self) -> t.Iterator[CircuitBreaker]:
+    return iter(list(self._breakers.values()))
+
+  def get(self, name: str) -> CircuitBreaker:
+    with self._lock:
+      breaker = self._breakers.get(name)
+      if breaker is None:
+        breaker = self._breakers[name] = CircuitBreaker(name, **self._kwargs)
+      return breaker
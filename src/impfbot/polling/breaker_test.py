@@ -0,0 +1,58 @@
+
+import datetime
+import threading
+import typing as t
+from unittest import TestCase
+
+from .breaker import BreakerState, CircuitBreaker, CircuitBreakerOpen, CircuitBreakerTimeout
+
+
+class CircuitBreakerTest(TestCase):
+
+  def setUp(self) -> None:
+    self.now = 0.0
+    self.states: t.List[BreakerState] = []
+    self.breaker = CircuitBreaker('host:abc.vacc', 2, datetime.timedelta(seconds=10),
+      datetime.timedelta(seconds=30), lambda name, state: self.states.append(state), lambda: self.now)
+
+  def _fail(self) -> None:
+    def _raise() -> None:
+      raise ValueError('remote is down')
+    with self.assertRaises(ValueError):
+      self.breaker.call(_raise)
+
+  def test_opens_and_backs_off(self) -> None:
+    self._fail()
+    assert self.breaker.state == BreakerState.CLOSED
+    self._fail()
+    assert self.breaker.state == BreakerState.OPEN
+    with self.assertRaises(CircuitBreakerOpen):
+      self.breaker.call(lambda: None)
+
+    self.now = 10.0
+    self._fail()  # The half-open probe fails, the backoff doubles.
+    self.now = 29.0
+    assert not self.breaker.allow()
+    self.now = 30.0
+    assert self.breaker.call(lambda: 42) == 42
+    assert self.breaker.state == BreakerState.CLOSED
+    assert self.states == [BreakerState.OPEN, BreakerState.HALF_OPEN, BreakerState.OPEN,
+      BreakerState.HALF_OPEN, BreakerState.CLOSED]
+
+  def test_half_open_allows_single_probe(self) -> None:
+    self._fail()
+    self._fail()
+    self.now = 10.0
+    assert self.breaker.allow()
+    assert not self.breaker.allow()
+
+  def test_timeout(self) -> None:
+    release = threading.Event()
+    breaker = CircuitBreaker('host:slow.vacc', 1, timeout=datetime.timedelta(milliseconds=10))
+    with self.assertRaises(CircuitBreakerTimeout):
+      breaker.call(release.wait)
+    release.set()
+    assert breaker.state == BreakerState.OPEN
+    with self.assertRaises(ValueError):
+      CircuitBreaker('host:abc.vacc', timeout=datetime.timedelta(seconds=5)).call(int, 'x')
+    assert CircuitBreaker('host:abc.vacc', timeout=datetime.timedelta(seconds=5)).call(int, '42') == 42
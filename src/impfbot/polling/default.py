@@ -1,55 +1,219 @@
 
+import concurrent.futures
 import datetime
 import logging
+import threading
 import time
 import typing as t
+import urllib.parse
+from impfbot.utils import trace
+from impfbot.utils.cache import ICache
 from . import api
+from .breaker import BreakerState, CircuitBreakerOpen, CircuitBreakerRegistry
+from .scheduler import AdaptiveScheduler
 
 logger = logging.getLogger(__name__)
 
 
 class DefaultPoller:
+  """
+  Polls the vaccination centers of all plugins. The list of vaccination centers is discovered from
+  the plugins every *discovery_period* (defaults to *frequency*) and cached in between, while the
+  availability of every cached center is polled whenever it is due according to the *scheduler*.
+  Without a scheduler, every center is polled every *frequency*.
+
+  Calls to a plugin go through a circuit breaker per plugin, calls to a vaccination center go
+  through a circuit breaker per remote host (taken from the center's URL), so that an outage of
+  a remote stops being polled until the breaker lets a probe through again.
+
+  While the last discovery was incomplete (a plugin failed or was skipped), it is retried every
+  *discovery_retry_interval*. A discovery is also retried when the breaker of a remote host opens,
+  as the plugin may hold stale data about the remote (e.g. an expired session token).
+
+  If a *cache* is specified, the time of the last poll is shared through it with other instances.
+  With a *concurrency* greater than one, that many vaccination centers are polled at the same
+  time; the receivers are still called from one thread at a time.
+  """
+
+  LAST_POLL_KEY = 'poller:last_poll'
+
+  def __init__(self,
+    frequency: datetime.timedelta,
+    scheduler: t.Optional[AdaptiveScheduler] = None,
+    discovery_period: t.Optional[datetime.timedelta] = None,
+    breakers: t.Optional[CircuitBreakerRegistry] = None,
+    discovery_retry_interval: datetime.timedelta = datetime.timedelta(minutes=1),
+    cache: t.Optional[ICache] = None,
+    concurrency: int = 1,
+  ) -> None:
 
-  def __init__(self, frequency: datetime.timedelta) -> None:
     self._frequency = frequency
+    self._discovery_period = discovery_period or frequency
+    self._discovery_retry_interval = discovery_retry_interval
+    self._discovery_complete = False
+    self.scheduler = scheduler or AdaptiveScheduler(frequency)
+    self.breakers = breakers or CircuitBreakerRegistry()
     self.receivers: t.List[api.IDataReceiver] = []
     self.plugins: t.List[api.IPlugin] = []
     self.last_poll: t.Optional[datetime.datetime] = None
+    self._cache = cache
+    self._dispatch_lock = threading.Lock()
+    self._executor = concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix='poll') \
+      if concurrency > 1 else None
+    self.last_discovery: t.Optional[datetime.datetime] = None
+    self._plugin_centers: t.Dict[int, t.Dict[str, api.IVaccinationCenter]] = {}
+    self._centers: t.Dict[str, api.IVaccinationCenter] = {}
+    self._last_availability: t.Dict[str, t.Dict[t.Any, t.Any]] = {}
+
+  def get_last_poll(self) -> t.Optional[datetime.datetime]:
+    """
+    Returns the time of the last poll of any instance that shares the cache with this poller,
+    or of this poller if it has no cache.
+    """
+
+    if self._cache is not None:
+      try:
+        return self._cache.get(self.LAST_POLL_KEY) or self.last_poll
+      except Exception:
+        logger.exception('Unable to read the time of the last poll from the cache.')
+    return self.last_poll
+
+  @property
+  def needs_discovery(self) -> bool:
+    """
+    True if the last discovery was incomplete or a remote host failed since.
+    """
+
+    return not self._discovery_complete
 
   def mainloop(self) -> None:
+    period = self._discovery_period.total_seconds()
+    retry_interval = self._discovery_retry_interval.total_seconds()
+    next_discovery = last_discovery = time.monotonic()
     while True:
+      now = time.monotonic()
+      if now >= next_discovery or (self.needs_discovery and now >= last_discovery + retry_interval):
+        try:
+          self.discover()
+        except Exception:
+          logger.exception('An unexpected error occurred during polling.')
+        last_discovery = now
+        if now >= next_discovery:
+          next_discovery += period * (int((now - next_discovery) / period) + 1)
       try:
-        self.poll_once()
+        self.poll_centers(self.scheduler.pop_due())
       except Exception:
         logger.exception('An unexpected error occurred during polling.')
-      time.sleep(self._frequency.total_seconds())
+      wakeup = min(next_discovery, self.scheduler.next_due() or next_discovery)
+      if self.needs_discovery:
+        wakeup = min(wakeup, last_discovery + retry_interval)
+      time.sleep(max(0.0, wakeup - time.monotonic()))
 
   def poll_once(self) -> None:
-    self.last_poll = datetime.datetime.now()
+    """
+    Discovers the vaccination centers and polls all of them once, regardless of the schedule.
+    """
+
+    self.discover()
+    self.poll_centers(list(self._centers))
+
+  def discover(self) -> None:
+    """
+    Retrieves the vaccination centers from all plugins and updates the schedule. If a plugin
+    fails, the vaccination centers it returned previously are kept.
+    """
+
+    self.last_discovery = datetime.datetime.now()
+    self._discovery_complete = False
+    complete = True
+    for plugin in self.plugins:
+      plugin_id = plugin.get_id()
+      logger.info('Polling vaccination centers for %s', plugin_id)
+      try:
+        result = self.breakers.get('plugin:' + plugin_id).call(plugin.get_vaccination_centers)
+        self._plugin_centers[id(plugin)] = {c.get_metadata().id: c for c in result}
+      except CircuitBreakerOpen as exc:
+        logger.info('Skipping vaccination centers for %s: %s', plugin_id, exc)
+        complete = False
+      except Exception:
+        logger.exception('An unexpected error occurred while polling vaccination '
+          'centers for %s.', plugin_id)
+        complete = False
+
+    centers: t.Dict[str, api.IVaccinationCenter] = {}
+    for plugin in self.plugins:
+      centers.update(self._plugin_centers.get(id(plugin), {}))
+
     dispatcher = api.IDataReceiver.Dispatcher(self.receivers)
     dispatcher.begin_polling()
     try:
-      centers: t.List[api.IVaccinationCenter] = []
-      for plugin in self.plugins:
-        plugin_id = type(plugin).__module__ + '.' + type(plugin).__qualname__
-        logger.info('Polling vaccination centers for %s', plugin_id)
-        try:
-          centers += plugin.get_vaccination_centers()
-        except Exception:
-          logger.exception('An unexpected error occurred while polling vaccination '
-            'centers for %s.', plugin_id)
-          continue
-      for center in centers:
+      for center in centers.values():
         dispatcher.on_vaccination_center(center)
-      for center in centers:
-        logger.info('Polling availability for %s', center.get_metadata().id)
-        try:
-          availability = center.check_availability()
-        except Exception:
-          logger.exception('An unexpected error occurred while checking the availability of %s',
-            center.get_metadata())
-        else:
-          for vaccine_round, data in availability.items():
-            dispatcher.on_availability_info_ready(center, vaccine_round, data)
     finally:
       dispatcher.end_polling()
+
+    self._centers = centers
+    self.scheduler.sync(centers)
+    for center_id in self._last_availability.keys() - centers.keys():
+      del self._last_availability[center_id]
+    self._discovery_complete = complete
+
+  def poll_centers(self, center_ids: t.List[str]) -> None:
+    """
+    Polls the availability of the specified vaccination centers and reschedules them.
+    """
+
+    if not center_ids:
+      return
+
+    self.last_poll = datetime.datetime.now()
+    dispatcher = api.IDataReceiver.Dispatcher(self.receivers)
+    dispatcher.begin_polling()
+    try:
+      if self._executor:
+        for future in [self._executor.submit(self._poll_center, dispatcher, c) for c in center_ids]:
+          future.result()
+      else:
+        for center_id in center_ids:
+          self._poll_center(dispatcher, center_id)
+    finally:
+      dispatcher.end_polling()
+
+    # The centers are rescheduled by now, so an outage of the cache can not stop the polling.
+    if self._cache is not None:
+      try:
+        self._cache.set(self.LAST_POLL_KEY, self.last_poll)
+      except Exception:
+        logger.exception('Unable to share the time of the last poll through the cache.')
+
+  def _poll_center(self, dispatcher: api.IDataReceiver, center_id: str) -> None:
+    with trace.span('poll', center_id=center_id) as span:
+      changed = False
+      breaker = None
+      try:
+        center = self._centers[center_id]
+        host = urllib.parse.urlparse(center.get_metadata().url).netloc
+        logger.info('Polling availability for %s', center_id)
+        breaker = self.breakers.get('host:' + host)
+        with trace.span('check_availability', host=host):
+          availability = breaker.call(center.check_availability)
+      except CircuitBreakerOpen as exc:
+        logger.info('Skipping availability for %s: %s', center_id, exc)
+        span.set_attribute('skipped', True)
+      except Exception:
+        logger.exception('An unexpected error occurred while checking the availability of %s', center_id)
+        span.set_attribute('error', True)
+        if breaker and breaker.state == BreakerState.OPEN:
+          self._discovery_complete = False
+      else:
+        # The receivers are only called from one thread at a time.
+        with self._dispatch_lock:
+          changed = center_id in self._last_availability and self._last_availability[center_id] != availability
+          span.set_attribute('changed', changed)
+          self._last_availability[center_id] = availability
+          for vaccine_round, data in availability.items():
+            with trace.span('dispatch', vaccine_type=vaccine_round.type.name, vaccine_round=vaccine_round.round):
+              dispatcher.on_availability_info_ready(center, vaccine_round, data)
+      finally:
+        with self._dispatch_lock:
+          self.scheduler.reschedule(center_id, changed)
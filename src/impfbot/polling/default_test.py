@@ -0,0 +1,119 @@
+
+import datetime
+import time
+import typing as t
+from unittest import TestCase
+
+from impfbot.model import AvailabilityInfo, VaccinationCenter, VaccineRound, VaccineType
+from impfbot.utils.cache import LocalCache
+from .api import IDataReceiver, IPlugin, IVaccinationCenter
+from .breaker import CircuitBreakerRegistry
+from .default import DefaultPoller
+
+
+class _Center(IVaccinationCenter):
+
+  def __init__(self, id: str) -> None:
+    self.vcenter = VaccinationCenter(id, id, f'https://{id}.vacc', 'Vaccheim')
+    self.vaccine_round = VaccineRound(VaccineType.BIONTECH, 0)
+    self.fail = False
+    self.latency = 0.0
+
+  def get_metadata(self) -> VaccinationCenter:
+    return self.vcenter
+
+  def check_availability(self) -> t.Dict[VaccineRound, AvailabilityInfo]:
+    time.sleep(self.latency)
+    if self.fail:
+      raise ConnectionError('remote is down')
+    return {self.vaccine_round: AvailabilityInfo([])}
+
+
+class _Plugin(IPlugin):
+
+  def __init__(self, centers: t.List[_Center]) -> None:
+    self.centers = centers
+    self.fail = False
+
+  def get_vaccination_centers(self) -> t.Sequence[IVaccinationCenter]:
+    if self.fail:
+      raise ConnectionError('remote is down')
+    return self.centers
+
+
+class _Receiver(IDataReceiver):
+
+  def __init__(self) -> None:
+    self.received: t.List[str] = []
+
+  def on_availability_info_ready(self, center: IVaccinationCenter, vaccine_round: VaccineRound, data: AvailabilityInfo) -> None:
+    self.received.append(center.get_metadata().id)
+
+
+class DefaultPollerTest(TestCase):
+
+  def setUp(self) -> None:
+    self.center = _Center('abc')
+    self.plugin = _Plugin([self.center])
+    self.poller = DefaultPoller(datetime.timedelta(minutes=20), breakers=CircuitBreakerRegistry(failure_threshold=2))
+    self.poller.plugins.append(self.plugin)
+
+  def test_needs_discovery_until_all_plugins_succeeded(self) -> None:
+    assert self.poller.needs_discovery
+    self.plugin.fail = True
+    self.poller.discover()
+    assert self.poller.needs_discovery
+    self.plugin.fail = False
+    self.poller.discover()
+    assert not self.poller.needs_discovery
+
+  def test_needs_discovery_when_host_breaker_opens(self) -> None:
+    self.poller.discover()
+    self.center.fail = True
+    self.poller.poll_centers(['abc'])
+    assert not self.poller.needs_discovery
+    self.poller.poll_centers(['abc'])
+    assert self.poller.needs_discovery
+
+  def test_last_poll_is_shared_through_cache(self) -> None:
+    cache = LocalCache()
+    poller = DefaultPoller(datetime.timedelta(minutes=20), cache=cache)
+    poller.plugins.append(self.plugin)
+    poller.discover()
+    other = DefaultPoller(datetime.timedelta(minutes=20), cache=cache)
+    assert other.get_last_poll() is None
+    poller.poll_centers(['abc'])
+    assert poller.last_poll is not None
+    assert other.get_last_poll() == poller.last_poll
+
+  def test_cache_errors_do_not_stop_polling(self) -> None:
+    class _FailingCache(LocalCache):
+      def get_many(self, keys: t.Sequence[str]) -> t.List[t.Optional[t.Any]]:
+        raise ConnectionError('cache is down')
+      def set_many(self, items: t.Mapping[str, t.Any], ttl: t.Optional[float] = None) -> None:
+        raise ConnectionError('cache is down')
+
+    centers = [_Center('c0'), _Center('c1')]
+    receiver = _Receiver()
+    poller = DefaultPoller(datetime.timedelta(minutes=20), cache=_FailingCache())
+    poller.plugins.append(_Plugin(centers))
+    poller.receivers.append(receiver)
+    poller.discover()
+    poller.poll_centers(poller.scheduler.pop_due())
+    assert sorted(receiver.received) == ['c0', 'c1']
+    assert poller.scheduler.next_due() is not None
+    assert poller.get_last_poll() == poller.last_poll
+
+  def test_concurrency(self) -> None:
+    centers = [_Center(f'c{i}') for i in range(4)]
+    for center in centers:
+      center.latency = 0.1
+    receiver = _Receiver()
+    poller = DefaultPoller(datetime.timedelta(minutes=20), concurrency=4)
+    poller.plugins.append(_Plugin(centers))
+    poller.receivers.append(receiver)
+    poller.discover()
+    started = time.perf_counter()
+    poller.poll_centers([c.vcenter.id for c in centers])
+    assert time.perf_counter() - started < 0.3
+    assert sorted(receiver.received) == ['c0', 'c1', 'c2', 'c3']
@@ -0,0 +1,63 @@
+
+import datetime
+import typing as t
+from dataclasses import dataclass, field
+
+from impfbot import model
+
+
+@dataclass(frozen=True)
+class AvailabilityDelta:
+  """
+  The change in availability of a vaccination center and vaccine round between two polls.
+  """
+
+  #: Dates that became available and should be reported to users.
+  added: t.List[datetime.date] = field(default_factory=list)
+
+  #: Dates that are no longer available.
+  removed: t.List[datetime.date] = field(default_factory=list)
+
+  def __bool__(self) -> bool:
+    return bool(self.added or self.removed)
+
+
+class AvailabilityDiffer:
+  """
+  Computes the per-date difference between the previously known and the current availability of
+  a vaccination center and vaccine round.
+
+  Dates that were last seen within the *hysteresis* window are not reported as added again when
+  they reappear. This suppresses repeated notifications for dates that flap in and out of the
+  availability between polls (e.g. because a slot is reserved and released again).
+  """
+
+  def __init__(self, hysteresis: datetime.timedelta) -> None:
+    self.hysteresis = hysteresis
+    self._last_seen: t.Dict[t.Tuple[str, model.VaccineRound], t.Dict[datetime.date, datetime.datetime]] = {}
+
+  def diff(self,
+    vaccination_center_id: str,
+    vaccine_round: model.VaccineRound,
+    old: model.AvailabilityInfo,
+    new: model.AvailabilityInfo,
+    now: t.Optional[datetime.datetime] = None,
+  ) -> AvailabilityDelta:
+
+    now = now or datetime.datetime.now()
+    old_dates, new_dates = set(old.dates), set(new.dates)
+    last_seen = self._last_seen.setdefault((vaccination_center_id, vaccine_round), {})
+
+    added = []
+    for date in sorted(new_dates - old_dates):
+      seen_at = last_seen.get(date)
+      if seen_at is None or now - seen_at > self.hysteresis:
+        added.append(date)
+
+    for date in new_dates:
+      last_seen[date] = now
+    for date, seen_at in list(last_seen.items()):
+      if now - seen_at > self.hysteresis:
+        del last_seen[date]
+
+    return AvailabilityDelta(added=added, removed=sorted(old_dates - new_dates))
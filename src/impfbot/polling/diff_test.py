@@ -0,0 +1,33 @@
+
+import datetime
+from unittest import TestCase
+
+from impfbot.model.api import AvailabilityInfo, VaccineRound, VaccineType
+from .diff import AvailabilityDelta, AvailabilityDiffer
+
+
+class AvailabilityDifferTest(TestCase):
+
+  def setUp(self) -> None:
+    self.differ = AvailabilityDiffer(datetime.timedelta(hours=1))
+    self.round = VaccineRound(VaccineType.BIONTECH, 0)
+    self.d1 = datetime.date(2021, 11, 22)
+    self.d2 = datetime.date(2021, 11, 23)
+    self.t0 = datetime.datetime(2021, 11, 21, 12, 0)
+
+  def _diff(self, old, new, minutes) -> AvailabilityDelta:
+    return self.differ.diff('abc', self.round, AvailabilityInfo(dates=old), AvailabilityInfo(dates=new),
+      self.t0 + datetime.timedelta(minutes=minutes))
+
+  def test_added_and_removed(self) -> None:
+    assert self._diff([], [self.d1], 0) == AvailabilityDelta(added=[self.d1])
+    assert self._diff([self.d1], [self.d1, self.d2], 20) == AvailabilityDelta(added=[self.d2])
+    assert self._diff([self.d1, self.d2], [self.d2], 40) == AvailabilityDelta(removed=[self.d1])
+    assert not self._diff([self.d2], [self.d2], 60)
+
+  def test_flapping_dates_are_suppressed_within_hysteresis(self) -> None:
+    assert self._diff([], [self.d1], 0).added == [self.d1]
+    assert self._diff([self.d1], [], 20).removed == [self.d1]
+    assert self._diff([], [self.d1], 40).added == []
+    assert self._diff([self.d1], [], 60).removed == [self.d1]
+    assert self._diff([], [self.d1], 121).added == [self.d1]
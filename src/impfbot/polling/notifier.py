@@ -0,0 +1,169 @@
+
+"""
+Workers that send the notifications queued in an #model.INotificationStore. Every worker
+processes one shard of the users, so the fan-out can be spread over multiple processes.
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import typing as t
+from telegram import Bot, ParseMode, TelegramError
+from telegram.error import RetryAfter
+
+from impfbot import model
+from impfbot.utils.ratelimit import TokenBucket
+from .telegram import is_chat_unreachable
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationWorker:
+  """
+  Claims the notifications of the *shard* in batches and sends them. The *rate_limit* is the
+  number of messages per second that the worker may send; it should be the bot's limit divided
+  by the number of shards.
+
+  Before every message is sent, the worker renews its claim on the notification. If the lease
+  expired in the meantime (e.g. because the worker was rate limited for a long time) and another
+  worker took over the notification, it is skipped and counted in #lost.
+
+  If a user store is specified, users that can not be reached anymore are marked as blocked.
+  """
+
+  def __init__(self,
+    bot: Bot,
+    session: model.ISessionProvider,
+    store: model.INotificationStore,
+    shard: int,
+    num_shards: int,
+    worker_id: t.Optional[str] = None,
+    batch_size: int = 100,
+    lease: datetime.timedelta = datetime.timedelta(minutes=5),
+    rate_limit: float = 25.0,
+    clock: t.Callable[[], float] = time.monotonic,
+    sleep: t.Callable[[float], None] = time.sleep,
+    users: t.Optional[model.IUSerStore] = None,
+  ) -> None:
+
+    assert 0 <= shard < num_shards, (shard, num_shards)
+    self._bot = bot
+    self._session = session
+    self._store = store
+    self._users = users
+    self.shard = shard
+    self.num_shards = num_shards
+    self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{shard}'
+    self.batch_size = batch_size
+    self.lease = lease
+    self._clock = clock
+    self._sleep = sleep
+    self._bucket = TokenBucket(rate_limit, max(rate_limit, 1.0), clock())
+    self.sent = 0
+    self.failed = 0
+    self.lost = 0
+
+  def _acquire(self) -> None:
+    while not self._bucket.try_acquire(self._clock()):
+      self._sleep(1.0 / self._bucket.rate)
+
+  def _send(self, notification: model.Notification, unreachable: t.List[int]) -> t.Optional[str]:
+    """
+    Sends the notification and returns an error message if it could not be sent. The ID of the
+    user is added to *unreachable* if the chat can not be reached anymore.
+    """
+
+    error = 'Too many retries'
+    for _attempt in range(3):
+      self._acquire()
+      try:
+        self._bot.send_message(chat_id=notification.chat_id, text=notification.text, parse_mode=ParseMode.HTML)
+        return None
+      except RetryAfter as exc:
+        logger.warning('Rate limited by Telegram, retrying after %s seconds.', exc.retry_after)
+        self._sleep(exc.retry_after)
+        error = str(exc)
+      except TelegramError as exc:
+        if is_chat_unreachable(exc):
+          unreachable.append(notification.user_id)
+        else:
+          logger.exception('An error occurred when sending message to chat_id %s', notification.chat_id)
+        return str(exc) or type(exc).__name__
+    return error
+
+  def run_once(self) -> int:
+    """
+    Claims and sends one batch of notifications. Returns the number of claimed notifications.
+    """
+
+    with self._session:
+      batch = self._store.claim_notifications(self.worker_id, self.shard, self.num_shards, self.batch_size, self.lease)
+    if not batch:
+      return 0
+
+    sent: t.List[int] = []
+    failed: t.List[t.Tuple[int, str]] = []
+    unreachable: t.List[int] = []
+    lost = 0
+    for notification in batch:
+      with self._session:
+        claimed = self._store.renew_claim(self.worker_id, notification.id, self.lease)
+      if not claimed:
+        lost += 1
+        continue
+      error = self._send(notification, unreachable)
+      if error is None:
+        sent.append(notification.id)
+      else:
+        failed.append((notification.id, error))
+
+    with self._session:
+      completed = self._store.complete_notifications(self.worker_id, sent)
+      for notification_id, error in failed:
+        completed += self._store.complete_notifications(self.worker_id, [notification_id], error)
+      if self._users and unreachable:
+        self._users.mark_users_blocked(unreachable)
+
+    # Notifications that were sent but could not be completed were taken over by another worker
+    # after the lease expired, and may be sent twice.
+    if completed < len(sent) + len(failed):
+      logger.warning('Shard %d/%d: %d of %d notification(s) were no longer claimed when completing them.',
+        self.shard, self.num_shards, len(sent) + len(failed) - completed, len(sent) + len(failed))
+      lost += len(sent) + len(failed) - completed
+
+    self.sent += len(sent)
+    self.failed += len(failed)
+    self.lost += lost
+    logger.info('Shard %d/%d: sent %d, failed %d, lost %d notification(s) (total sent %d, failed %d, lost %d).',
+      self.shard, self.num_shards, len(sent), len(failed), lost, self.sent, self.failed, self.lost)
+    return len(batch)
+
+  def mainloop(self,
+    idle_interval: float = 1.0,
+    prune_after: datetime.timedelta = datetime.timedelta(days=1),
+    stop: t.Optional[threading.Event] = None,
+  ) -> None:
+    """
+    Processes the shard until *stop* is set, waiting *idle_interval* seconds whenever the shard
+    has no pending notifications. The worker of shard zero also prunes old notifications.
+    """
+
+    stop = stop or threading.Event()
+    last_prune: t.Optional[float] = None
+    logger.info('Notification worker %s started for shard %d/%d.', self.worker_id, self.shard, self.num_shards)
+    while not stop.is_set():
+      if self.shard == 0 and (last_prune is None or self._clock() - last_prune > 3600):
+        with self._session:
+          pruned = self._store.prune_notifications(prune_after)
+        logger.info('Pruned %d notification(s).', pruned)
+        last_prune = self._clock()
+      try:
+        claimed = self.run_once()
+      except Exception:
+        logger.exception('An unexpected error occurred in the notification worker.')
+        claimed = 0
+      if not claimed:
+        stop.wait(idle_interval)
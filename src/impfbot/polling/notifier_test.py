@@ -0,0 +1,85 @@
+
+import datetime
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from telegram import Bot
+
+from impfbot.model import db, User
+from impfbot.model.default import DefaultNotificationStore
+from impfbot.utils.fakebot import FakeTelegramRequest
+from .notifier import NotificationWorker
+
+
+class NotificationWorkerTest(TestCase):
+
+  def setUp(self) -> None:
+    self.tempdir = tempfile.TemporaryDirectory()
+    db.init_database('sqlite:///' + os.path.join(self.tempdir.name, 'impfbot.db'))
+    self.session = db.ScopedSession()
+    self.store = DefaultNotificationStore(self.session)
+    self.request = FakeTelegramRequest()
+    self.bot = Bot('123456:fake', request=self.request)
+
+  def tearDown(self) -> None:
+    assert db.engine
+    db.engine.dispose()
+    self.tempdir.cleanup()
+
+  def _worker(self, shard: int, num_shards: int, worker_id: str,
+      lease: datetime.timedelta = datetime.timedelta(minutes=5)) -> NotificationWorker:
+    return NotificationWorker(self.bot, self.session, self.store, shard, num_shards,
+      worker_id, batch_size=7, lease=lease, rate_limit=1e6)
+
+  def test_claim_is_exclusive_until_lease_expires(self) -> None:
+    with self.session:
+      self.store.enqueue_notifications([(User(1, 10, 'u1'), 'a'), (User(2, 20, 'u2'), 'b')])
+    with self.session:
+      claimed = self.store.claim_notifications('w1', 0, 1, 10, datetime.timedelta(minutes=1))
+      assert [x.chat_id for x in claimed] == [10, 20]
+      assert self.store.claim_notifications('w2', 0, 1, 10, datetime.timedelta(minutes=1)) == []
+      assert self.store.complete_notifications('w2', [claimed[0].id]) == 0
+      assert self.store.complete_notifications('w1', [claimed[0].id]) == 1
+      assert self.store.get_notification_counts() == {'pending': 0, 'claimed': 1, 'sent': 1, 'failed': 0}
+    with self.session:
+      self.store.enqueue_notifications([(User(3, 30, 'u3'), 'c')])
+      assert [x.chat_id for x in self.store.claim_notifications('w1', 0, 1, 10, datetime.timedelta(seconds=-1))] == [30]
+      # Claims with an expired lease can be taken over by another worker.
+      assert [x.chat_id for x in self.store.claim_notifications('w2', 0, 1, 10, datetime.timedelta(minutes=1))] == [30]
+      assert self.store.complete_notifications('w1', [claimed[1].id], 'Forbidden') == 1
+
+  def test_skips_notifications_with_expired_claim(self) -> None:
+    with self.session:
+      self.store.enqueue_notifications([(User(1, 10, 'u1'), 'a'), (User(2, 20, 'u2'), 'b')])
+    worker = self._worker(0, 1, 'w1', lease=datetime.timedelta(seconds=-1))
+    assert worker.run_once() == 2
+    assert worker.lost == 2 and worker.sent == 0
+    assert self.request.messages == {}
+    with self.session:
+      claimed = self.store.claim_notifications('w2', 0, 1, 10, datetime.timedelta(minutes=1))
+      assert [x.chat_id for x in claimed] == [10, 20]
+      assert self.store.renew_claim('w2', claimed[0].id, datetime.timedelta(minutes=1))
+      assert not self.store.renew_claim('w1', claimed[0].id, datetime.timedelta(minutes=1))
+
+  def test_concurrent_workers_send_every_notification_once(self) -> None:
+    with self.session:
+      self.store.enqueue_notifications([(User(i, i * 10, f'u{i}'), 'hello') for i in range(1, 101)])
+
+    # Two workers per shard to make them compete for the same notifications.
+    workers = [self._worker(shard, 3, f'w{shard}.{i}') for shard in range(3) for i in range(2)]
+
+    def _run(worker: NotificationWorker) -> None:
+      while worker.run_once():
+        pass
+
+    threads = [threading.Thread(target=_run, args=(w,)) for w in workers]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    assert {chat_id: len(m) for chat_id, m in self.request.messages.items()} == {i * 10: 1 for i in range(1, 101)}
+    assert sum(w.sent for w in workers) == 100
+    with self.session:
+      assert self.store.get_notification_counts() == {'pending': 0, 'claimed': 0, 'sent': 100, 'failed': 0}
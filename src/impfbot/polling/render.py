@@ -0,0 +1,176 @@
+
+"""
+Formatting of availability for Telegram messages and a cache for the rendered messages.
+"""
+
+import functools
+import hashlib
+import logging
+import threading
+import typing as t
+import cachetools
+from nr.stream import Stream
+
+from impfbot import model
+from impfbot.utils import locale
+from impfbot.utils.cache import ICache, LocalCache
+from impfbot.utils.locale import get as _
+from . import api
+
+logger = logging.getLogger(__name__)
+
+AvailabilityItem = t.Tuple[model.VaccinationCenter, model.VaccineRound, model.AvailabilityInfo]
+
+
+def format_dates(data: model.AvailabilityInfo) -> str:
+  return ', '.join(d.strftime('%Y-%m-%d') for d in data.dates)
+
+
+def format_availability_html(
+  vcenter: model.VaccinationCenter,
+  vaccine_round: model.VaccineRound,
+  data: model.AvailabilityInfo,
+  long: bool = True
+) -> str:
+
+  return _('notification.immediate',
+    vaccine_name=vaccine_round.to_text(),
+    link=vcenter.url,
+    name=vcenter.name,
+    dates=format_dates(data))
+
+
+def format_availability_line_html(vcenter: model.VaccinationCenter, data: model.AvailabilityInfo) -> str:
+  return f'• <a href="{vcenter.url}">{vcenter.name}</a>: {format_dates(data)}'
+
+
+def format_availability_summary_html(
+  availability: t.Iterable[AvailabilityItem],
+  format_line: t.Callable[[model.VaccinationCenter, model.VaccineRound, model.AvailabilityInfo], str] =
+    lambda vcenter, _round, data: format_availability_line_html(vcenter, data),
+) -> str:
+  """
+  Formats the availability grouped by vaccine round, one line per vaccination center.
+  """
+
+  lines = []
+  availability = sorted(availability, key=lambda t: (t[1].type.name, t[1].round))
+  for vaccine_round, values in Stream(availability).groupby(lambda t: t[1]):
+    lines.append(f'<b>{vaccine_round.to_text()}</b>')
+    for vcenter, vaccine_round, data in values:
+      lines.append(format_line(vcenter, vaccine_round, data))
+    lines.append('')
+  return '\n'.join(lines)
+
+
+class AvailabilityRenderCache(api.IDataReceiver):
+  """
+  Caches rendered availability messages and the availability relevant to a user.
+
+  Rendered fragments are keyed by the vaccination center, vaccine round, the set of dates and the
+  locale, so they stay valid as long as they are in the cache and are shared between all users
+  whose messages contain them. They are stored in the *cache*, which may be shared with other
+  instances of the bot, for *fragment_ttl* seconds. The availability relevant to a user is keyed
+  by the user and their subscription and is dropped at the end of every poll cycle (the poll
+  generation), so it is always kept in the process. If the *cache* fails, the fragments are
+  rendered without it.
+  """
+
+  def __init__(self, maxsize: int = 4096, cache: t.Optional[ICache] = None, fragment_ttl: float = 24 * 3600) -> None:
+    self._lock = threading.Lock()
+    self._fragments = cache if cache is not None else LocalCache(maxsize)
+    self._fragment_ttl = fragment_ttl
+    self._user_availability: t.MutableMapping[t.Hashable, t.List[AvailabilityItem]] = cachetools.LRUCache(maxsize)
+    self.generation = 0
+    self.hits = 0
+    self.misses = 0
+
+  def end_polling(self) -> None:
+    with self._lock:
+      self.generation += 1
+      self._user_availability.clear()
+
+  def on_availability_info_ready(self,
+    center: api.IVaccinationCenter,
+    vaccine_round: model.VaccineRound,
+    data: model.AvailabilityInfo
+  ) -> None:
+    pass
+
+  def _get(self, cache: t.MutableMapping[t.Hashable, t.Any], key: t.Hashable, func: t.Callable[[], t.Any]) -> t.Any:
+    with self._lock:
+      try:
+        result = cache[key]
+      except KeyError:
+        self.misses += 1
+        generation = self.generation
+      else:
+        self.hits += 1
+        return result
+    result = func()
+    with self._lock:
+      # Don't store results that were loaded while the poll generation changed.
+      if generation == self.generation:
+        cache[key] = result
+    return result
+
+  @staticmethod
+  def _fragment_key(*parts: t.Any) -> str:
+    return 'render:' + hashlib.sha1(repr(parts).encode('utf8')).hexdigest()
+
+  def _get_fragments(self, keys: t.Sequence[str], funcs: t.Sequence[t.Callable[[], str]]) -> t.List[str]:
+    """
+    Looks up all *keys* with a single request to the cache and renders the missing fragments
+    with the corresponding *funcs*.
+    """
+
+    try:
+      results = self._fragments.get_many(keys)
+    except Exception as exc:
+      logger.warning('Unable to look up rendered fragments in the cache: %s', exc)
+      results = [None] * len(keys)
+    missing = {}
+    for index, (key, result) in enumerate(zip(keys, results)):
+      if result is None:
+        results[index] = missing[key] = funcs[index]()
+    with self._lock:
+      self.hits += len(keys) - len(missing)
+      self.misses += len(missing)
+    if missing:
+      try:
+        self._fragments.set_many(missing, self._fragment_ttl)
+      except Exception as exc:
+        logger.warning('Unable to store rendered fragments in the cache: %s', exc)
+    return t.cast(t.List[str], results)
+
+  def format_availability_html(self,
+    vcenter: model.VaccinationCenter,
+    vaccine_round: model.VaccineRound,
+    data: model.AvailabilityInfo
+  ) -> str:
+
+    key = self._fragment_key('notification', vcenter, vaccine_round, tuple(data.dates), locale.get_locale().name)
+    return self._get_fragments([key], [lambda: format_availability_html(vcenter, vaccine_round, data)])[0]
+
+  def format_availability_summary_html(self, availability: t.Iterable[AvailabilityItem]) -> str:
+    availability = list(availability)
+    keys = [self._fragment_key('line', vcenter, tuple(data.dates)) for vcenter, _round, data in availability]
+    funcs = [functools.partial(format_availability_line_html, vcenter, data) for vcenter, _round, data in availability]
+    lines = {(id(vcenter), id(data)): line for (vcenter, _round, data), line
+      in zip(availability, self._get_fragments(keys, funcs))}
+    return format_availability_summary_html(availability,
+      lambda vcenter, _round, data: lines[id(vcenter), id(data)])
+
+  def get_relevant_availability_for_user(self,
+    user_id: int,
+    subscription: model.Subscription,
+    load: t.Callable[[], t.List[AvailabilityItem]],
+  ) -> t.List[AvailabilityItem]:
+    """
+    Returns the availability relevant to the user with the given *subscription* from the cache,
+    or calls *load* to retrieve it.
+    """
+
+    key = (user_id, tuple(subscription.vaccine_rounds), tuple(subscription.vaccination_center_ids),
+      tuple(subscription.vaccination_center_queries), tuple(subscription.vaccination_center_areas))
+    return self._get(self._user_availability, key, load)
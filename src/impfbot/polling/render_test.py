@@ -0,0 +1,62 @@
+
+import datetime
+import os
+import typing as t
+from unittest import TestCase
+
+from impfbot.model.api import AvailabilityInfo, Subscription, VaccinationCenter, VaccineRound, VaccineType
+from impfbot.utils import locale
+from impfbot.utils.cache import LocalCache
+from .render import AvailabilityRenderCache, format_availability_summary_html
+
+
+class _FailingCache(LocalCache):
+
+  def get_many(self, keys: t.Sequence[str]) -> t.List[t.Optional[t.Any]]:
+    raise ConnectionError('cache is down')
+
+  def set_many(self, items: t.Mapping[str, t.Any], ttl: t.Optional[float] = None) -> None:
+    raise ConnectionError('cache is down')
+
+
+class AvailabilityRenderCacheTest(TestCase):
+
+  def setUp(self) -> None:
+    locale.load(os.path.join(os.path.dirname(__file__), '..', '..', 'locale', 'de.yml'))
+    self.cache = AvailabilityRenderCache()
+    self.abc = VaccinationCenter('abc', 'ABC Vacc', 'https://abc.vacc', 'Vaccheim')
+    self.items = [(self.abc, VaccineRound(VaccineType.BIONTECH, 0), AvailabilityInfo(dates=[datetime.date(2021, 11, 22)]))]
+
+  def test_summary_fragments_are_shared(self) -> None:
+    assert self.cache.format_availability_summary_html(self.items) == format_availability_summary_html(self.items)
+    self.cache.format_availability_summary_html(self.items)
+    assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+  def test_user_availability_expires_with_poll_generation(self) -> None:
+    loads = []
+    def _load():
+      loads.append(1)
+      return self.items
+    subscription = Subscription(vaccine_rounds=[VaccineRound(VaccineType.BIONTECH, 0)], vaccination_center_ids=['abc'])
+    assert self.cache.get_relevant_availability_for_user(1, subscription, _load) == self.items
+    self.cache.get_relevant_availability_for_user(1, subscription, _load)
+    assert len(loads) == 1
+    self.cache.end_polling()
+    self.cache.get_relevant_availability_for_user(1, subscription, _load)
+    assert len(loads) == 2
+
+  def test_fragments_are_shared_between_instances(self) -> None:
+    shared = LocalCache()
+    first = AvailabilityRenderCache(cache=shared)
+    second = AvailabilityRenderCache(cache=shared)
+    first.format_availability_summary_html(self.items)
+    first.format_availability_html(*self.items[0])
+    second.format_availability_summary_html(self.items)
+    second.format_availability_html(*self.items[0])
+    assert (first.hits, first.misses) == (0, 2)
+    assert (second.hits, second.misses) == (2, 0)
+
+  def test_renders_without_failing_cache(self) -> None:
+    cache = AvailabilityRenderCache(cache=_FailingCache())
+    assert cache.format_availability_summary_html(self.items) == format_availability_summary_html(self.items)
+    assert cache.format_availability_html(*self.items[0]) == AvailabilityRenderCache().format_availability_html(*self.items[0])
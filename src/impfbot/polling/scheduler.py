@@ -0,0 +1,141 @@
+
+import datetime
+import heapq
+import math
+import random
+import time
+import typing as t
+from dataclasses import dataclass
+
+
+@dataclass
+class _Entry:
+  due: float
+  interval: float
+  weight: float = 0.0
+
+
+class AdaptiveScheduler:
+  """
+  Keeps track of the next poll time of every vaccination center in a priority queue. The poll
+  interval of a center adapts to how often its availability changes: it is halved when a poll
+  saw a change and grows by 25% otherwise, always staying between *min_interval* and
+  *max_interval*. Intervals are stretched by *night_factor* between *night_hours* and shrunk for
+  centers with a high *priority* (e.g. the number of subscribers), and a random *jitter* (as a
+  fraction of the interval) spreads out polls of centers that would otherwise be due together.
+
+  Next poll times are advanced from the previous due time rather than from the time the poll
+  finished, so ticks do not drift when polls take long. If a poll overruns one or more ticks,
+  the missed ticks are skipped.
+
+  # Arguments
+  priority: A function that returns a weight >= 0 for a vaccination center ID. It is called
+    for every center in #sync().
+  on_interval_changed: Called with the effective interval of a vaccination center whenever it
+    is rescheduled, and with `None` when the center is removed.
+  clock: The monotonic clock to use.
+  """
+
+  def __init__(self,
+    base_interval: datetime.timedelta,
+    min_interval: t.Optional[datetime.timedelta] = None,
+    max_interval: t.Optional[datetime.timedelta] = None,
+    jitter: float = 0.0,
+    night_hours: t.Tuple[int, int] = (0, 0),
+    night_factor: float = 1.0,
+    priority: t.Optional[t.Callable[[str], float]] = None,
+    on_interval_changed: t.Optional[t.Callable[[str, t.Optional[float]], None]] = None,
+    clock: t.Callable[[], float] = time.monotonic,
+  ) -> None:
+
+    self.base_interval = base_interval.total_seconds()
+    self.min_interval = (min_interval or base_interval).total_seconds()
+    self.max_interval = (max_interval or base_interval).total_seconds()
+    self.jitter = jitter
+    self.night_hours = night_hours
+    self.night_factor = night_factor
+    self.priority = priority
+    self.on_interval_changed = on_interval_changed
+    self.clock = clock
+    self._entries: t.Dict[str, _Entry] = {}
+    self._heap: t.List[t.Tuple[float, float, str]] = []
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def _push(self, center_id: str, entry: _Entry) -> None:
+    heapq.heappush(self._heap, (entry.due, -entry.weight, center_id))
+
+  def _is_night(self) -> bool:
+    start, end = self.night_hours
+    hour = datetime.datetime.now().hour
+    return (start <= hour < end) if start <= end else (hour >= start or hour < end)
+
+  def sync(self, center_ids: t.Iterable[str]) -> None:
+    """
+    Adds vaccination centers that are not yet scheduled (due immediately), removes those that
+    are not in *center_ids* and updates the priority of all centers.
+    """
+
+    center_ids = set(center_ids)
+    now = self.clock()
+    for center_id in center_ids:
+      weight = self.priority(center_id) if self.priority else 0.0
+      if center_id in self._entries:
+        self._entries[center_id].weight = weight
+      else:
+        entry = self._entries[center_id] = _Entry(now, self.base_interval, weight)
+        self._push(center_id, entry)
+    for center_id in self._entries.keys() - center_ids:
+      del self._entries[center_id]
+      if self.on_interval_changed:
+        self.on_interval_changed(center_id, None)
+
+  def next_due(self) -> t.Optional[float]:
+    while self._heap:
+      due, _weight, center_id = self._heap[0]
+      entry = self._entries.get(center_id)
+      if entry and entry.due == due:
+        return due
+      heapq.heappop(self._heap)  # Stale entry.
+    return None
+
+  def pop_due(self, now: t.Optional[float] = None) -> t.List[str]:
+    """
+    Returns the IDs of all vaccination centers that are due, the ones with the highest priority
+    first. The centers must be passed to #reschedule() after they were polled.
+    """
+
+    now = self.clock() if now is None else now
+    result = []
+    while True:
+      due = self.next_due()
+      if due is None or due > now:
+        break
+      result.append(heapq.heappop(self._heap)[2])
+    return result
+
+  def reschedule(self, center_id: str, changed: bool, now: t.Optional[float] = None) -> None:
+    entry = self._entries.get(center_id)
+    if entry is None:
+      return
+
+    if changed:
+      entry.interval = max(self.min_interval, entry.interval / 2)
+    else:
+      entry.interval = min(self.max_interval, entry.interval * 1.25)
+
+    interval = entry.interval / (1 + math.log10(1 + max(entry.weight, 0.0)))
+    if self._is_night():
+      interval *= self.night_factor
+    interval = min(self.max_interval, max(self.min_interval, interval))
+    interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    now = self.clock() if now is None else now
+    entry.due += interval
+    if entry.due <= now:
+      entry.due += (math.floor((now - entry.due) / interval) + 1) * interval
+    self._push(center_id, entry)
+
+    if self.on_interval_changed:
+      self.on_interval_changed(center_id, interval)
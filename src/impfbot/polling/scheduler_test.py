@@ -0,0 +1,48 @@
+
+import datetime
+import typing as t
+from unittest import TestCase
+
+from .scheduler import AdaptiveScheduler
+
+
+class AdaptiveSchedulerTest(TestCase):
+
+  def setUp(self) -> None:
+    self.now = 0.0
+    self.intervals: t.Dict[str, t.Optional[float]] = {}
+    self.scheduler = AdaptiveScheduler(
+      datetime.timedelta(minutes=20),
+      datetime.timedelta(minutes=5),
+      datetime.timedelta(minutes=60),
+      priority=lambda center_id: 99 if center_id == 'hot' else 0,
+      on_interval_changed=self.intervals.__setitem__,
+      clock=lambda: self.now)
+
+  def test_adapts_interval_to_changes(self) -> None:
+    self.scheduler.sync(['abc', 'hot'])
+    assert self.scheduler.pop_due() == ['hot', 'abc']
+    self.scheduler.reschedule('abc', changed=True)
+    self.scheduler.reschedule('hot', changed=False)
+    assert self.intervals['abc'] == 10 * 60
+    assert self.intervals['hot'] == 25 * 60 / 3
+    for _ in range(10):
+      self.scheduler.reschedule('abc', changed=False)
+    assert self.intervals['abc'] == 60 * 60
+
+  def test_ticks_do_not_drift(self) -> None:
+    self.scheduler.sync(['abc'])
+    self.scheduler.pop_due()
+    self.now = 30.0  # The poll took 30 seconds.
+    self.scheduler.reschedule('abc', changed=True)
+    assert self.scheduler.next_due() == 10 * 60
+    self.now = 25 * 60.0  # The poll overran the next tick.
+    assert self.scheduler.pop_due() == ['abc']
+    self.scheduler.reschedule('abc', changed=True)
+    assert self.scheduler.next_due() == 30 * 60
+
+  def test_sync_removes_centers(self) -> None:
+    self.scheduler.sync(['abc', 'xyz'])
+    self.scheduler.sync(['xyz'])
+    assert self.scheduler.pop_due() == ['xyz']
+    assert self.intervals == {'abc': None}
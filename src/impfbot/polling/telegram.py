@@ -1,28 +1,69 @@
 
+import concurrent.futures
+import datetime
 import logging
 import typing as t
 from telegram import Bot, TelegramError, ParseMode
+from telegram.error import BadRequest, Unauthorized
 
 from impfbot import model
+from impfbot.utils import trace
 from impfbot.utils.locale import get as _
-from . import api
+from . import api, render
+from .diff import AvailabilityDiffer
 
 logger = logging.getLogger(__name__)
 
 
+def is_chat_unreachable(exc: TelegramError) -> bool:
+  """
+  Returns True if the error means that messages can not be sent to the chat anymore, i.e. the
+  user blocked the bot, deactivated their account or the chat does not exist.
+  """
+
+  return isinstance(exc, Unauthorized) or (isinstance(exc, BadRequest) and 'chat not found' in exc.message.lower())
+
+
 class TelegramAvailabilityDispatcher(api.IDataReceiver):
+  """
+  Notifies subscribed users about new availability. All changes relevant to a user are collected
+  and sent as a single message once the *coalesce_window* has elapsed since the first pending
+  change, checked at the end of every poll cycle. With the default window of zero, the changes
+  are sent at the end of every poll cycle.
+
+  If an *executor* is specified, the messages are sent by the executor instead of the polling
+  thread. If a *notification_store* is specified, the messages are not sent but queued in the
+  store for the notification workers (see #notifier.NotificationWorker).
+
+  Users that can not be reached anymore are marked as blocked in the user store.
+  """
 
   def __init__(self,
     bot: Bot,
     session: model.ISessionProvider,
     avail: model.IAvailabilityStore,
-    users: model.IUSerStore
+    users: model.IUSerStore,
+    coalesce_window: datetime.timedelta = datetime.timedelta(0),
+    render_cache: t.Optional[render.AvailabilityRenderCache] = None,
+    executor: t.Optional[concurrent.futures.Executor] = None,
+    notification_store: t.Optional[model.INotificationStore] = None,
   ) -> None:
 
     self._session = session
     self._bot = bot
     self._avail = avail
     self._users = users
+    self._coalesce_window = coalesce_window
+    self._render = render_cache or render.AvailabilityRenderCache()
+    self._executor = executor
+    self._notification_store = notification_store
+    #: The pending changes per user, along with the trace of the first change.
+    self._pending: t.Dict[int, t.Tuple[model.User, t.List[render.AvailabilityItem], t.Optional[trace.SpanContext]]] = {}
+    self._pending_since: t.Optional[datetime.datetime] = None
+
+  def end_polling(self) -> None:
+    if self._pending_since and datetime.datetime.now() - self._pending_since >= self._coalesce_window:
+      self.flush()
 
   def on_availability_info_ready(self,
     center: api.IVaccinationCenter,
@@ -34,49 +75,115 @@ class TelegramAvailabilityDispatcher(api.IDataReceiver):
       return
 
     vcenter = center.get_metadata()
-    logger.info('Dispatching availability for %s at %s.', vaccine_round, vcenter.id)
-
-    with self._session:
-      for user in self._users.get_users_subscribed_to(vcenter.id, vaccine_round):
-        try:
-          self._bot.send_message(
-            chat_id=user.chat_id,
-            text=self.format_availability_html(vcenter, vaccine_round, data),
-            parse_mode=ParseMode.HTML,
-          )
-        except TelegramError:
-          logger.exception('An error occurred when sending message to chat_id %s', user.chat_id)
+    logger.info('Collecting availability for %s at %s.', vaccine_round, vcenter.id)
+
+    # A subscription that was changed a moment ago may be missed, so it is read from the replica.
+    with trace.span('collect_subscribers') as span, self._session.read_only():
+      users = self._users.get_users_subscribed_to(vcenter.id, vaccine_round)
+      span.set_attribute('users', len(users))
+    context = trace.current_context()
+    for user in users:
+      items = self._pending.setdefault(user.id, (user, [], context))[1]
+      self._merge_item(items, (vcenter, vaccine_round, data))
+    if users and self._pending_since is None:
+      self._pending_since = datetime.datetime.now()
 
   @staticmethod
-  def format_availability_html(
-    vcenter: model.VaccinationCenter,
-    vaccine_round: model.VaccineRound,
-    data: model.AvailabilityInfo,
-    long: bool = True
-  ) -> str:
+  def _merge_item(items: t.List[render.AvailabilityItem], item: render.AvailabilityItem) -> None:
+    """
+    Adds the *item* to the pending *items* of a user. If dates for the same vaccination center and
+    round are already pending (e.g. from an earlier poll cycle in the coalesce window), the dates
+    are merged so that the center is listed only once.
+    """
+
+    vcenter, vaccine_round, data = item
+    for index, (other_vcenter, other_round, other_data) in enumerate(items):
+      if other_vcenter.id == vcenter.id and other_round == vaccine_round:
+        dates = sorted(set(other_data.dates) | set(data.dates))
+        items[index] = (vcenter, vaccine_round, model.AvailabilityInfo(dates=dates))
+        return
+    items.append(item)
+
+  def flush(self) -> None:
+    """
+    Sends one message to every user with pending changes.
+    """
+
+    pending, self._pending, self._pending_since = self._pending, {}, None
+    logger.info('Dispatching availability to %d user(s).', len(pending))
+    messages = [(user, self._format_message(items), context) for user, items, context in pending.values()]
+    if self._notification_store:
+      with self._session:
+        self._notification_store.enqueue_notifications((user, text) for user, text, _context in messages)
+      return
+    for user, text, context in messages:
+      if self._executor:
+        self._executor.submit(self._send, user, text, context)
+      else:
+        self._send(user, text, context)
+
+  def _format_message(self, items: t.List[render.AvailabilityItem]) -> str:
+    if len(items) == 1:
+      return self._render.format_availability_html(*items[0])
+    return _('notification.digest_header') + '\n\n' + self._render.format_availability_summary_html(items)
+
+  def _send(self, user: model.User, text: str, context: t.Optional[trace.SpanContext] = None) -> None:
+    with trace.span('send_message', context, child_only=True, chat_id=user.chat_id) as span:
+      try:
+        self._bot.send_message(chat_id=user.chat_id, text=text, parse_mode=ParseMode.HTML)
+      except TelegramError as exc:
+        span.set_attribute('error', type(exc).__name__)
+        if is_chat_unreachable(exc):
+          logger.info('Marking user %s as blocked: %s', user.id, exc)
+          with self._session:
+            self._users.mark_users_blocked([user.id])
+        else:
+          logger.exception('An error occurred when sending message to chat_id %s', user.chat_id)
 
-    return _('notification.immediate',
-      vaccine_name=vaccine_round.to_text(),
-      link=vcenter.url,
-      name=vcenter.name,
-      dates=', '.join(d.strftime('%Y-%m-%d') for d in data.dates))
+  format_availability_html = staticmethod(render.format_availability_html)
+  format_availability_summary_html = staticmethod(render.format_availability_summary_html)
 
 
 class TelegramAvailabilityRecorder(api.IDataReceiver):
+  """
+  Records vaccination centers and their availability in the store and dispatches the dates that
+  became available to *dispatch_on_change*. Vaccination centers are only written to the store
+  when their metadata changed, and the lifetime of all centers polled in a cycle is extended in
+  bulk at the end of the cycle.
+  """
 
   def __init__(self,
     session: model.ISessionProvider,
     avail: model.IAvailabilityStore,
-    dispatch_on_change: api.IDataReceiver
+    dispatch_on_change: api.IDataReceiver,
+    differ: t.Optional[AvailabilityDiffer] = None,
   ) -> None:
 
     self._session = session
     self._avail = avail
     self._dispatch_on_change = dispatch_on_change
+    self._differ = differ or AvailabilityDiffer(datetime.timedelta(0))
+    self._known_centers: t.Dict[str, model.VaccinationCenter] = {}
+    self._polled_center_ids: t.Set[str] = set()
+
+  def begin_polling(self) -> None:
+    self._polled_center_ids.clear()
+    self._dispatch_on_change.begin_polling()
+
+  def end_polling(self) -> None:
+    try:
+      if self._polled_center_ids:
+        with self._session:
+          self._avail.refresh_vaccination_centers(self._polled_center_ids)
+    finally:
+      self._dispatch_on_change.end_polling()
 
   def on_vaccination_center(self, center: api.IVaccinationCenter) -> None:
-    with self._session:
-      self._avail.upsert_vaccination_center(center.get_metadata())
+    vcenter = center.get_metadata()
+    if self._known_centers.get(vcenter.id) != vcenter:
+      with self._session:
+        self._avail.upsert_vaccination_center(vcenter)
+      self._known_centers[vcenter.id] = vcenter
 
   def on_availability_info_ready(self,
     center: api.IVaccinationCenter,
@@ -85,15 +192,20 @@ class TelegramAvailabilityRecorder(api.IDataReceiver):
   ) -> None:
 
     vcenter = center.get_metadata()
+    self._polled_center_ids.add(vcenter.id)
 
-    with self._session:
-      # If the dates changed significantly, (i.e. new dates became available, we ignore if
-      # old dates are no longer available), we continue to dispatch.
+    with trace.span('record'), self._session:
       last_data = self._avail.get_availability(vcenter.id, vaccine_round)
       self._avail.set_availability(vcenter.id, vaccine_round, data)
 
-    if not set(data.dates).issubset(set(last_data.dates)):
+    # Only dates that became available are dispatched, we ignore if old dates are no longer
+    # available.
+    delta = self._differ.diff(vcenter.id, vaccine_round, last_data, data)
+    if delta.removed:
+      logger.debug('Dates no longer available for %s at %s: %s', vaccine_round, vcenter.id, delta.removed)
+    if delta.added:
       try:
-        self._dispatch_on_change.on_availability_info_ready(center, vaccine_round, data)
+        self._dispatch_on_change.on_availability_info_ready(
+          center, vaccine_round, model.AvailabilityInfo(dates=delta.added))
       except Exception:
         logger.exception('An unexpected error occurred during dispatch.')
@@ -0,0 +1,85 @@
+
+import datetime
+import os
+import typing as t
+from unittest import TestCase
+from telegram import Bot
+
+from impfbot.model import db
+from impfbot.model.api import AvailabilityInfo, Subscription, User, VaccinationCenter, VaccineRound, VaccineType
+from impfbot.model.default import DefaultAvailabilityStore, DefaultUserStore
+from impfbot.utils import locale
+from impfbot.utils.fakebot import FakeTelegramRequest
+from .api import IVaccinationCenter
+from .telegram import TelegramAvailabilityDispatcher
+
+
+class _Center(IVaccinationCenter):
+
+  def __init__(self, vcenter: VaccinationCenter) -> None:
+    self.vcenter = vcenter
+
+  def get_metadata(self) -> VaccinationCenter:
+    return self.vcenter
+
+  def check_availability(self) -> t.Dict[VaccineRound, AvailabilityInfo]:
+    return {}
+
+
+class TelegramAvailabilityDispatcherTest(TestCase):
+
+  def setUp(self) -> None:
+    locale.load(os.path.join(os.path.dirname(__file__), '..', '..', 'locale', 'de.yml'))
+    db.init_database('sqlite:///:memory:')
+    self.session = db.ScopedSession()
+    self.avail = DefaultAvailabilityStore(self.session, datetime.timedelta(1))
+    self.users = DefaultUserStore(self.session)
+    self.request = FakeTelegramRequest()
+    self.bot = Bot('123456:fake', request=self.request)
+    self.abc = VaccinationCenter('abc', 'ABC Vacc', 'https://abc.vacc', 'Vaccheim')
+    self.xyz = VaccinationCenter('xyz', 'XYZ Vacc', 'https://xyz.vacc', 'Defheim')
+    self.b1 = VaccineRound(VaccineType.BIONTECH, 1)
+    self.b2 = VaccineRound(VaccineType.BIONTECH, 2)
+    with self.session:
+      self.avail.upsert_vaccination_center(self.abc)
+      self.avail.upsert_vaccination_center(self.xyz)
+      self.users.register_user(User(1, 10, 'u1'))
+      self.users.subscribe_user(1, Subscription(vaccine_rounds=[self.b1, self.b2], vaccination_center_queries=['heim']))
+      self.users.register_user(User(2, 20, 'u2'))
+      self.users.subscribe_user(2, Subscription(vaccine_rounds=[self.b1], vaccination_center_ids=['xyz']))
+
+  def _texts(self, chat_id: int) -> t.List[str]:
+    return [m['text'] for m in self.request.messages.get(chat_id, [])]
+
+  def _poll(self, dispatcher: TelegramAvailabilityDispatcher, date: datetime.date = datetime.date(2021, 11, 22)) -> None:
+    dates = AvailabilityInfo(dates=[date])
+    dispatcher.begin_polling()
+    dispatcher.on_availability_info_ready(_Center(self.abc), self.b1, dates)
+    dispatcher.on_availability_info_ready(_Center(self.abc), self.b2, dates)
+    dispatcher.on_availability_info_ready(_Center(self.xyz), self.b1, dates)
+    dispatcher.end_polling()
+
+  def test_coalesces_changes_per_user(self) -> None:
+    self._poll(TelegramAvailabilityDispatcher(self.bot, self.session, self.avail, self.users))
+    assert sorted(self.request.messages) == [10, 20]
+    [text] = self._texts(10)
+    assert text.count('ABC Vacc') == 2 and text.count('XYZ Vacc') == 1
+    assert 'ABC Vacc' not in self._texts(20)[0]
+
+  def test_coalesce_window(self) -> None:
+    dispatcher = TelegramAvailabilityDispatcher(self.bot, self.session, self.avail, self.users,
+      datetime.timedelta(hours=1))
+    self._poll(dispatcher)
+    assert self.request.messages == {}
+    dispatcher.flush()
+    assert len(self._texts(10)) == 1 and len(self._texts(20)) == 1
+
+  def test_coalesce_window_merges_dates(self) -> None:
+    dispatcher = TelegramAvailabilityDispatcher(self.bot, self.session, self.avail, self.users,
+      datetime.timedelta(hours=1))
+    self._poll(dispatcher, datetime.date(2021, 11, 22))
+    self._poll(dispatcher, datetime.date(2021, 11, 23))
+    dispatcher.flush()
+    [text] = self._texts(10)
+    assert text.count('ABC Vacc') == 2 and text.count('XYZ Vacc') == 1
+    assert text.count('2021-11-22, 2021-11-23') == 3
@@ -0,0 +1,281 @@
+
+"""
+A key-value cache that can be shared between multiple instances of the bot. The #RedisCache
+speaks the Redis protocol (RESP) to a Redis compatible server, the #LocalCache keeps the values
+in the process and is used when no shared cache is configured.
+
+```py
+from impfbot.utils.cache import create_cache
+
+cache = create_cache('redis://localhost:6379/0')
+cache.set_many({'a': 1, 'b': 2}, ttl=60)
+assert cache.get_many(['a', 'b', 'c']) == [1, 2, None]
+```
+"""
+
+import abc
+import collections
+import pickle
+import socket
+import threading
+import time
+import typing as t
+import urllib.parse
+
+
+class ICache(metaclass=abc.ABCMeta):
+  """
+  Interface for a key-value cache. A *ttl* is the number of seconds after which a value expires,
+  `None` keeps the value until it is evicted.
+  """
+
+  @abc.abstractmethod
+  def get_many(self, keys: t.Sequence[str]) -> t.List[t.Optional[t.Any]]:
+    """
+    Returns the values of the *keys* in the same order, `None` for keys that are not cached.
+    """
+
+  @abc.abstractmethod
+  def set_many(self, items: t.Mapping[str, t.Any], ttl: t.Optional[float] = None) -> None: ...
+
+  @abc.abstractmethod
+  def delete(self, *keys: str) -> None: ...
+
+  @abc.abstractmethod
+  def incr(self, key: str, amount: int = 1, ttl: t.Optional[float] = None) -> int:
+    """
+    Atomically increments the counter at *key* and returns the new value. The *ttl* applies
+    when the counter is created and is not extended by further increments. Counters can only
+    be read with this method.
+    """
+
+  def get(self, key: str) -> t.Optional[t.Any]:
+    return self.get_many([key])[0]
+
+  def set(self, key: str, value: t.Any, ttl: t.Optional[float] = None) -> None:
+    self.set_many({key: value}, ttl)
+
+
+class LocalCache(ICache):
+  """
+  Keeps up to *maxsize* values in the process, evicting the least recently used ones. Values are
+  stored as they are (without serialization).
+  """
+
+  def __init__(self, maxsize: int = 2**16, clock: t.Callable[[], float] = time.monotonic) -> None:
+    self.maxsize = maxsize
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._data: t.OrderedDict[str, t.Tuple[t.Optional[float], t.Any]] = collections.OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def _lookup(self, key: str, now: float) -> t.Optional[t.Tuple[t.Optional[float], t.Any]]:
+    entry = self._data.get(key)
+    if entry is None:
+      return None
+    if entry[0] is not None and entry[0] <= now:
+      del self._data[key]
+      return None
+    self._data.move_to_end(key)
+    return entry
+
+  def _store(self, key: str, expires: t.Optional[float], value: t.Any) -> None:
+    self._data[key] = (expires, value)
+    self._data.move_to_end(key)
+    while len(self._data) > self.maxsize:
+      self._data.popitem(last=False)
+
+  def get_many(self, keys: t.Sequence[str]) -> t.List[t.Optional[t.Any]]:
+    with self._lock:
+      now = self._clock()
+      entries = [self._lookup(key, now) for key in keys]
+    return [entry[1] if entry else None for entry in entries]
+
+  def set_many(self, items: t.Mapping[str, t.Any], ttl: t.Optional[float] = None) -> None:
+    with self._lock:
+      expires = self._clock() + ttl if ttl is not None else None
+      for key, value in items.items():
+        self._store(key, expires, value)
+
+  def delete(self, *keys: str) -> None:
+    with self._lock:
+      for key in keys:
+        self._data.pop(key, None)
+
+  def incr(self, key: str, amount: int = 1, ttl: t.Optional[float] = None) -> int:
+    with self._lock:
+      now = self._clock()
+      entry = self._lookup(key, now)
+      if entry is None:
+        entry = (now + ttl if ttl is not None else None, 0)
+      value = entry[1] + amount
+      self._store(key, entry[0], value)
+      return value
+
+
+class RedisError(Exception):
+  """
+  Raised when the server replies to a command with an error.
+  """
+
+
+class _Connection:
+
+  def __init__(self, host: str, port: int, timeout: float) -> None:
+    self._sock = socket.create_connection((host, port), timeout)
+    self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self._file = self._sock.makefile('rb')
+
+  def close(self) -> None:
+    self._file.close()
+    self._sock.close()
+
+  @staticmethod
+  def _encode(command: t.Sequence[t.Union[str, bytes, int, float]]) -> bytes:
+    parts = [b'*%d\r\n' % len(command)]
+    for arg in command:
+      if not isinstance(arg, bytes):
+        arg = str(arg).encode('utf8')
+      parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+  def _read_reply(self) -> t.Any:
+    line = self._file.readline()
+    if not line.endswith(b'\r\n'):
+      raise ConnectionError('connection closed by the server')
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'+':
+      return payload.decode('utf8')
+    if kind == b'-':
+      return RedisError(payload.decode('utf8'))
+    if kind == b':':
+      return int(payload)
+    if kind == b'$':
+      length = int(payload)
+      if length < 0:
+        return None
+      data = self._file.read(length + 2)
+      if len(data) != length + 2:
+        raise ConnectionError('connection closed by the server')
+      return data[:-2]
+    if kind == b'*':
+      length = int(payload)
+      return None if length < 0 else [self._read_reply() for _ in range(length)]
+    raise ConnectionError(f'unexpected reply from the server: {line!r}')
+
+  def execute(self, commands: t.Sequence[t.Sequence[t.Union[str, bytes, int, float]]]) -> t.List[t.Any]:
+    """
+    Sends all *commands* in one go and reads their replies (pipelining). Errors are raised after
+    all replies were read, so that the connection can be used further.
+    """
+
+    self._sock.sendall(b''.join(map(self._encode, commands)))
+    replies = [self._read_reply() for _ in commands]
+    for reply in replies:
+      if isinstance(reply, RedisError):
+        raise reply
+    return replies
+
+
+class RedisCache(ICache):
+  """
+  A cache on a Redis compatible server, addressed by a URL of the form
+  `redis://[:password@]host[:port][/db]`. Every thread uses its own connection, commands that
+  operate on multiple keys are sent in a single round trip.
+
+  Values are serialized with #pickle, so the server must only be writable by trusted clients.
+  All keys are prefixed with *prefix* so that the server can be shared with other applications.
+  """
+
+  def __init__(self, url: str = 'redis://localhost:6379/0', prefix: str = 'impfbot:', timeout: float = 5.0) -> None:
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme != 'redis':
+      raise ValueError(f'unsupported cache URL: {url!r}')
+    self.host = parsed.hostname or 'localhost'
+    self.port = parsed.port or 6379
+    self.db = int(parsed.path.strip('/') or 0)
+    self.prefix = prefix
+    self.timeout = timeout
+    self._password = urllib.parse.unquote(parsed.password) if parsed.password else None
+    self._local = threading.local()
+
+  def _connect(self) -> _Connection:
+    conn = _Connection(self.host, self.port, self.timeout)
+    setup: t.List[t.Sequence[t.Union[str, int]]] = []
+    if self._password:
+      setup.append(('AUTH', self._password))
+    if self.db:
+      setup.append(('SELECT', self.db))
+    if setup:
+      conn.execute(setup)
+    return conn
+
+  def execute(self, *commands: t.Sequence[t.Union[str, bytes, int, float]]) -> t.List[t.Any]:
+    """
+    Executes the *commands* in a pipeline on the connection of the current thread and returns
+    their replies. The connection is dropped (and reopened with the next call) if it fails.
+    """
+
+    conn: t.Optional[_Connection] = getattr(self._local, 'conn', None)
+    if conn is None:
+      conn = self._local.conn = self._connect()
+    try:
+      return conn.execute(commands)
+    except (OSError, ConnectionError):
+      self._local.conn = None
+      conn.close()
+      raise
+
+  def close(self) -> None:
+    conn: t.Optional[_Connection] = getattr(self._local, 'conn', None)
+    if conn is not None:
+      self._local.conn = None
+      conn.close()
+
+  def _key(self, key: str) -> str:
+    return self.prefix + key
+
+  def get_many(self, keys: t.Sequence[str]) -> t.List[t.Optional[t.Any]]:
+    if not keys:
+      return []
+    values, = self.execute(('MGET', *map(self._key, keys)))
+    return [pickle.loads(value) if value is not None else None for value in values]
+
+  def set_many(self, items: t.Mapping[str, t.Any], ttl: t.Optional[float] = None) -> None:
+    if not items:
+      return
+    if ttl is None:
+      args: t.List[t.Union[str, bytes]] = []
+      for key, value in items.items():
+        args += [self._key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)]
+      self.execute(('MSET', *args))
+    else:
+      self.execute(*(('SET', self._key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 'PX', max(1, int(ttl * 1000)))
+        for key, value in items.items()))
+
+  def delete(self, *keys: str) -> None:
+    if keys:
+      self.execute(('DEL', *map(self._key, keys)))
+
+  def incr(self, key: str, amount: int = 1, ttl: t.Optional[float] = None) -> int:
+    if ttl is None:
+      value, = self.execute(('INCRBY', self._key(key), amount))
+    else:
+      # Creating the counter with its expiry before incrementing it makes sure that it expires
+      # even if the client goes away between the two commands.
+      _created, value = self.execute(
+        ('SET', self._key(key), 0, 'PX', max(1, int(ttl * 1000)), 'NX'),
+        ('INCRBY', self._key(key), amount))
+    return int(value)
+
+
+def create_cache(url: t.Optional[str], maxsize: int = 2**16) -> ICache:
+  """
+  Returns a #RedisCache for a `redis://` *url*, or a #LocalCache if no URL is given.
+  """
+
+  if url:
+    return RedisCache(url)
+  return LocalCache(maxsize)
@@ -0,0 +1,80 @@
+
+import os
+import time
+import typing as t
+from unittest import TestCase
+
+from .cache import ICache, LocalCache, RedisCache
+from .fakeredis import FakeRedisServer
+
+
+class _CacheTests:
+
+  cache: ICache
+
+  def test_get_set_delete(self) -> None:
+    assert self.cache.get('a') is None
+    self.cache.set('a', {'x': (1, 2)})
+    assert self.cache.get('a') == {'x': (1, 2)}
+    self.cache.delete('a')
+    assert self.cache.get('a') is None
+
+  def test_many(self) -> None:
+    self.cache.set_many({'a': 1, 'b': 'zwei'})
+    self.cache.set_many({'c': 3.0}, ttl=60)
+    assert self.cache.get_many(['c', 'missing', 'b', 'a']) == [3.0, None, 'zwei', 1]
+    assert self.cache.get_many([]) == []
+
+  def test_ttl(self) -> None:
+    self.cache.set('a', 1, ttl=0.05)
+    assert self.cache.get('a') == 1
+    time.sleep(0.1)
+    assert self.cache.get('a') is None
+
+  def test_incr(self) -> None:
+    assert self.cache.incr('counter', ttl=0.05) == 1
+    assert self.cache.incr('counter', 2, ttl=0.05) == 3
+    time.sleep(0.1)
+    assert self.cache.incr('counter', ttl=60) == 1
+
+
+class LocalCacheTest(_CacheTests, TestCase):
+
+  def setUp(self) -> None:
+    self.cache = LocalCache()
+
+  def test_evicts_least_recently_used(self) -> None:
+    cache = LocalCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get_many(['a', 'b', 'c']) == [1, None, 3]
+    assert len(cache) == 2
+
+
+class RedisCacheTest(_CacheTests, TestCase):
+  """
+  Runs against the Redis server at `IMPFBOT_TEST_REDIS_URL` if it is set, otherwise against a
+  #FakeRedisServer.
+  """
+
+  def setUp(self) -> None:
+    url = os.getenv('IMPFBOT_TEST_REDIS_URL')
+    self.server: t.Optional[FakeRedisServer] = None
+    if not url:
+      self.server = FakeRedisServer()
+      self.server.start()
+      self.addCleanup(self.server.stop)
+      url = self.server.url
+    self.cache = self.redis = RedisCache(url, prefix=f'impfbot-test:{self.id()}:')
+    self.addCleanup(self.redis.close)
+
+  def test_pipelines_multiple_keys(self) -> None:
+    if not self.server:
+      self.skipTest('requires the fake server')
+    self.cache.set_many({'a': 1, 'b': 2}, ttl=60)
+    self.cache.get_many(['a', 'b'])
+    self.cache.incr('c', ttl=60)
+    assert [c[0] for c in self.server.commands] == [b'SET', b'SET', b'MGET', b'SET', b'INCRBY']
+    assert self.server.commands[2][1:] == [self.redis._key('a').encode(), self.redis._key('b').encode()]
@@ -0,0 +1,226 @@
+
+"""
+A stand-in for the Telegram Bot API that plugs into #telegram.Bot as its request object. It
+answers the API methods used by the bot locally with configurable latency and failures, and
+records every call, so that fan-outs and the UI can be tested without talking to Telegram.
+
+```py
+request = FakeTelegramRequest(latency=0.05, retry_after_rate=0.01, blocked_chat_ids={42})
+bot = telegram.Bot('123456:fake', request=request)
+```
+"""
+
+import random
+import threading
+import time
+import typing as t
+from telegram.error import BadRequest, RetryAfter, Unauthorized
+from telegram.utils.request import Request
+
+JSONDict = t.Dict[str, t.Any]
+
+
+class FakeCall(t.NamedTuple):
+  method: str
+  data: JSONDict
+  started: float
+  duration: float
+  error: t.Optional[str]
+
+
+class FakeTelegramRequest(Request):
+  """
+  Simulates the Telegram Bot API.
+
+  * Every call takes *latency* seconds, plus a uniformly distributed random *latency_jitter*.
+  * A fraction of *retry_after_rate* of the calls that address a chat fail with #RetryAfter.
+  * Calls that address one of the *blocked_chat_ids* fail with #Unauthorized (the user blocked
+    the bot), calls that address one of the *missing_chat_ids* fail with #BadRequest
+    ("Chat not found").
+  * Sent messages get increasing message IDs and are recorded per chat in #messages.
+  * Updates can be fed to the bot with #push_update() and are returned by `getUpdates`.
+  * Files are not served from Telegram, every download returns the *file_content*.
+
+  The *listeners* are called with every #FakeCall after it completed.
+  """
+
+
+  def __init__(self,
+    latency: float = 0.0,
+    latency_jitter: float = 0.0,
+    retry_after_rate: float = 0.0,
+    retry_after: int = 1,
+    blocked_chat_ids: t.Collection[int] = (),
+    missing_chat_ids: t.Collection[int] = (),
+    bot_username: str = 'impfbot_fake_bot',
+    seed: t.Optional[int] = None,
+    con_pool_size: int = 8,
+    file_content: bytes = b'',
+  ) -> None:
+
+    super().__init__(con_pool_size=con_pool_size)
+    self.latency = latency
+    self.latency_jitter = latency_jitter
+    self.retry_after_rate = retry_after_rate
+    self.retry_after = retry_after
+    self.blocked_chat_ids = set(blocked_chat_ids)
+    self.missing_chat_ids = set(missing_chat_ids)
+    self.bot_username = bot_username
+    self.file_content = file_content
+    self.calls: t.List[FakeCall] = []
+    self.messages: t.Dict[int, t.List[JSONDict]] = {}
+    self.listeners: t.List[t.Callable[[FakeCall], None]] = []
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self._updates_changed = threading.Condition(self._lock)
+    self._updates: t.List[JSONDict] = []
+    self._next_update_id = 1
+    self._next_message_id = 1
+    self._stopped = False
+
+  # Request
+
+  def post(self, url: str, data: JSONDict, timeout: t.Optional[float] = None) -> t.Union[JSONDict, bool, t.List[JSONDict]]:  # type: ignore[override]
+    method = url.rpartition('/')[2]
+    data = dict(data or {})
+    started = time.perf_counter()
+    error: t.Optional[str] = None
+    try:
+      if method == 'getUpdates':
+        return self._get_updates(data)
+      with self._lock:
+        delay = self.latency + self._random.uniform(0, self.latency_jitter)
+        rate_limited = 'chat_id' in data and self._random.random() < self.retry_after_rate
+      if delay:
+        time.sleep(delay)
+      if 'chat_id' in data:
+        chat_id = int(data['chat_id'])
+        if chat_id in self.blocked_chat_ids:
+          raise Unauthorized('Forbidden: bot was blocked by the user')
+        if chat_id in self.missing_chat_ids:
+          raise BadRequest('Chat not found')
+        if rate_limited:
+          raise RetryAfter(self.retry_after)
+      handler = getattr(self, '_method_' + method, None)
+      return handler(data) if handler else True
+    except Exception as exc:
+      error = type(exc).__name__
+      raise
+    finally:
+      call = FakeCall(method, data, started, time.perf_counter() - started, error)
+      with self._lock:
+        self.calls.append(call)
+      for listener in self.listeners:
+        listener(call)
+
+  def __setattr__(self, key: str, value: object) -> None:
+    # Request warns about setting attributes that are not in its __slots__.
+    object.__setattr__(self, key, value)
+
+  def retrieve(self, url: str, timeout: t.Optional[float] = None) -> bytes:
+    return self.file_content
+
+  def download(self, url: str, filename: str, timeout: t.Optional[float] = None) -> None:
+    with open(filename, 'wb') as fp:
+      fp.write(self.file_content)
+
+  def stop(self) -> None:
+    super().stop()
+    with self._updates_changed:
+      self._stopped = True
+      self._updates_changed.notify_all()
+
+  # Updates
+
+  def push_update(self, update: JSONDict) -> int:
+    """
+    Queues an update for `getUpdates`. The `update_id` is assigned and returned.
+    """
+
+    with self._updates_changed:
+      update_id = self._next_update_id
+      self._next_update_id += 1
+      self._updates.append(dict(update, update_id=update_id))
+      self._updates_changed.notify_all()
+    return update_id
+
+  def push_command(self, user_id: int, text: str, first_name: str = 'User') -> int:
+    """
+    Queues a message with a bot command (e.g. `/termine`) from the private chat of a user.
+    """
+
+    command = text.split()[0]
+    return self.push_update({'message': {
+      'message_id': self._new_message_id(),
+      'date': int(time.time()),
+      'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+      'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+      'text': text,
+      'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+    }})
+
+  def push_callback_query(self, user_id: int, message_id: int, data: str) -> int:
+    """
+    Queues a click on an inline keyboard button of a message that the bot sent to the user.
+    """
+
+    return self.push_update({'callback_query': {
+      'id': str(self._new_message_id()),
+      'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+      'chat_instance': str(user_id),
+      'data': data,
+      'message': self._message(user_id, message_id, ''),
+    }})
+
+  def _get_updates(self, data: JSONDict) -> t.List[JSONDict]:
+    offset = int(data.get('offset') or 0)
+    limit = int(data.get('limit') or 100)
+    deadline = time.monotonic() + float(data.get('timeout') or 0)
+    with self._updates_changed:
+      self._updates = [u for u in self._updates if u['update_id'] >= offset]
+      while not self._updates and not self._stopped:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self._updates_changed.wait(remaining)
+      return self._updates[:limit]
+
+  # Bot API methods
+
+  def _new_message_id(self) -> int:
+    with self._lock:
+      message_id = self._next_message_id
+      self._next_message_id += 1
+    return message_id
+
+  def _message(self, chat_id: int, message_id: int, text: str) -> JSONDict:
+    return {
+      'message_id': message_id,
+      'date': int(time.time()),
+      'chat': {'id': chat_id, 'type': 'private'},
+      'from': {'id': 1, 'is_bot': True, 'first_name': 'Impfbot', 'username': self.bot_username},
+      'text': text,
+    }
+
+  def _record_message(self, data: JSONDict, message_id: int) -> JSONDict:
+    chat_id = int(data['chat_id'])
+    message = self._message(chat_id, message_id, str(data.get('text', '')))
+    with self._lock:
+      self.messages.setdefault(chat_id, []).append(message)
+    return message
+
+  def _method_getMe(self, data: JSONDict) -> JSONDict:
+    return {'id': 1, 'is_bot': True, 'first_name': 'Impfbot', 'username': self.bot_username}
+
+  def _method_sendMessage(self, data: JSONDict) -> JSONDict:
+    return self._record_message(data, self._new_message_id())
+
+  def _method_editMessageText(self, data: JSONDict) -> t.Union[JSONDict, bool]:
+    if 'chat_id' not in data:
+      return True  # Inline message
+    return self._record_message(data, int(data['message_id']))
+
+  def _method_editMessageReplyMarkup(self, data: JSONDict) -> t.Union[JSONDict, bool]:
+    if 'chat_id' not in data:
+      return True
+    return self._message(int(data['chat_id']), int(data['message_id']), '')
@@ -0,0 +1,44 @@
+
+from unittest import TestCase
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter, Unauthorized
+
+from .fakebot import FakeTelegramRequest
+
+
+class FakeTelegramRequestTest(TestCase):
+
+  def test_send_message(self) -> None:
+    request = FakeTelegramRequest(blocked_chat_ids={2}, missing_chat_ids={3})
+    bot = Bot('123456:fake', request=request)
+    assert bot.get_me().username == 'impfbot_fake_bot'
+    first = bot.send_message(chat_id=1, text='Hello')
+    second = bot.send_message(chat_id=1, text='World')
+    assert second.message_id > first.message_id
+    assert [m['text'] for m in request.messages[1]] == ['Hello', 'World']
+    with self.assertRaises(Unauthorized):
+      bot.send_message(chat_id=2, text='Hello')
+    with self.assertRaises(BadRequest):
+      bot.send_message(chat_id=3, text='Hello')
+    assert [(c.method, c.error) for c in request.calls] == [('getMe', None), ('sendMessage', None),
+      ('sendMessage', None), ('sendMessage', 'Unauthorized'), ('sendMessage', 'BadRequest')]
+
+  def test_retry_after(self) -> None:
+    bot = Bot('123456:fake', request=FakeTelegramRequest(retry_after_rate=1.0, retry_after=3))
+    with self.assertRaises(RetryAfter) as ctx:
+      bot.send_message(chat_id=1, text='Hello')
+    assert ctx.exception.retry_after == 3
+
+  def test_get_updates(self) -> None:
+    request = FakeTelegramRequest()
+    bot = Bot('123456:fake', request=request)
+    request.push_command(42, '/termine')
+    updates = bot.get_updates(timeout=0)
+    assert len(updates) == 1
+    user = updates[0].effective_user
+    assert updates[0].message.text == '/termine' and user is not None and user.id == 42
+    assert bot.get_updates(offset=updates[0].update_id + 1, timeout=0) == []
+
+  def test_retrieve(self) -> None:
+    request = FakeTelegramRequest(file_content=b'data')
+    assert request.retrieve('https://api.telegram.org/file/bot123456:fake/photo.jpg') == b'data'
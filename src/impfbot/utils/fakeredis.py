@@ -0,0 +1,142 @@
+
+"""
+A minimal in-process server that speaks the Redis protocol, for testing the #cache.RedisCache
+without a Redis server. It implements only the commands used by the cache.
+
+```py
+with FakeRedisServer() as server:
+  cache = RedisCache(server.url)
+```
+"""
+
+import socketserver
+import threading
+import time
+import typing as t
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+  server: '_Server'
+
+  def _read_command(self) -> t.Optional[t.List[bytes]]:
+    line = self.rfile.readline()
+    if not line:
+      return None
+    assert line.startswith(b'*'), line
+    args = []
+    for _ in range(int(line[1:])):
+      length = int(self.rfile.readline()[1:])
+      args.append(self.rfile.read(length + 2)[:-2])
+    return args
+
+  @staticmethod
+  def _encode(reply: t.Any) -> bytes:
+    if reply is None:
+      return b'$-1\r\n'
+    if isinstance(reply, Exception):
+      return b'-ERR %s\r\n' % str(reply).encode('utf8')
+    if isinstance(reply, str):
+      return b'+%s\r\n' % reply.encode('utf8')
+    if isinstance(reply, int):
+      return b':%d\r\n' % reply
+    if isinstance(reply, bytes):
+      return b'$%d\r\n%s\r\n' % (len(reply), reply)
+    return b'*%d\r\n' % len(reply) + b''.join(map(_Handler._encode, reply))
+
+  def handle(self) -> None:
+    while True:
+      command = self._read_command()
+      if command is None:
+        return
+      self.server.commands.append(command)
+      try:
+        reply = self.server.execute(command[0].decode().upper(), command[1:])
+      except Exception as exc:
+        reply = exc
+      self.wfile.write(self._encode(reply))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address: t.Tuple[str, int]) -> None:
+    super().__init__(address, _Handler)
+    self.commands: t.List[t.List[bytes]] = []
+    self._lock = threading.Lock()
+    self._data: t.Dict[bytes, t.Tuple[t.Optional[float], bytes]] = {}
+
+  def _get(self, key: bytes) -> t.Optional[bytes]:
+    entry = self._data.get(key)
+    if entry is None:
+      return None
+    if entry[0] is not None and entry[0] <= time.monotonic():
+      del self._data[key]
+      return None
+    return entry[1]
+
+  def execute(self, name: str, args: t.List[bytes]) -> t.Any:
+    with self._lock:
+      if name in ('PING', 'SELECT', 'AUTH'):
+        return 'OK'
+      if name == 'MGET':
+        return [self._get(key) for key in args]
+      if name == 'MSET':
+        for key, value in zip(args[::2], args[1::2]):
+          self._data[key] = (None, value)
+        return 'OK'
+      if name == 'SET':
+        key, value, options = args[0], args[1], [o.upper() for o in args[2:]]
+        if b'NX' in options and self._get(key) is not None:
+          return None
+        expires = None
+        if b'PX' in options:
+          expires = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+        self._data[key] = (expires, value)
+        return 'OK'
+      if name == 'DEL':
+        return sum(self._data.pop(key, None) is not None for key in args)
+      if name == 'INCRBY':
+        current = self._get(args[0])
+        expires = self._data[args[0]][0] if current is not None else None
+        result = int(current or 0) + int(args[1])
+        self._data[args[0]] = (expires, str(result).encode())
+        return result
+      raise ValueError(f'unknown command {name!r}')
+
+
+class FakeRedisServer:
+  """
+  Serves the fake on a free port of localhost in a background thread. All received commands are
+  recorded in #commands.
+  """
+
+  def __init__(self) -> None:
+    self._server = _Server(('127.0.0.1', 0))
+    self._thread: t.Optional[threading.Thread] = None
+
+  @property
+  def url(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f'redis://{host!s}:{port}/0'
+
+  @property
+  def commands(self) -> t.List[t.List[bytes]]:
+    return self._server.commands
+
+  def start(self) -> None:
+    self._thread = threading.Thread(target=self._server.serve_forever, name='FakeRedisServer', daemon=True)
+    self._thread.start()
+
+  def stop(self) -> None:
+    self._server.shutdown()
+    self._server.server_close()
+
+  def __enter__(self) -> 'FakeRedisServer':
+    self.start()
+    return self
+
+  def __exit__(self, *args: t.Any) -> None:
+    self.stop()
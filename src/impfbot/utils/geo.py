@@ -0,0 +1,118 @@
+
+"""
+Distances on the earth's surface, a grid index for radius queries and the lookup of postcodes.
+"""
+
+import csv
+import functools
+import math
+import os
+import typing as t
+
+T = t.TypeVar('T')
+
+EARTH_RADIUS_KM = 6371.0
+
+#: Kilometers per degree of latitude (and of longitude at the equator).
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+#: The largest radius that can be searched for.
+MAX_RADIUS_KM = 100.0
+
+#: The postcode table that ships with the package. It covers the region of the vaccination centers
+#: that the bot polls; the coordinates are the approximate centers of the postcode areas. To cover
+#: more regions, configure a complete table with #use_postcodes_file() (e.g. the `DE.txt` of the
+#: GeoNames postcode export at https://download.geonames.org/export/zip/).
+POSTCODES_FILE = os.path.join(os.path.dirname(__file__), 'postcodes_de.csv')
+
+_postcodes_file = POSTCODES_FILE
+
+
+class Coordinates(t.NamedTuple):
+  latitude: float
+  longitude: float
+
+
+def distance_km(a: Coordinates, b: Coordinates) -> float:
+  """
+  Returns the great-circle distance between *a* and *b* (haversine formula).
+  """
+
+  lat1, lon1, lat2, lon2 = map(math.radians, (a.latitude, a.longitude, b.latitude, b.longitude))
+  h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+class GridIndex(t.Generic[T]):
+  """
+  Indexes items by their coordinates in a grid of *cell_size* degrees, so that a radius query only
+  has to look at the items in the cells that overlap the bounding box of the circle.
+  """
+
+  def __init__(self, cell_size: float = 0.25) -> None:
+    self.cell_size = cell_size
+    self._cells: t.Dict[t.Tuple[int, int], t.List[t.Tuple[Coordinates, T]]] = {}
+
+  def __len__(self) -> int:
+    return sum(map(len, self._cells.values()))
+
+  def _cell(self, latitude: float, longitude: float) -> t.Tuple[int, int]:
+    return (math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size))
+
+  def insert(self, coordinates: Coordinates, item: T) -> None:
+    self._cells.setdefault(self._cell(*coordinates), []).append((coordinates, item))
+
+  def query(self, center: Coordinates, radius_km: float) -> t.List[t.Tuple[float, T]]:
+    """
+    Returns the distance and the item for all items within *radius_km* of *center*, nearest first.
+    """
+
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(center.latitude)), 1e-6))
+    lat0, lon0 = self._cell(center.latitude - dlat, center.longitude - dlon)
+    lat1, lon1 = self._cell(center.latitude + dlat, center.longitude + dlon)
+    result = []
+    for lat in range(lat0, lat1 + 1):
+      for lon in range(lon0, lon1 + 1):
+        for coordinates, item in self._cells.get((lat, lon), ()):
+          distance = distance_km(center, coordinates)
+          if distance <= radius_km:
+            result.append((distance, item))
+    result.sort(key=lambda x: x[0])
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def load_postcodes(filename: str = POSTCODES_FILE) -> t.Dict[str, Coordinates]:
+  """
+  Loads a table of postcodes and the coordinates of their center, either from a CSV file with the
+  columns `postcode`, `latitude` and `longitude`, or from a tab-separated GeoNames postcode export
+  (without a header; the postcode is the second, the coordinates are the tenth and eleventh column).
+  A postcode that is listed for multiple places is placed at the mean of their coordinates.
+  """
+
+  with open(filename, encoding='utf8', newline='') as fp:
+    if '\t' not in fp.readline():
+      fp.seek(0)
+      return {row['postcode']: Coordinates(float(row['latitude']), float(row['longitude'])) for row in csv.DictReader(fp)}
+    fp.seek(0)
+    places: t.Dict[str, t.List[Coordinates]] = {}
+    for row in csv.reader(fp, delimiter='\t', quoting=csv.QUOTE_NONE):
+      places.setdefault(row[1], []).append(Coordinates(float(row[9]), float(row[10])))
+  return {postcode: Coordinates(sum(c.latitude for c in coordinates) / len(coordinates),
+    sum(c.longitude for c in coordinates) / len(coordinates)) for postcode, coordinates in places.items()}
+
+
+def use_postcodes_file(filename: str) -> None:
+  """
+  Makes #lookup_postcode() use the table in *filename* (see #load_postcodes()) instead of the one
+  that ships with the package. The table is loaded immediately, so that errors show at startup.
+  """
+
+  global _postcodes_file
+  load_postcodes(filename)
+  _postcodes_file = filename
+
+
+def lookup_postcode(postcode: str) -> t.Optional[Coordinates]:
+  return load_postcodes(_postcodes_file).get(postcode.strip())
@@ -0,0 +1,56 @@
+
+import os
+import tempfile
+from unittest import TestCase
+
+from . import geo
+
+
+class GeoTest(TestCase):
+
+  def test_distance_km(self) -> None:
+    dachau = geo.Coordinates(48.2600, 11.4340)
+    munich = geo.Coordinates(48.1372, 11.5755)
+    assert geo.distance_km(dachau, dachau) == 0
+    assert 16 < geo.distance_km(dachau, munich) < 18
+    assert geo.distance_km(dachau, munich) == geo.distance_km(munich, dachau)
+
+  def test_grid_index(self) -> None:
+    index: geo.GridIndex[int] = geo.GridIndex(cell_size=0.1)
+    for i in range(-20, 21):
+      for j in range(-20, 21):
+        index.insert(geo.Coordinates(48 + i * 0.05, 11 + j * 0.05), i * 100 + j)
+    assert len(index) == 41 * 41
+    center = geo.Coordinates(48.0, 11.0)
+    expected = sorted(
+      (geo.distance_km(center, coordinates), item)
+      for cell in index._cells.values() for coordinates, item in cell
+      if geo.distance_km(center, coordinates) <= 20)
+    result = index.query(center, 20)
+    assert result[0] == (0, 0)
+    assert [d for d, _ in result] == [d for d, _ in expected]
+    assert set(x for _, x in result) == set(x for _, x in expected)
+
+  def test_lookup_postcode(self) -> None:
+    coordinates = geo.lookup_postcode(' 85221 ')
+    assert coordinates is not None
+    assert geo.distance_km(coordinates, geo.Coordinates(48.26, 11.434)) < 5
+    assert geo.lookup_postcode('00000') is None
+
+  def test_use_postcodes_file(self) -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+      filename = os.path.join(tempdir, 'DE.txt')
+      with open(filename, 'w', encoding='utf8') as fp:
+        fp.write('DE\t24937\tFlensburg\tSchleswig-Holstein\tSH\t\t00\tFlensburg\t01001\t54.7833\t9.4333\t4\n')
+        fp.write('DE\t24939\tFlensburg\tSchleswig-Holstein\tSH\t\t00\tFlensburg\t01001\t54.7900\t9.4100\t4\n')
+        fp.write('DE\t24939\tFlensburg Mürwik\tSchleswig-Holstein\tSH\t\t00\tFlensburg\t01001\t54.8100\t9.4300\t4\n')
+      geo.use_postcodes_file(filename)
+      try:
+        assert geo.lookup_postcode('24937') == geo.Coordinates(54.7833, 9.4333)
+        coordinates = geo.lookup_postcode('24939')
+        assert coordinates is not None
+        assert abs(coordinates.latitude - 54.8) < 1e-9 and abs(coordinates.longitude - 9.42) < 1e-9
+        assert geo.lookup_postcode('85221') is None
+      finally:
+        geo.use_postcodes_file(geo.POSTCODES_FILE)
+    assert geo.lookup_postcode('85221') is not None
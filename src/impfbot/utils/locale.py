@@ -1,45 +1,150 @@
 
-import collections
+import contextlib
 import logging
+import os
+import string
 import typing as t
 import yaml  # type: ignore
 
+from .local import LocalList
+
 logger = logging.getLogger(__name__)
+MISSING = '<?>'
+
+
+class _Params(t.Dict[str, t.Any]):
+
+  def __missing__(self, key: str) -> str:
+    return MISSING
+
 
+class Template:
+  """
+  A locale string that is prepared for formatting once. Escaped line breaks are removed and the
+  names of the placeholders are extracted up front.
+  """
 
-class Template(str):
+  __slots__ = ('text', 'fields', '_static')
 
-  def __call__(self, **params) -> str:
-    return self.replace('\\\n', '').format_map(collections.defaultdict(lambda: '<?>', params))
+  def __init__(self, text: str) -> None:
+    self.text = text.replace('\\\n', '')
+    self.fields = frozenset(
+      name.partition('.')[0].partition('[')[0]
+      for _literal, name, _spec, _conv in string.Formatter().parse(self.text) if name)
+    self._static = None if self.fields else self.text.format_map({})
+
+  def __repr__(self) -> str:
+    return f'Template({self.text!r})'
+
+  def __call__(self, **params: t.Any) -> str:
+    if self._static is not None:
+      return self._static
+    return self.text.format_map(_Params(params))
 
 
 class Locale:
+  """
+  Loads a YAML file of nested locale strings and flattens it to a mapping of dotted keys to
+  #Template objects.
+  """
+
+  def __init__(self, filename: str, name: t.Optional[str] = None) -> None:
+    self.filename = filename
+    self.name = name or os.path.splitext(os.path.basename(filename))[0]
+    with open(filename, encoding='utf8') as fp:
+      data = yaml.safe_load(fp)
+    self.templates: t.Dict[str, Template] = {}
+    self._flatten('', data)
+    self._reported: t.Set[str] = set()
+
+  def _flatten(self, prefix: str, data: t.Any) -> None:
+    if isinstance(data, t.Mapping):
+      for key, value in data.items():
+        self._flatten(prefix + str(key) + '.', value)
+    elif isinstance(data, str):
+      self.templates[prefix[:-1]] = Template(data)
+    else:
+      logger.warning('Ignoring non-string locale key in "%s": %s', self.filename, prefix[:-1])
+
+  def validate(self, reference: 'Locale') -> t.List[str]:
+    """
+    Returns the keys of the *reference* locale that are missing in this locale and logs them.
+    """
 
-  def __init__(self, filename: str) -> None:
-    self._filename = filename
-    self._data: t.Dict[str, t.Any] = yaml.safe_load(open(filename))  # TODO
+    missing = sorted(reference.templates.keys() - self.templates.keys())
+    for key in missing:
+      logger.warning('Missing locale key in "%s": %s', self.filename, key)
+    self._reported.update(missing)
+    return missing
 
-  def get(self, key: str, **kwargs) -> str:
-    data: t.Union[t.Dict, str] = self._data
-    for part in key.split('.'):
-      if not isinstance(data, t.Mapping) or part not in data:
-        logger.warn('Missing locale key in "%s": %s (%s)', self._filename, key, part)
-        return '<?>'
-      data = data[part]
-    if not isinstance(data, str):
-      logger.warn('Missing locale key in "%s": %s (%s)', self._filename, key, part)
-      return '<?>'
-    return Template(data)(**kwargs)
+  def get(self, key: str, **kwargs: t.Any) -> str:
+    template = self.templates.get(key)
+    if template is None:
+      if key not in self._reported:
+        logger.warning('Missing locale key in "%s": %s', self.filename, key)
+        self._reported.add(key)
+      return MISSING
+    return template(**kwargs)
 
 
+_locales: t.Dict[str, Locale] = {}
 _gl: t.Optional[Locale] = None
+_current = LocalList[Locale]()
 
 
-def load(filename: str) -> None:
+def load(filename: str, name: t.Optional[str] = None) -> Locale:
+  """
+  Loads a locale. The first locale that is loaded becomes the global default, every other
+  locale is validated against it.
+  """
+
   global _gl
-  _gl = Locale(filename)
+  loc = Locale(filename, name)
+  if _gl is None or _gl.name == loc.name:
+    _gl = loc
+  else:
+    loc.validate(_gl)
+  _locales[loc.name] = loc
+  return loc
+
+
+def load_all(directory: str, default: str) -> None:
+  """
+  Loads the *default* locale and all other `.yml` files in the *directory* side by side.
+  """
+
+  load(os.path.join(directory, default + '.yml'))
+  for filename in sorted(os.listdir(directory)):
+    name, ext = os.path.splitext(filename)
+    if ext == '.yml' and name != default:
+      load(os.path.join(directory, filename))
+
 
+def get_locale(language_code: t.Optional[str] = None) -> Locale:
+  """
+  Returns the locale for a language code (e.g. a Telegram user's `de-DE`), or the global
+  default if the language is not loaded. Without a language code, the locale of the current
+  thread (see #use()) is returned.
+  """
 
-def get(key: str, **kwargs) -> str:
   assert _gl, 'Global locale not initialized'
-  return _gl.get(key, **kwargs)
+  if language_code:
+    return _locales.get(language_code) or _locales.get(language_code.partition('-')[0].lower(), _gl)
+  return _current.last() if _current else _gl
+
+
+@contextlib.contextmanager
+def use(loc: Locale) -> t.Iterator[Locale]:
+  """
+  Makes *loc* the locale of the current thread, e.g. while handling an update of a user.
+  """
+
+  _current.append(loc)
+  try:
+    yield loc
+  finally:
+    _current.pop()
+
+
+def get(key: str, **kwargs: t.Any) -> str:
+  return get_locale().get(key, **kwargs)
@@ -0,0 +1,44 @@
+
+import os
+import tempfile
+from unittest import TestCase
+
+from . import locale
+from .locale import Locale, Template
+
+
+class LocaleTest(TestCase):
+
+  def _write(self, directory: str, name: str, content: str) -> str:
+    filename = os.path.join(directory, name)
+    with open(filename, 'w') as fp:
+      fp.write(content)
+    return filename
+
+  def test_template(self) -> None:
+    template = Template('Hallo {first_name}, \\\nwillkommen bei {bot_name}.')
+    assert template.fields == {'first_name', 'bot_name'}
+    assert template(first_name='Niklas') == 'Hallo Niklas, willkommen bei <?>.'
+    assert Template('{{literal}}')() == '{literal}'
+
+  def test_flatten_and_validate(self) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+      de = Locale(self._write(tmp, 'de.yml', 'a:\n  b: Hallo {name}\n  c: Tschüss\n'))
+      en = Locale(self._write(tmp, 'en.yml', 'a:\n  b: Hello {name}\n'))
+    assert de.name == 'de' and set(de.templates) == {'a.b', 'a.c'}
+    assert de.get('a.b', name='Welt') == 'Hallo Welt'
+    assert en.validate(de) == ['a.c']
+    assert en.get('a.c') == '<?>'
+
+  def test_use(self) -> None:
+    self.addCleanup(setattr, locale, '_gl', locale._gl)
+    self.addCleanup(setattr, locale, '_locales', dict(locale._locales))
+    locale._gl = None
+    with tempfile.TemporaryDirectory() as tmp:
+      locale.load(self._write(tmp, 'de.yml', 'a: Hallo\n'))
+      en = locale.load(self._write(tmp, 'en.yml', 'a: Hello\n'))
+    assert locale.get_locale('en-US') is en
+    assert locale.get('a') == 'Hallo'
+    with locale.use(locale.get_locale('en-US')):
+      assert locale.get('a') == 'Hello'
+    assert locale.get('a') == 'Hallo'
@@ -0,0 +1,93 @@
+
+"""
+A pool of processes to run CPU-bound parse functions (e.g. of HTML pages) in, so that they don't
+hold the GIL of the process that serves the Telegram commands and the metrics.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+import time
+import typing as t
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+T = t.TypeVar('T')
+
+
+def _timed_call(func: t.Callable[..., T], args: t.Tuple[t.Any, ...]) -> t.Tuple[T, float, float]:
+  started = time.time()
+  result = func(*args)
+  return result, started, time.time()
+
+
+class ParsePool:
+  """
+  Runs functions in a pool of *processes*, or in the calling thread if *processes* is zero. The
+  functions, their arguments and results must be picklable; functions must be defined at the
+  module level.
+
+  *on_parsed* is called with the name of the function, the number of seconds the call waited for
+  a process and the number of seconds the function ran.
+
+  The processes are started with the `spawn` method (forking a process with threads is unsafe)
+  when the first function is run. If a process dies, the pool is replaced.
+  """
+
+  def __init__(self,
+    processes: int = 0,
+    on_parsed: t.Optional[t.Callable[[str, float, float], None]] = None,
+  ) -> None:
+    self.processes = processes
+    self._on_parsed = on_parsed
+    self._lock = threading.Lock()
+    self._executor: t.Optional[concurrent.futures.ProcessPoolExecutor] = None
+    self._pending = 0
+
+  @property
+  def pending(self) -> int:
+    """ The number of calls that wait for a process or are running. """
+
+    return self._pending
+
+  def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+    with self._lock:
+      if self._executor is None:
+        self._executor = concurrent.futures.ProcessPoolExecutor(self.processes, multiprocessing.get_context('spawn'))
+      return self._executor
+
+  def run(self, func: t.Callable[..., T], *args: t.Any) -> T:
+    """
+    Calls *func* with *args* in a process of the pool and waits for the result.
+    """
+
+    if self.processes <= 0:
+      result, started, finished = _timed_call(func, args)
+      submitted = started
+    else:
+      executor = self._get_executor()
+      with self._lock:
+        self._pending += 1
+      try:
+        submitted = time.time()
+        result, started, finished = executor.submit(_timed_call, func, args).result()
+      except BrokenProcessPool:
+        logger.warning('A process of the parse pool died, replacing the pool.')
+        with self._lock:
+          if self._executor is executor:
+            self._executor = None
+        executor.shutdown(wait=False)
+        raise
+      finally:
+        with self._lock:
+          self._pending -= 1
+    if self._on_parsed:
+      self._on_parsed(func.__name__, max(0.0, started - submitted), finished - started)
+    return result
+
+  def shutdown(self) -> None:
+    with self._lock:
+      executor, self._executor = self._executor, None
+    if executor:
+      executor.shutdown()
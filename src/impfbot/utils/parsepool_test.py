@@ -0,0 +1,40 @@
+
+import os
+import typing as t
+from concurrent.futures.process import BrokenProcessPool
+from unittest import TestCase
+
+from .parsepool import ParsePool
+
+
+def _parse(text: str) -> t.Tuple[int, t.List[str]]:
+  return os.getpid(), text.split()
+
+
+def _crash() -> None:
+  os._exit(1)
+
+
+class ParsePoolTest(TestCase):
+
+  def setUp(self) -> None:
+    self.parsed: t.List[t.Tuple[str, float, float]] = []
+
+  def test_inline(self) -> None:
+    pool = ParsePool(0, lambda *a: self.parsed.append(a))
+    assert pool.run(_parse, 'a b') == (os.getpid(), ['a', 'b'])
+    assert [x[0] for x in self.parsed] == ['_parse']
+    assert self.parsed[0][1] == 0
+
+  def test_processes(self) -> None:
+    pool = ParsePool(2, lambda *a: self.parsed.append(a))
+    self.addCleanup(pool.shutdown)
+    pid, tokens = pool.run(_parse, 'a b')
+    assert pid != os.getpid() and tokens == ['a', 'b']
+    assert pool.pending == 0
+    assert [x[0] for x in self.parsed] == ['_parse']
+    assert all(x[1] >= 0 and x[2] >= 0 for x in self.parsed)
+
+    with self.assertRaises(BrokenProcessPool):
+      pool.run(_crash)
+    assert pool.run(_parse, 'c')[1] == ['c']
@@ -0,0 +1,101 @@
+
+"""
+Measures the time spent importing modules and in the phases of the bot's startup.
+"""
+
+import contextlib
+import importlib.abc
+import importlib.machinery
+import sys
+import threading
+import time
+import typing as t
+
+
+class _TimingLoader(importlib.abc.Loader):
+
+  def __init__(self, profiler: 'StartupProfiler', loader: t.Any) -> None:
+    self._profiler = profiler
+    self._loader = loader
+
+  def __getattr__(self, name: str) -> t.Any:
+    return getattr(self._loader, name)
+
+  def create_module(self, spec: importlib.machinery.ModuleSpec) -> t.Any:
+    return self._loader.create_module(spec)
+
+  def exec_module(self, module: t.Any) -> None:
+    with self._profiler._measure_import(module.__name__):
+      self._loader.exec_module(module)
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+
+  def __init__(self, profiler: 'StartupProfiler') -> None:
+    self._profiler = profiler
+
+  def find_spec(self, fullname, path, target=None):  # type: ignore
+    for finder in sys.meta_path:
+      if finder is self or not hasattr(finder, 'find_spec'):
+        continue
+      spec = finder.find_spec(fullname, path, target)
+      if spec is not None:
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+          spec.loader = _TimingLoader(self._profiler, spec.loader)
+        return spec
+    return None
+
+
+class StartupProfiler:
+  """
+  Records the time spent executing each imported module (excluding and including the modules it
+  imports in turn) and the time spent in named startup phases.
+  """
+
+  def __init__(self) -> None:
+    self.imports: t.Dict[str, t.Tuple[float, float]] = {}  #: Module name to (self, total) seconds.
+    self.phases: t.List[t.Tuple[str, float]] = []
+    self._finder = _TimingFinder(self)
+    self._local = threading.local()
+    self._started = time.perf_counter()
+
+  @contextlib.contextmanager
+  def _measure_import(self, name: str) -> t.Iterator[None]:
+    stack: t.List[float] = self._local.__dict__.setdefault('stack', [])
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      total = time.perf_counter() - start
+      children = stack.pop()
+      if stack:
+        stack[-1] += total
+      self.imports[name] = (total - children, total)
+
+  def install(self) -> None:
+    self._started = time.perf_counter()
+    sys.meta_path.insert(0, self._finder)
+
+  def uninstall(self) -> None:
+    if self._finder in sys.meta_path:
+      sys.meta_path.remove(self._finder)
+
+  @contextlib.contextmanager
+  def phase(self, name: str) -> t.Iterator[None]:
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.phases.append((name, time.perf_counter() - start))
+
+  def report(self, limit: int = 30) -> str:
+    lines = [f'Startup took {time.perf_counter() - self._started:.3f}s.', '', 'Phases:']
+    for name, seconds in self.phases:
+      lines.append(f'  {seconds:8.3f}s  {name}')
+    lines += ['', f'Imports (top {limit} by self time, {len(self.imports)} total):',
+              '      self     total  module']
+    imports = sorted(self.imports.items(), key=lambda x: x[1][0], reverse=True)
+    for name, (self_time, total) in imports[:limit]:
+      lines.append(f'  {self_time:7.3f}s  {total:7.3f}s  {name}')
+    return '\n'.join(lines)
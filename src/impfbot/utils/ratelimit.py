@@ -0,0 +1,151 @@
+
+"""
+Per-key rate limiting and coalescing of concurrent requests.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+import typing as t
+import cachetools
+
+from .cache import ICache
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+  """
+  A bucket that holds up to *capacity* tokens and refills at *rate* tokens per second.
+  """
+
+  __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+  def __init__(self, rate: float, capacity: float, now: float) -> None:
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = now
+
+  def try_acquire(self, now: float, tokens: float = 1.0) -> bool:
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+    if self.tokens >= tokens:
+      self.tokens -= tokens
+      return True
+    return False
+
+
+class RateLimiter:
+  """
+  Keeps a #TokenBucket per key. Buckets of keys that were not used for long enough to be full
+  again are evicted.
+  """
+
+  def __init__(self, rate: float, capacity: float, maxsize: int = 2**16,
+      clock: t.Callable[[], float] = time.monotonic) -> None:
+    self.rate = rate
+    self.capacity = capacity
+    self.clock = clock
+    self._lock = threading.Lock()
+    self._buckets: t.MutableMapping[t.Hashable, TokenBucket] = cachetools.TTLCache(
+      maxsize, ttl=capacity / rate, timer=clock)
+
+  def allow(self, key: t.Hashable) -> bool:
+    with self._lock:
+      now = self.clock()
+      bucket = self._buckets.get(key)
+      if bucket is None:
+        bucket = TokenBucket(self.rate, self.capacity, now)
+      allowed = bucket.try_acquire(now)
+      self._buckets[key] = bucket  # Refreshes the TTL.
+      return allowed
+
+
+class SharedRateLimiter(RateLimiter):
+  """
+  Counts the requests in a shared #ICache, so that the limit applies across all instances of the
+  bot. Instead of a token bucket, at most *capacity* requests are allowed in fixed windows of
+  `capacity / rate` seconds, which needs a single atomic increment per request. The *clock* must
+  be the same on all instances, hence it defaults to the wall clock.
+
+  If the cache fails, the request is checked against a token bucket in the process instead.
+  """
+
+  def __init__(self, rate: float, capacity: float, cache: ICache, prefix: str = 'ratelimit',
+      clock: t.Callable[[], float] = time.time) -> None:
+    super().__init__(rate, capacity, clock=clock)
+    self.prefix = prefix
+    self.window = capacity / rate
+    self._cache = cache
+
+  def allow(self, key: t.Hashable) -> bool:
+    window = int(self.clock() // self.window)
+    try:
+      count = self._cache.incr(f'{self.prefix}:{key}:{window}', ttl=self.window * 2)
+    except Exception as exc:
+      logger.warning('Unable to count the request in the cache, using the local rate limit: %s', exc)
+      return super().allow(key)
+    return count <= self.capacity
+
+
+class RequestGuard:
+  """
+  Rejects requests of a user that exceed the user's rate limit and requests that are identical
+  to a request of the same user that is still being processed.
+  """
+
+  RATE_LIMITED = 'rate_limited'
+  COALESCED = 'coalesced'
+
+  def __init__(self, limiter: RateLimiter, notify_interval: float = 60.0) -> None:
+    self._limiter = limiter
+    self._lock = threading.Lock()
+    self._in_flight: t.Set[t.Hashable] = set()
+    self._notified = t.cast(t.MutableMapping[t.Hashable, bool], cachetools.TTLCache(2**16, ttl=notify_interval))
+
+  @contextlib.contextmanager
+  def enter(self, user_id: t.Optional[int], request: t.Hashable) -> t.Iterator[t.Optional[str]]:
+    """
+    Yields `None` if the *request* of the user may be processed, or the reason why it was
+    rejected (#RATE_LIMITED or #COALESCED).
+    """
+
+    if user_id is None:
+      yield None
+      return
+
+    key = (user_id, request)
+    with self._lock:
+      if key in self._in_flight:
+        reason: t.Optional[str] = self.COALESCED
+      else:
+        reason = None
+        self._in_flight.add(key)
+
+    # The limiter may have to ask a shared cache, so it is not called while holding the lock.
+    if reason is None and not self._limiter.allow(user_id):
+      reason = self.RATE_LIMITED
+      with self._lock:
+        self._in_flight.discard(key)
+
+    if reason:
+      yield reason
+      return
+    try:
+      yield None
+    finally:
+      with self._lock:
+        self._in_flight.discard(key)
+
+  def should_notify(self, user_id: int) -> bool:
+    """
+    Returns True if the user should be told that they were rate limited, at most once per
+    notify interval.
+    """
+
+    with self._lock:
+      if user_id in self._notified:
+        return False
+      self._notified[user_id] = True
+      return True
@@ -0,0 +1,73 @@
+
+import typing as t
+from unittest import TestCase
+
+from .cache import LocalCache
+from .ratelimit import RateLimiter, RequestGuard, SharedRateLimiter
+
+
+class _FailingCache(LocalCache):
+
+  def incr(self, key: str, amount: int = 1, ttl: t.Optional[float] = None) -> int:
+    raise ConnectionError('cache is down')
+
+
+class RequestGuardTest(TestCase):
+
+  def setUp(self) -> None:
+    self.now = 0.0
+    self.guard = RequestGuard(RateLimiter(rate=1.0, capacity=2, clock=lambda: self.now))
+
+  def _enter(self, user_id: int, request: str):
+    with self.guard.enter(user_id, request) as rejected:
+      return rejected
+
+  def test_rate_limit(self) -> None:
+    assert self._enter(1, '/termine') is None
+    assert self._enter(1, '/termine') is None
+    assert self._enter(1, '/termine') == RequestGuard.RATE_LIMITED
+    assert self._enter(2, '/termine') is None
+    self.now = 1.0
+    assert self._enter(1, '/termine') is None
+
+  def test_coalesces_in_flight_requests(self) -> None:
+    with self.guard.enter(1, '/termine') as rejected:
+      assert rejected is None
+      assert self._enter(1, '/termine') == RequestGuard.COALESCED
+      assert self._enter(1, '/info') is None
+
+  def test_limiter_is_called_without_lock(self) -> None:
+    guard = self.guard
+    class _Limiter(RateLimiter):
+      def allow(self, key: t.Hashable) -> bool:
+        assert not guard._lock.locked()
+        return super().allow(key)
+    guard._limiter = _Limiter(rate=1.0, capacity=1)
+    assert self._enter(1, '/termine') is None
+    assert self._enter(1, '/termine') == RequestGuard.RATE_LIMITED
+    assert self._enter(1, '/termine') == RequestGuard.RATE_LIMITED
+
+  def test_should_notify_once(self) -> None:
+    assert self.guard.should_notify(1)
+    assert not self.guard.should_notify(1)
+
+
+class SharedRateLimiterTest(TestCase):
+
+  def test_limit_is_shared(self) -> None:
+    now = 10.0
+    cache = LocalCache()
+    first = SharedRateLimiter(rate=1.0, capacity=2, cache=cache, clock=lambda: now)
+    second = SharedRateLimiter(rate=1.0, capacity=2, cache=cache, clock=lambda: now)
+    assert first.allow(1)
+    assert second.allow(1)
+    assert not first.allow(1)
+    assert second.allow(2)
+    now = 12.0
+    assert first.allow(1)
+
+  def test_falls_back_to_local_limit(self) -> None:
+    limiter = SharedRateLimiter(rate=1.0, capacity=2, cache=_FailingCache())
+    assert limiter.allow(1)
+    assert limiter.allow(1)
+    assert not limiter.allow(1)
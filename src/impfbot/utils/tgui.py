@@ -12,6 +12,8 @@ from telegram import InlineKeyboardButton, Update, Message, CallbackQuery, User
 from telegram.inline.inlinekeyboardmarkup import InlineKeyboardMarkup
 from telegram.parsemode import ParseMode
 
+from .cache import ICache
+
 logger = logging.getLogger(__name__)
 
 
@@ -52,21 +54,29 @@ class IContext(metaclass=abc.ABCMeta):
 
 
 class DefaultActionStore(IActionStore):
+  """
+  Stores actions in a cache for *ttl* seconds. Actions hold callbacks that can not be serialized,
+  so the cache must keep the values in the process (e.g. a #LocalCache).
+  """
 
   # TODO(NiklasRosenstein): This should be combined with a cache that can drop all
   #   previously stored actions when a message view has been replaced with new
   #   actions to a memory leak.
 
-  def __init__(self, cache: t.MutableMapping) -> None:
+  def __init__(self, cache: ICache, ttl: t.Optional[float] = None) -> None:
     self._cache = cache
+    self._ttl = ttl
 
   def save_action(self, action: 'Action') -> str:
     k = str(id(action))
-    self._cache[k] = action
+    self._cache.set(k, action, self._ttl)
     return k
 
   def get_action(self, action_id: str) -> 'Action':
-    return self._cache[action_id]
+    action = self._cache.get(action_id)
+    if action is None:
+      raise KeyError(action_id)
+    return action
 
 
 class DefaultContext(IContext):
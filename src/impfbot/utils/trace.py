@@ -0,0 +1,249 @@
+
+"""
+Lightweight tracing to follow availability data from polling a vaccination center to sending the
+notifications. The current span is kept per thread; to continue a trace in another thread, pass
+the #SpanContext of the parent explicitly.
+
+Traces are sampled at the root span, so that all spans of a trace are either recorded or not.
+With the default sample rate of zero, starting a span is close to free.
+
+```py
+from impfbot.utils import trace
+
+trace.configure(JsonFileExporter('traces.jsonl'), sample_rate=0.01)
+with trace.span('poll', center_id=center_id) as span:
+  ...
+```
+"""
+
+import abc
+import contextlib
+import json
+import logging
+import random
+import threading
+import time
+import typing as t
+import requests
+
+from .local import LocalList
+
+logger = logging.getLogger(__name__)
+
+
+class SpanContext(t.NamedTuple):
+  trace_id: str
+  span_id: str
+  sampled: bool
+
+
+_UNSAMPLED = SpanContext('', '', False)
+
+
+class Span:
+
+  __slots__ = ('name', 'context', 'parent_id', 'start_ns', 'end_ns', 'attributes')
+
+  def __init__(self, name: str, context: SpanContext, parent_id: t.Optional[str], attributes: t.Dict[str, t.Any]) -> None:
+    self.name = name
+    self.context = context
+    self.parent_id = parent_id
+    self.start_ns = time.time_ns()
+    self.end_ns: t.Optional[int] = None
+    self.attributes = attributes
+
+  def __repr__(self) -> str:
+    return f'Span(name={self.name!r}, context={self.context!r}, parent_id={self.parent_id!r})'
+
+  def set_attribute(self, key: str, value: t.Any) -> None:
+    if self.context.sampled:
+      self.attributes[key] = value
+
+  def to_json(self) -> t.Dict[str, t.Any]:
+    return {
+      'name': self.name,
+      'trace_id': self.context.trace_id,
+      'span_id': self.context.span_id,
+      'parent_id': self.parent_id,
+      'start_ns': self.start_ns,
+      'end_ns': self.end_ns,
+      'attributes': self.attributes,
+    }
+
+
+class ISpanExporter(metaclass=abc.ABCMeta):
+
+  @abc.abstractmethod
+  def export(self, spans: t.List[Span]) -> None: ...
+
+
+class JsonFileExporter(ISpanExporter):
+  """
+  Appends the spans to a file, one JSON object per line.
+  """
+
+  def __init__(self, filename: str) -> None:
+    self.filename = filename
+
+  def export(self, spans: t.List[Span]) -> None:
+    with open(self.filename, 'a', encoding='utf8') as fp:
+      for span in spans:
+        fp.write(json.dumps(span.to_json(), default=str) + '\n')
+
+
+class OtlpHttpExporter(ISpanExporter):
+  """
+  Sends the spans to an OpenTelemetry collector using OTLP/HTTP with JSON encoding.
+  """
+
+  def __init__(self, endpoint: str = 'http://localhost:4318/v1/traces', service_name: str = 'impfbot',
+      timeout: float = 5.0) -> None:
+    self.endpoint = endpoint
+    self.service_name = service_name
+    self.timeout = timeout
+    self._session = requests.Session()
+
+  @staticmethod
+  def _value(value: t.Any) -> t.Dict[str, t.Any]:
+    if isinstance(value, bool):
+      return {'boolValue': value}
+    if isinstance(value, int):
+      return {'intValue': str(value)}
+    if isinstance(value, float):
+      return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+  def to_otlp_json(self, spans: t.List[Span]) -> t.Dict[str, t.Any]:
+    return {'resourceSpans': [{
+      'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+      'scopeSpans': [{
+        'scope': {'name': 'impfbot'},
+        'spans': [{
+          'traceId': span.context.trace_id,
+          'spanId': span.context.span_id,
+          'parentSpanId': span.parent_id or '',
+          'name': span.name,
+          'kind': 1,  # SPAN_KIND_INTERNAL
+          'startTimeUnixNano': str(span.start_ns),
+          'endTimeUnixNano': str(span.end_ns),
+          'attributes': [{'key': k, 'value': self._value(v)} for k, v in span.attributes.items()],
+        } for span in spans],
+      }],
+    }]}
+
+  def export(self, spans: t.List[Span]) -> None:
+    response = self._session.post(self.endpoint, json=self.to_otlp_json(spans), timeout=self.timeout)
+    response.raise_for_status()
+
+
+class Tracer:
+  """
+  Creates spans and exports the finished spans of sampled traces in batches from a background
+  thread every *flush_interval* seconds. At most *max_queue_size* spans are buffered, further
+  spans are dropped and counted in #dropped.
+  """
+
+  def __init__(self,
+    exporter: t.Optional[ISpanExporter] = None,
+    sample_rate: float = 0.0,
+    flush_interval: float = 5.0,
+    max_queue_size: int = 2048,
+  ) -> None:
+
+    self.exporter = exporter
+    self.sample_rate = sample_rate if exporter else 0.0
+    self.flush_interval = flush_interval
+    self.max_queue_size = max_queue_size
+    self.dropped = 0
+    self._stack = LocalList[Span]()
+    self._lock = threading.Lock()
+    self._buffer: t.List[Span] = []
+    self._thread: t.Optional[threading.Thread] = None
+    self._random = random.Random()
+
+  def current_context(self) -> t.Optional[SpanContext]:
+    return self._stack.last().context if self._stack else None
+
+  @contextlib.contextmanager
+  def start_span(self,
+    name: str,
+    parent: t.Optional[SpanContext] = None,
+    child_only: bool = False,
+    **attributes: t.Any,
+  ) -> t.Iterator[Span]:
+    """
+    Starts a span as a child of *parent*, or of the current span of the thread. Without a parent,
+    a new trace is started, unless *child_only* is set (in which case the span is not recorded).
+    """
+
+    if parent is None and self._stack:
+      parent = self._stack.last().context
+    if parent is None:
+      if not child_only and self.sample_rate > 0 and self._random.random() < self.sample_rate:
+        context = SpanContext(f'{self._random.getrandbits(128):032x}', f'{self._random.getrandbits(64):016x}', True)
+      else:
+        context = _UNSAMPLED
+    elif parent.sampled:
+      context = SpanContext(parent.trace_id, f'{self._random.getrandbits(64):016x}', True)
+    else:
+      context = parent
+
+    span = Span(name, context, parent.span_id if parent else None, attributes if context.sampled else {})
+    self._stack.append(span)
+    try:
+      yield span
+    finally:
+      self._stack.pop()
+      if context.sampled:
+        span.end_ns = time.time_ns()
+        self._finish(span)
+
+  def _finish(self, span: Span) -> None:
+    with self._lock:
+      if len(self._buffer) >= self.max_queue_size:
+        self.dropped += 1
+        return
+      self._buffer.append(span)
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='Tracer', daemon=True)
+        self._thread.start()
+
+  def _run(self) -> None:
+    while True:
+      time.sleep(self.flush_interval)
+      self.flush()
+
+  def flush(self) -> None:
+    with self._lock:
+      spans, self._buffer = self._buffer, []
+    if spans and self.exporter:
+      try:
+        self.exporter.export(spans)
+      except Exception:
+        logger.exception('Could not export %d span(s).', len(spans))
+
+
+_tracer = Tracer()
+
+
+def configure(exporter: t.Optional[ISpanExporter], sample_rate: float, **kwargs: t.Any) -> Tracer:
+  """
+  Replaces the global tracer.
+  """
+
+  global _tracer
+  _tracer.flush()
+  _tracer = Tracer(exporter, sample_rate, **kwargs)
+  return _tracer
+
+
+def get_tracer() -> Tracer:
+  return _tracer
+
+
+def span(name: str, parent: t.Optional[SpanContext] = None, child_only: bool = False, **attributes: t.Any) -> t.ContextManager[Span]:
+  return _tracer.start_span(name, parent, child_only, **attributes)
+
+
+def current_context() -> t.Optional[SpanContext]:
+  return _tracer.current_context()
@@ -0,0 +1,77 @@
+
+import json
+import os
+import tempfile
+import threading
+import typing as t
+from unittest import TestCase
+
+from .trace import ISpanExporter, JsonFileExporter, OtlpHttpExporter, Span, Tracer
+
+
+class _Exporter(ISpanExporter):
+
+  def __init__(self) -> None:
+    self.spans: t.List[Span] = []
+
+  def export(self, spans: t.List[Span]) -> None:
+    self.spans += spans
+
+
+class TracerTest(TestCase):
+
+  def test_nested_and_cross_thread_spans(self) -> None:
+    exporter = _Exporter()
+    tracer = Tracer(exporter, sample_rate=1.0)
+    with tracer.start_span('poll', center_id='abc') as root:
+      with tracer.start_span('dispatch') as child:
+        child.set_attribute('users', 3)
+        context = tracer.current_context()
+    assert tracer.current_context() is None
+
+    def _send() -> None:
+      with tracer.start_span('send_message', context, child_only=True):
+        pass
+    thread = threading.Thread(target=_send)
+    thread.start()
+    thread.join()
+
+    tracer.flush()
+    spans = {s.name: s for s in exporter.spans}
+    assert spans.keys() == {'poll', 'dispatch', 'send_message'}
+    assert {s.context.trace_id for s in spans.values()} == {root.context.trace_id}
+    assert spans['poll'].parent_id is None and spans['poll'].attributes == {'center_id': 'abc'}
+    assert spans['dispatch'].parent_id == root.context.span_id
+    assert spans['dispatch'].attributes == {'users': 3}
+    assert spans['send_message'].parent_id == child.context.span_id
+    assert all(s.end_ns and s.end_ns >= s.start_ns for s in spans.values())
+
+  def test_sampling(self) -> None:
+    exporter = _Exporter()
+    tracer = Tracer(exporter, sample_rate=0.0)
+    with tracer.start_span('poll'):
+      with tracer.start_span('dispatch'):
+        context = tracer.current_context()
+    assert context is not None and not context.sampled
+    tracer.sample_rate = 1.0
+    with tracer.start_span('send_message', context):
+      pass
+    with tracer.start_span('send_message', None, child_only=True):
+      pass
+    tracer.flush()
+    assert exporter.spans == []
+
+  def test_exporters(self) -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+      filename = os.path.join(tempdir, 'traces.jsonl')
+      tracer = Tracer(JsonFileExporter(filename), sample_rate=1.0)
+      with tracer.start_span('poll', center_id='abc') as span:
+        pass
+      tracer.flush()
+      with open(filename) as fp:
+        assert [json.loads(line)['name'] for line in fp] == ['poll']
+
+    payload = OtlpHttpExporter().to_otlp_json([span])
+    otlp_span = payload['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert otlp_span['traceId'] == span.context.trace_id and len(otlp_span['traceId']) == 32
+    assert otlp_span['attributes'] == [{'key': 'center_id', 'value': {'stringValue': 'abc'}}]
@@ -0,0 +1,138 @@
+
+"""
+Work queues with a fixed number of worker threads each, used to keep classes of work (interactive
+commands, notifications, broadcasts) from starving each other.
+"""
+
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueueFull(Exception):
+  pass
+
+
+class _Job(t.NamedTuple):
+  future: 'concurrent.futures.Future[t.Any]'
+  func: t.Callable[..., t.Any]
+  args: t.Tuple[t.Any, ...]
+  kwargs: t.Dict[str, t.Any]
+  submitted: float
+
+
+class WorkQueue(concurrent.futures.Executor):
+  """
+  A FIFO of jobs that is processed by up to *workers* threads. Jobs are rejected with
+  #WorkQueueFull when *maxsize* jobs are already waiting (zero means unbounded). The worker
+  threads are started on the first submit.
+
+  *on_job_started* is called with the name of the queue and the number of seconds the job waited
+  in the queue before a worker picked it up.
+  """
+
+  def __init__(self,
+    name: str,
+    workers: int,
+    maxsize: int = 0,
+    on_job_started: t.Optional[t.Callable[[str, float], None]] = None,
+  ) -> None:
+
+    assert workers > 0, workers
+    self.name = name
+    self.workers = workers
+    self._queue: 'queue.Queue[t.Optional[_Job]]' = queue.Queue(maxsize)
+    self._on_job_started = on_job_started
+    self._lock = threading.Lock()
+    self._threads: t.List[threading.Thread] = []
+    self._shutdown = False
+    self._active = 0
+
+  @property
+  def depth(self) -> int:
+    """ The number of jobs waiting for a worker. """
+
+    return self._queue.qsize()
+
+  @property
+  def active(self) -> int:
+    """ The number of jobs that are currently being processed. """
+
+    return self._active
+
+  def submit(self, func: t.Callable[..., t.Any], *args: t.Any, **kwargs: t.Any) -> 'concurrent.futures.Future[t.Any]':  # type: ignore[override]
+    with self._lock:
+      if self._shutdown:
+        raise RuntimeError(f'WorkQueue {self.name!r} is shut down')
+      if not self._threads:
+        for i in range(self.workers):
+          thread = threading.Thread(target=self._worker, name=f'{self.name}-{i}', daemon=True)
+          thread.start()
+          self._threads.append(thread)
+    future: 'concurrent.futures.Future[t.Any]' = concurrent.futures.Future()
+    try:
+      self._queue.put_nowait(_Job(future, func, args, kwargs, time.perf_counter()))
+    except queue.Full:
+      raise WorkQueueFull(f'WorkQueue {self.name!r} is full ({self._queue.maxsize} jobs waiting)')
+    return future
+
+  def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+    with self._lock:
+      self._shutdown = True
+      threads = list(self._threads)
+    if cancel_futures:
+      while True:
+        try:
+          job = self._queue.get_nowait()
+        except queue.Empty:
+          break
+        if job:
+          job.future.cancel()
+        self._queue.task_done()
+    for _ in threads:
+      self._queue.put(None)
+    if wait:
+      for thread in threads:
+        thread.join()
+
+  def join(self, timeout: t.Optional[float] = None) -> bool:
+    """
+    Waits until all submitted jobs are done. Returns False if the *timeout* expired first.
+    """
+
+    with self._queue.all_tasks_done:
+      return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+  def _worker(self) -> None:
+    while True:
+      job = self._queue.get()
+      if job is None:
+        self._queue.task_done()
+        break
+      try:
+        self._run(job)
+      finally:
+        self._queue.task_done()
+
+  def _run(self, job: _Job) -> None:
+    if not job.future.set_running_or_notify_cancel():
+      return
+    if self._on_job_started:
+      self._on_job_started(self.name, time.perf_counter() - job.submitted)
+    with self._lock:
+      self._active += 1
+    try:
+      result = job.func(*job.args, **job.kwargs)
+    except BaseException as exc:
+      logger.exception('An unhandled exception occurred in a job of WorkQueue %r.', self.name)
+      job.future.set_exception(exc)
+    else:
+      job.future.set_result(result)
+    finally:
+      with self._lock:
+        self._active -= 1
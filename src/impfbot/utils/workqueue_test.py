@@ -0,0 +1,59 @@
+
+import threading
+import time
+from unittest import TestCase
+
+from .workqueue import WorkQueue, WorkQueueFull
+
+
+class WorkQueueTest(TestCase):
+
+  def test_submit(self) -> None:
+    waits = []
+    wq = WorkQueue('test', 2, on_job_started=lambda name, seconds: waits.append((name, seconds)))
+    futures = [wq.submit(lambda x: x * 2, i) for i in range(10)]
+    assert [f.result(timeout=5) for f in futures] == [i * 2 for i in range(10)]
+    wq.shutdown()
+    assert len(waits) == 10 and all(name == 'test' for name, _ in waits)
+
+  def test_exception_is_set_on_future(self) -> None:
+    wq = WorkQueue('test', 1)
+    future = wq.submit(lambda: 1 / 0)
+    with self.assertRaises(ZeroDivisionError):
+      future.result(timeout=5)
+    wq.shutdown()
+
+  def test_join(self) -> None:
+    release = threading.Event()
+    wq = WorkQueue('test', 2)
+    for _ in range(3):
+      wq.submit(release.wait)
+    assert not wq.join(timeout=0.01)
+    release.set()
+    assert wq.join(timeout=5)
+    assert wq.depth == 0 and wq.active == 0
+    wq.shutdown()
+
+  def test_full(self) -> None:
+    release = threading.Event()
+    wq = WorkQueue('test', 1, maxsize=1)
+    wq.submit(release.wait)
+    while wq.active == 0:
+      time.sleep(0.001)
+    wq.submit(lambda: None)
+    assert wq.depth == 1
+    with self.assertRaises(WorkQueueFull):
+      wq.submit(lambda: None)
+    release.set()
+    wq.shutdown()
+    assert wq.depth == 0 and wq.active == 0
+
+  def test_queues_do_not_block_each_other(self) -> None:
+    release = threading.Event()
+    background = WorkQueue('background', 1)
+    interactive = WorkQueue('interactive', 1)
+    background.submit(release.wait)
+    assert interactive.submit(lambda: 42).result(timeout=5) == 42
+    release.set()
+    background.shutdown()
+    interactive.shutdown()